@@ -1,8 +1,9 @@
-from flask import Flask, request, jsonify, session
+from flask import Flask, request, jsonify, session, Response, stream_with_context
 from flask_cors import CORS
 from flask_session import Session
 import logging
 import os
+import click
 from dotenv import load_dotenv
 from database import (
     create_connection,
@@ -13,6 +14,27 @@ from database import (
     TABLES,
     DB_CONFIG,
     save_historical_data,
+    iter_historical_record_chunks,
+    fetch_daily_demand,
+    iter_daily_demand_batches,
+    has_daily_demand,
+    fetch_data_version,
+    rebuild_daily_demand,
+    refresh_forecast_states,
+    refresh_forecast_store,
+    fetch_fitted_params,
+    save_fitted_params,
+    fetch_stored_forecasts,
+    fetch_historical_page,
+    fetch_historical_record_page,
+    count_historical_records,
+    run_with_count,
+    COUNT_MODES,
+    decode_page_cursor,
+    fetch_inventory_item_settings,
+    save_inventory_item_settings,
+    bulk_load_historical_data,
+    FORECAST_STORE_CONFIG,
     get_db
 )
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -28,21 +50,46 @@ import concurrent.futures
 import mysql.connector
 from mysql.connector import Error
 import numpy as np
-from sklearn.linear_model import LinearRegression
 import re
 import random
-from dateutil import parser
 from sklearn.preprocessing import StandardScaler
 import time
-import math
-import hashlib
 import sys
 import traceback
 import uuid
+import copy
 import google.generativeai as genai
 import googlemaps
 from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
+from route_jobs import job_manager, stream_job_events, JobCancelled, Deadline
+from cache import TTLCache, make_cache_key
+from data_quality import validate_stock_data, validate_import_records
+from forecasting import (
+    DailyDemandAggregator,
+    DemandSeries,
+    forecast_demand_matrix,
+    select_models,
+    series_fingerprints,
+    FORECAST_MODELS,
+    DEFAULT_FORECAST_MODEL,
+    DEFAULT_SEASON_LENGTH,
+    DEFAULT_QUANTILES,
+    AUTO_FORECAST_MODEL
+)
+from demand_records import public_record, public_payload
+from exports import iter_ndjson, iter_csv, iter_chunks, export_filename, EXPORT_MIMETYPES, CSV_PREVIEW_CHUNK_SIZE
+from inventory_optimization import optimize_inventory_policies, validate_item_settings
+from inventory_simulation import (
+    simulate_inventory_policies,
+    simulation_results,
+    validate_candidates,
+    location_shares,
+    SIMULATION_CONFIG
+)
+from migrations import migrate, migration_status, MIGRATIONS, LATEST_VERSION
+from mock_data import generate_mock_demand, mock_daily_totals, iter_synthetic_movements, MOCK_DATA_SEED
+from multi_echelon import allocate_safety_stock, build_network, validate_network, MULTI_ECHELON_CONFIG
 
 # Configure logging
 logging.basicConfig(
@@ -79,6 +126,57 @@ genai.configure(api_key=GEMINI_API_KEY)
 # Configure Google Maps API
 GOOGLE_MAPS_API_KEY = os.getenv('GOOGLE_MAPS_API_KEY')
 
+# Cache of completed route optimizations, keyed by the canonical request
+route_result_cache = TTLCache(
+    max_entries=int(os.getenv('ROUTE_CACHE_MAX_ENTRIES', 256)),
+    ttl_seconds=int(os.getenv('ROUTE_CACHE_TTL_SECONDS', 900))
+)
+
+# Directions API responses keyed by ordered waypoints
+directions_cache = TTLCache(
+    max_entries=int(os.getenv('DIRECTIONS_CACHE_MAX_ENTRIES', 512)),
+    ttl_seconds=int(os.getenv('DIRECTIONS_CACHE_TTL_SECONDS', 3600))
+)
+
+# Matrices and routes of recent solutions, for incremental re-optimization;
+# at least as large and long-lived as the result cache, whose entries refer
+# to a stored solution (cache hits in another destination order add one more)
+route_solution_store = TTLCache(
+    max_entries=max(int(os.getenv('ROUTE_SOLUTION_MAX_ENTRIES', 512)), 2 * route_result_cache.max_entries),
+    ttl_seconds=max(int(os.getenv('ROUTE_SOLUTION_TTL_SECONDS', 14400)), route_result_cache.ttl_seconds)
+)
+
+# Winning forecast model per (user, SKU, horizon, season length), valid while the SKU's series is unchanged
+model_selection_cache = TTLCache(
+    max_entries=int(os.getenv('MODEL_SELECTION_CACHE_MAX_ENTRIES', 50000)),
+    ttl_seconds=int(os.getenv('MODEL_SELECTION_CACHE_TTL_SECONDS', 7 * 86400))
+)
+
+# Read-through layer over the forecast_fits table: fitted parameters per
+# (user, SKU, model, season length), valid while the SKU's series is unchanged
+forecast_model_cache = TTLCache(
+    max_entries=int(os.getenv('FORECAST_MODEL_CACHE_MAX_ENTRIES', 100000)),
+    ttl_seconds=int(os.getenv('FORECAST_MODEL_CACHE_TTL_SECONDS', 7 * 86400))
+)
+
+# Complete forecast responses keyed by the request and the user's data version
+forecast_response_cache = TTLCache(
+    max_entries=int(os.getenv('FORECAST_RESPONSE_CACHE_MAX_ENTRIES', 128)),
+    ttl_seconds=int(os.getenv('FORECAST_RESPONSE_CACHE_TTL_SECONDS', 3600))
+)
+
+# Seeded demo demand per (start, end, seed), shown to tenants without history
+mock_demand_cache = TTLCache(
+    max_entries=int(os.getenv('MOCK_DATA_CACHE_MAX_ENTRIES', 64)),
+    ttl_seconds=int(os.getenv('MOCK_DATA_CACHE_TTL_SECONDS', 86400))
+)
+
+# History row counts keyed by the filters and the user's data version
+row_count_cache = TTLCache(
+    max_entries=int(os.getenv('ROW_COUNT_CACHE_MAX_ENTRIES', 1024)),
+    ttl_seconds=int(os.getenv('ROW_COUNT_CACHE_TTL_SECONDS', 3600))
+)
+
 # Initialize Flask app
 app = Flask(__name__, static_folder='build', static_url_path='/')
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-here')
@@ -140,6 +238,22 @@ def health_check():
             {'status': 'unhealthy', 'database': 'disconnected', 'error': str(e)}), 500
 
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Runtime counters for caches and background jobs"""
+    return jsonify({
+        'route_result_cache': route_result_cache.stats(),
+        'route_solution_store': route_solution_store.stats(),
+        'directions_cache': directions_cache.stats(),
+        'model_selection_cache': model_selection_cache.stats(),
+        'forecast_model_cache': forecast_model_cache.stats(),
+        'forecast_response_cache': forecast_response_cache.stats(),
+        'mock_demand_cache': mock_demand_cache.stats(),
+        'row_count_cache': row_count_cache.stats(),
+        'route_jobs': job_manager.stats()
+    }), 200
+
+
 @app.route('/register', methods=['POST'])
 def register():
     """User registration endpoint"""
@@ -828,34 +942,81 @@ def inventory_settings():
             {'message': 'Inventory settings saved successfully'}), 200
 
 
+@app.route('/api/settings/inventory/items', methods=['GET', 'POST'])
+def inventory_item_settings():
+    """Per-SKU/location cost and service settings used by inventory optimization ('*' matches any)."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    user_id = session['user_id']
+
+    if request.method == 'GET':
+        settings = fetch_inventory_item_settings(
+            user_id, request.args.get('product_id'), request.args.get('location'))
+        return jsonify({'items': settings}), 200
+
+    data = request.get_json(silent=True) or {}
+    items, error = validate_item_settings(data.get('items'))
+    if error:
+        return jsonify({'error': error}), 400
+    try:
+        saved = save_inventory_item_settings(user_id, items)
+    except Exception as e:
+        logger.error(f"Error saving inventory item settings: {str(e)}")
+        return jsonify({'error': 'Failed to save inventory item settings'}), 500
+    return jsonify({'message': 'Inventory item settings saved successfully', 'saved': saved}), 200
+
+
+def history_page_params(default_limit=100, max_limit=1000):
+    """
+    Page size, cursor and date filters of the paginated history endpoints.
+
+    Returns (params, error) where params holds limit, after, start_date and
+    end_date for fetch_historical_page and error a message or None.
+    """
+    params = {
+        'limit': min(max(request.args.get('limit', default_limit, type=int), 1), max_limit),
+        'after': request.args.get('cursor') or None,
+        'start_date': request.args.get('start_date') or None,
+        'end_date': request.args.get('end_date') or None
+    }
+    for key in ('start_date', 'end_date'):
+        if params[key]:
+            try:
+                datetime.strptime(params[key], '%Y-%m-%d')
+            except ValueError:
+                return None, f'{key} must be a YYYY-MM-DD date'
+    if params['after']:
+        try:
+            decode_page_cursor(params['after'])
+        except ValueError:
+            return None, 'Invalid cursor'
+    return params, None
+
+
 @app.route('/api/import/data', methods=['GET'])
 def get_imported_data():
-    """Get imported historical data from MySQL database"""
+    """
+    Get imported historical data from MySQL database, newest first
+    ---
+    Pages over stored imports (historical_data rows), each returned with
+    all its records; see /api/import/<source>/history for record pages.
+    Query parameters:
+    - source: optional source filter
+    - start_date, end_date: optional YYYY-MM-DD range of the import date
+    - limit: imports per page (default 100, max 1000)
+    - cursor: next_cursor of the previous page
+    """
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
 
     user_id = session['user_id']
+    page, error = history_page_params()
+    if error:
+        return jsonify({'error': error}), 400
 
     try:
-        # Get the last 100 records for the user, grouped by source
-        query = """
-            SELECT
-                hd.id,
-                hd.user_id,
-                hd.data,
-                hd.date,
-                hd.company_id,
-                hd.source,
-                hd.created_at,
-                hd.updated_at,
-                COUNT(*) OVER (PARTITION BY hd.source) as source_count
-            FROM historical_data hd
-            WHERE hd.user_id = %s
-            ORDER BY hd.date DESC
-            LIMIT 100
-        """
-
-        data = fetch_all(query, (user_id,))
+        data, next_cursor = fetch_historical_page(user_id, request.args.get('source'), **page)
 
         # Process and format the data
         formatted_data = []
@@ -875,7 +1036,7 @@ def get_imported_data():
                     'date': record['date'],
                     'source': record['source'],
                     'company_id': record['company_id'],
-                    'data': data_content,
+                    'data': public_payload(data_content),
                     'created_at': record['created_at'],
                     'updated_at': record['updated_at']
                 }
@@ -918,7 +1079,8 @@ def get_imported_data():
         return jsonify({
             'data': formatted_data,
             'source_stats': source_stats,
-            'total_records': len(formatted_data)
+            'total_records': len(formatted_data),
+            'next_cursor': next_cursor
         }), 200
 
     except Exception as e:
@@ -1030,9 +1192,16 @@ def import_odoo_data():
                     'error': 'No data found in the selected date range. Please verify your Odoo data or try a different date range.'
                 }), 404
 
-            # Process and save the data
-            save_historical_data(user_id, warehouse_data, 'odoo')
-            save_historical_data(user_id, retailer_data, 'odoo')
+            validation = validate_stock_data(warehouse_data + retailer_data)
+            if validation['issues']:
+                logger.warning(f"Odoo import for user {user_id}: {validation['stats']['invalid_moves']} of "
+                               f"{validation['stats']['total_moves']} stock moves failed validation "
+                               f"({'; '.join(validation['issues'])})")
+
+            # Process and save the data (a single save, since Odoo imports replace the source's data)
+            quality = save_historical_data(warehouse_data + retailer_data, 'odoo', user_id)
+            if not quality:
+                return jsonify({'error': 'Failed to save data', 'validation': validation}), 500
 
             return jsonify({
                 'message': 'Data imported successfully',
@@ -1040,6 +1209,8 @@ def import_odoo_data():
                 'retailer_records': len(retailer_data),
                 'warehouse_total': warehouse_total,
                 'retailer_total': retailer_total,
+                'validation': validation,
+                'quality': quality,
                 'note': 'Processed first 50 records for each type, while preserving total count information'
             }), 200
 
@@ -1087,11 +1258,14 @@ def import_zoho_data():
             setting['api_key'])
 
         # Process and save the data
-        save_historical_data(user_id, zoho_data, 'zoho')
+        quality = save_historical_data(zoho_data, 'zoho', user_id)
+        if not quality:
+            return jsonify({'error': 'Failed to save data'}), 500
 
         return jsonify({
             'message': 'Data imported successfully',
-            'records': len(zoho_data)
+            'records': len(zoho_data),
+            'quality': quality
         }), 200
 
     except Exception as e:
@@ -1099,9 +1273,58 @@ def import_zoho_data():
         return jsonify({'error': f'Failed to import data: {str(e)}'}), 500
 
 
+def csv_upload_records(file):
+    """
+    Records in the format expected by the frontend table, one per row of an uploaded CSV.
+
+    The upload is read right away (it is closed with the request, before a
+    streamed response is sent); records are built lazily while iterating.
+    """
+    stream = StringIO(file.stream.read().decode("UTF8"), newline=None)
+    return (csv_row_record(row) for row in csv.DictReader(stream))
+
+
+def csv_row_record(row):
+    """Record of one uploaded CSV row."""
+    return {
+        'date': row.get('date', datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
+        'data': {
+            'product': row.get('product', ''),
+            'location': row.get('location', ''),
+            'quantity': row.get('quantity', '0'),
+            'type': row.get('type', 'warehouse')
+        },
+        'company_id': row.get('company_id', '1'),
+        'source_specific': {
+            'csv_fields': {k: v for k, v in row.items()
+                           if k not in ['date', 'product', 'location', 'quantity', 'type', 'company_id']}
+        }
+    }
+
+
+def stream_export(chunks, export_format, filename=None, trailer=None):
+    """
+    Streaming response of record chunks as NDJSON or CSV.
+
+    Chunks are encoded and sent as they are produced, so the first byte goes
+    out right away and memory stays flat however long the export is.
+    trailer (NDJSON only) adds a final summary line, see iter_ndjson.
+    """
+    body = iter_ndjson(chunks, trailer) if export_format == 'ndjson' else iter_csv(chunks)
+    headers = {'X-Accel-Buffering': 'no'}
+    if filename:
+        headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return Response(stream_with_context(body), mimetype=EXPORT_MIMETYPES[export_format], headers=headers)
+
+
 @app.route('/api/import/csv', methods=['POST'])
 def handle_csv_data():
-    """Handle CSV data import with optimized processing"""
+    """
+    Handle CSV data import with optimized processing
+
+    Previews are returned as JSON with a quality report, or streamed as
+    NDJSON records plus a final {"total_records"} line with format=ndjson.
+    """
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
 
@@ -1118,68 +1341,28 @@ def handle_csv_data():
         return jsonify({'error': 'File must be a CSV'}), 400
 
     try:
-        # Process CSV in chunks for better memory usage
-        chunk_size = 1000
-        formatted_data = []
-
-        # Read CSV in chunks
-        stream = StringIO(file.stream.read().decode("UTF8"), newline=None)
-        reader = csv.DictReader(stream)
-
-        chunk = []
-        for row in reader:
-            # Create a record in the format expected by the frontend table
-            record = {
-                'date': row.get(
-                    'date',
-                    datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
-                'data': {
-                    'product': row.get(
-                        'product',
-                        ''),
-                    'location': row.get(
-                        'location',
-                        ''),
-                    'quantity': row.get(
-                        'quantity',
-                        '0'),
-                    'type': row.get(
-                        'type',
-                        'warehouse')},
-                'company_id': row.get(
-                    'company_id',
-                    '1'),
-                'source_specific': {
-                    'csv_fields': {
-                        k: v for k,
-                        v in row.items() if k not in [
-                            'date',
-                            'product',
-                            'location',
-                            'quantity',
-                            'type',
-                            'company_id']}}}
-
-            chunk.append(record)
-
-            if len(chunk) >= chunk_size:
-                formatted_data.extend(chunk)
-                chunk = []
-
-        if chunk:
-            formatted_data.extend(chunk)
+        # Records are built lazily from the uploaded file; previews can stream them
+        records = csv_upload_records(file)
+        if request.args.get('save') != 'true' and request.args.get('format') == 'ndjson':
+            return stream_export(iter_chunks(records, CSV_PREVIEW_CHUNK_SIZE), 'ndjson',
+                                 trailer=lambda total: {'total_records': total})
+        formatted_data = list(records)
 
         # If save parameter is present, save the data
         if request.args.get('save') == 'true':
-            save_historical_data(formatted_data, 'csv', user_id)
+            quality = save_historical_data(formatted_data, 'csv', user_id)
+            if not quality:
+                return jsonify({'error': 'Failed to save data'}), 500
             return jsonify({
                 'message': 'Data imported and saved successfully',
-                'total_records': len(formatted_data)
+                'total_records': len(formatted_data),
+                'quality': quality
             }), 200
 
         return jsonify({
             'data': formatted_data,
-            'total_records': len(formatted_data)
+            'total_records': len(formatted_data),
+            'quality': validate_import_records(formatted_data)
         }), 200
 
     except Exception as e:
@@ -1211,8 +1394,9 @@ def save_source_data(source):
             return jsonify({'error': 'No records to save'}), 400
 
         # Save the data using the new function
-        if save_historical_data(source_data, source, user_id):
-            return jsonify({'message': 'Data saved successfully'})
+        quality = save_historical_data(source_data, source, user_id)
+        if quality:
+            return jsonify({'message': 'Data saved successfully', 'quality': quality})
         else:
             return jsonify({'error': 'Failed to save data'}), 500
 
@@ -1223,35 +1407,26 @@ def save_source_data(source):
 
 @app.route('/api/import/<source>/data', methods=['GET'])
 def get_source_data(source):
-    """Get imported data for a specific source with efficient JSON handling"""
+    """
+    Get imported data for a specific source with efficient JSON handling
+    ---
+    Query parameters as for /api/import/data (without source).
+    """
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
 
     user_id = session['user_id']
+    page, error = history_page_params()
+    if error:
+        return jsonify({'error': error}), 400
 
-    # Get the last 100 records for the user and source
-    query = """
-        SELECT
-            id,
-            user_id,
-            JSON_UNQUOTE(data) as data,
-            date,
-            company_id,
-            source,
-            created_at,
-            updated_at
-        FROM historical_data
-        WHERE user_id = %s AND source = %s
-        ORDER BY date DESC
-        LIMIT 100
-    """
-
+    columns = ['id', 'user_id', 'JSON_UNQUOTE(data) as data', 'date', 'company_id', 'source', 'created_at', 'updated_at']
     try:
-        data = fetch_all(query, (user_id, source))
+        data, next_cursor = fetch_historical_page(user_id, source, columns=columns, **page)
         # Parse JSON data for each record
         for record in data:
-            record['data'] = json.loads(record['data'])
-        return jsonify({'data': data}), 200
+            record['data'] = public_payload(json.loads(record['data']))
+        return jsonify({'data': data, 'next_cursor': next_cursor}), 200
     except json.JSONDecodeError as e:
         logger.error(f"JSON parsing error: {str(e)}")
         return jsonify({'error': 'Data format error'}), 500
@@ -1374,7 +1549,8 @@ def fetch_odoo_data():
 
         return jsonify({
             'data': formatted_data,
-            'total_records': total_records  # Return the actual total count
+            'total_records': total_records,  # Return the actual total count
+            'validation': validate_stock_data(stock_moves)
         }), 200
 
     except Exception as e:
@@ -1547,51 +1723,92 @@ def fetch_retailer_stock_history(
 # Do not define database-related functions here to avoid conflicts.
 
 
+def cached_history_count(user_id, source, start_date, end_date, mode):
+    """count_historical_records, memoized until the user's data changes."""
+    if mode == 'none':
+        return None, False
+    key = make_cache_key(user_id, fetch_data_version(user_id), source, start_date, end_date, mode)
+    cached, _ = row_count_cache.get(key)
+    if cached is None:
+        cached = count_historical_records(user_id, source, start_date, end_date, mode)
+        row_count_cache.set(key, cached)
+    return cached
+
+
 @app.route('/api/import/<source>/history', methods=['GET'])
 def get_historical_data(source):
-    """Get historical data for the specified source"""
+    """
+    Get historical data for the specified source
+    ---
+    Pages over individual records: imports (historical_data rows) newest
+    first, the records of each in stored order (see fetch_historical_record_page).
+    Query parameters:
+    - start_date, end_date: optional YYYY-MM-DD range of the import date
+    - limit: records per page (default 100, max 1000)
+    - cursor: next_cursor of the previous page
+    - count: how total_records is computed, auto (default: exact unless
+      there are many imports, then an estimate), exact, estimate or none
+    - format: ndjson or csv to stream every matching record instead of a
+      page (see /api/import/<source>/export)
+    """
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
 
+    if request.args.get('format'):
+        return export_historical_data(source)
+
     user_id = session['user_id']
+    page, error = history_page_params()
+    if error:
+        return jsonify({'error': error}), 400
+    count_mode = request.args.get('count', 'auto')
+    if count_mode not in COUNT_MODES:
+        return jsonify({'error': f"count must be one of {', '.join(COUNT_MODES)}"}), 400
 
     try:
-        # Fetch historical data from the database with limit and count
-        query = """
-            SELECT * FROM historical_data
-            WHERE user_id = %s AND source = %s
-            ORDER BY created_at DESC
-        """
-
-        historical_data, total_count = fetch_all(
-            query,
-            (user_id, source),
-            limit=50,
-            count=True
-        )
-
-        # Format the data for frontend
-        formatted_data = []
-        for record in historical_data:
-            if record.get('data'):
-                try:
-                    # Parse the JSON data
-                    data_records = json.loads(record['data'])
-                    if isinstance(data_records, list):
-                        formatted_data.extend(data_records)
-                    else:
-                        formatted_data.append(data_records)
-                except Exception as e:
-                    print(f"Error parsing JSON data: {str(e)}")
+        (records, next_cursor), (total_count, total_is_estimate) = run_with_count(
+            lambda: fetch_historical_record_page(user_id, source, **page),
+            lambda: cached_history_count(user_id, source, page['start_date'], page['end_date'], count_mode))
 
         return jsonify({
-            'data': formatted_data,
-            'total_records': total_count
+            'data': [public_record(record) for record in records],
+            'total_records': total_count,
+            'total_is_estimate': total_is_estimate,
+            'next_cursor': next_cursor
         }), 200
     except Exception as e:
         logger.error(f"Error fetching historical data: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+
+@app.route('/api/import/<source>/export', methods=['GET'])
+def export_historical_data(source):
+    """
+    Stream every imported record of a source as a download
+    ---
+    Records are read through a server-side cursor and written as they
+    arrive, so exports of any size start immediately. Memory is bounded by
+    the largest single import's JSON text plus one chunk of records (see
+    iter_historical_record_chunks), not by the size of the export.
+    Query parameters:
+    - format: ndjson (default, lossless) or csv (date, product_id, product,
+      location, quantity)
+    - start_date, end_date: optional YYYY-MM-DD range of the import date
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_MIMETYPES:
+        return jsonify({'error': f"format must be one of {', '.join(EXPORT_MIMETYPES)}"}), 400
+    page, error = history_page_params()
+    if error:
+        return jsonify({'error': error}), 400
+
+    chunks = iter_historical_record_chunks(session['user_id'], source=source,
+                                           start_date=page['start_date'], end_date=page['end_date'])
+    return stream_export(chunks, export_format, export_filename(source, export_format))
+
 # User preferences endpoints
 
 
@@ -1960,469 +2177,185 @@ def get_mock_inventory_data():
     }
 
 
-def validate_stock_data(stock_moves):
-    """Validate stock movement data for quality and consistency"""
-    validation_results = {
-        'is_valid': True,
-        'issues': [],
-        'stats': {
-            'total_moves': len(stock_moves),
-            'invalid_moves': 0,
-            'missing_fields': 0,
-            'date_range': {'min': None, 'max': None}
-        }
-    }
-
-    if not stock_moves:
-        validation_results['is_valid'] = False
-        validation_results['issues'].append('No stock movements found')
-        return validation_results
-
-    dates = []
-    for move in stock_moves:
-        try:
-            # Check required fields
-            required_fields = [
-                'product_id',
-                'product_uom_qty',
-                'date',
-                'location_id',
-                'location_dest_id']
-            missing_fields = [
-                field for field in required_fields if field not in move]
-            if missing_fields:
-                validation_results['stats']['missing_fields'] += 1
-                validation_results['issues'].append(
-                    f'Missing fields: {", ".join(missing_fields)}')
-                continue
-
-            # Validate product_id
-            if not isinstance(
-                    move['product_id'], (list, tuple)) or len(
-                    move['product_id']) < 2:
-                validation_results['stats']['invalid_moves'] += 1
-                validation_results['issues'].append(
-                    'Invalid product_id format')
-                continue
-
-            # Validate quantity
-            try:
-                quantity = float(move['product_uom_qty'])
-                if quantity < 0:
-                    validation_results['stats']['invalid_moves'] += 1
-                    validation_results['issues'].append(
-                        'Negative quantity found')
-            except (ValueError, TypeError):
-                validation_results['stats']['invalid_moves'] += 1
-                validation_results['issues'].append('Invalid quantity format')
-                continue
-
-            # Validate date
-            try:
-                date = datetime.strptime(move['date'], '%Y-%m-%d %H:%M:%S')
-                dates.append(date)
-            except ValueError:
-                validation_results['stats']['invalid_moves'] += 1
-                validation_results['issues'].append('Invalid date format')
-                continue
-
-        except Exception as e:
-            validation_results['stats']['invalid_moves'] += 1
-            validation_results['issues'].append(
-                f'Error processing move: {str(e)}')
-            continue
-
-    if dates:
-        validation_results['stats']['date_range'] = {
-            'min': min(dates).strftime('%Y-%m-%d %H:%M:%S'),
-            'max': max(dates).strftime('%Y-%m-%d %H:%M:%S')
-        }
-
-    # Calculate validity percentage
-    valid_moves = validation_results['stats']['total_moves'] - \
-        validation_results['stats']['invalid_moves']
-    validity_percentage = (
-        valid_moves / validation_results['stats']['total_moves']) * 100 if validation_results['stats']['total_moves'] > 0 else 0
-
-    validation_results['stats']['validity_percentage'] = validity_percentage
-    # Require at least 80% valid data
-    validation_results['is_valid'] = validity_percentage >= 80
-
-    return validation_results
+def select_product_models(user_id, demand_matrix, forecast_horizon, season_length):
+    """
+    Choose a forecast model per SKU by rolling-origin backtests.
 
+    Winners are cached per SKU together with a fingerprint of its daily
+    series, so only SKUs whose data changed since the last selection are
+    backtested again. Returns (product_models, model_scores) keyed by product id.
+    """
+    first_day, demand, observed, product_ids, _ = demand_matrix
+    series = DemandSeries.from_matrix(first_day, demand, observed, season_length)
+    fingerprints = series_fingerprints(series)
+
+    product_models, model_scores, stale = {}, {}, []
+    for p, product_id in enumerate(product_ids):
+        cached, _ = model_selection_cache.get(make_cache_key(user_id, product_id, forecast_horizon, season_length))
+        if cached is not None and cached['fingerprint'] == fingerprints[p]:
+            product_models[product_id] = cached['model']
+            model_scores[product_id] = cached['scores']
+        else:
+            stale.append(p)
+
+    if stale:
+        started = time.time()
+        model_names, scores = select_models(series.subset(np.array(stale)), forecast_horizon)
+        for i, p in enumerate(stale):
+            product_id = product_ids[p]
+            product_models[product_id] = model_names[i]
+            model_scores[product_id] = scores[i]
+            model_selection_cache.set(make_cache_key(user_id, product_id, forecast_horizon, season_length), {
+                'fingerprint': fingerprints[p], 'model': model_names[i], 'scores': scores[i]})
+        logger.info(f"Backtested {len(stale)} of {len(product_ids)} products in {time.time() - started:.2f}s")
+    return product_models, model_scores
+
+
+def forecast_with_fitted_models(user_id, demand_matrix, forecast_horizon, model, product_models, season_length,
+                                model_scores=None, quantiles=DEFAULT_QUANTILES):
+    """
+    Forecast a demand matrix, refitting only SKUs whose series changed.
 
-def calculate_data_quality_metrics(data_points):
-    """Calculate quality metrics for the data points"""
-    if not data_points:
-        return None
+    Fitted parameters are stored per (user, SKU, model, season length)
+    together with a fingerprint of the SKU's daily series, in the
+    forecast_fits table with forecast_model_cache as a read-through layer
+    (see fetch_fitted_params). SKUs with a matching fit are projected from
+    it, the rest are fit and stored.
+    """
+    if demand_matrix is None:
+        return forecast_demand_matrix(None, forecast_horizon)
+    first_day, demand, observed, product_ids, _ = demand_matrix
+    fingerprints = series_fingerprints(DemandSeries.from_matrix(first_day, demand, observed, season_length))
+    models = [product_models.get(product_id, model) for product_id in product_ids]
+
+    cache_keys, fitted_params, missing = [], [], []
+    for p, (product_id, fingerprint) in enumerate(zip(product_ids, fingerprints)):
+        key = make_cache_key(user_id, product_id, models[p], season_length)
+        cached, _ = forecast_model_cache.get(key)
+        cache_keys.append(key)
+        if cached is not None and cached['fingerprint'] == fingerprint:
+            fitted_params.append(cached['fit'])
+        else:
+            fitted_params.append(None)
+            missing.append(p)
 
+    if missing:
+        try:
+            stored = fetch_fitted_params(user_id, season_length,
+                                         [(product_ids[p], models[p], fingerprints[p]) for p in missing])
+        except Exception as db_error:
+            logger.warning(f"Stored forecast fits unavailable: {str(db_error)}")
+            stored = {}
+        for p in missing:
+            params = stored.get((str(product_ids[p]), models[p]))
+            if params is not None:
+                fitted_params[p] = {'model': models[p], 'params': params}
+                forecast_model_cache.set(cache_keys[p], {'fingerprint': fingerprints[p], 'fit': fitted_params[p]})
+    refit = [p for p, fit in enumerate(fitted_params) if fit is None]
+
+    forecasts = forecast_demand_matrix(
+        demand_matrix, forecast_horizon, model=model, product_models=product_models,
+        season_length=season_length, model_scores=model_scores, fitted_params=fitted_params, quantiles=quantiles)
+
+    for p in refit:
+        forecast_model_cache.set(cache_keys[p], {'fingerprint': fingerprints[p], 'fit': fitted_params[p]})
     try:
-        # Calculate basic statistics
-        quantities = [point['quantity'] for point in data_points]
-        dates = [
-            datetime.strptime(
-                point['date'],
-                '%Y-%m-%d %H:%M:%S') for point in data_points]
-
-        # Time-based metrics
-        date_range = max(dates) - min(dates)
-        data_frequency = len(dates) / (date_range.days +
-                                       1) if date_range.days > 0 else 1
-
-        # Quantity-based metrics
-        quantity_stats = {
-            'mean': np.mean(quantities),
-            'std': np.std(quantities) if len(quantities) > 1 else 0,
-            'min': np.min(quantities),
-            'max': np.max(quantities),
-            'cv': np.std(quantities) / np.mean(quantities) if np.mean(quantities) != 0 else 0
-        }
+        save_fitted_params(user_id, season_length, [
+            (product_ids[p], fitted_params[p]['model'], fingerprints[p], fitted_params[p]['params']) for p in refit])
+    except Exception as db_error:
+        logger.warning(f"Could not store forecast fits: {str(db_error)}")
+    logger.info(f"Refit {len(refit)} of {len(product_ids)} products "
+                f"({len(missing) - len(refit)} loaded from the database)")
+    return forecasts
 
-        # Check for outliers (using 3 standard deviations)
-        outliers = [
-            q for q in quantities if abs(
-                q -
-                quantity_stats['mean']) > 3 *
-            quantity_stats['std']]
-
-        return {
-            'data_points': len(data_points),
-            'date_range_days': date_range.days,
-            'data_frequency': round(
-                data_frequency,
-                2),
-            'quantity_stats': quantity_stats,
-            'outlier_count': len(outliers),
-            'outlier_percentage': (
-                len(outliers) /
-                len(quantities)) *
-            100 if quantities else 0}
-    except Exception as e:
-        logger.error(f"Error calculating data quality metrics: {str(e)}")
-        return None
 
+def load_daily_demand(user_id, start_date, end_date, by_location=False):
+    """
+    Load a user's daily per-product (or per-product and location) demand for the date window.
 
-def generate_forecast(historical_data, forecast_horizon):
-    """Generate inventory forecast using historical data"""
+    Streams the daily_demand rollup in batches; only users without any rollup
+    rows (not yet backfilled) stream their full raw history instead. Falls back to mock data
+    when the window holds fewer than 3 observations or the database cannot be read.
+    """
+    aggregator = DailyDemandAggregator(start_date, end_date, by_location)
     try:
-        # Convert historical data to time series format
-        dates = []
-        quantities = []
-        
-        # Ensure historical_data is iterable and handle different data formats
-        if not historical_data or not isinstance(historical_data, (list, tuple)):
-            logger.warning("Historical data is missing or in invalid format")
-            return {'error': 'Invalid historical data format'}
-            
-        for record in historical_data:
-            try:
-                # Handle different data structures that might be present
-                if isinstance(record, dict):
-                    # Extract date
-                    if 'date' in record:
-                        date_str = record['date']
-                        if isinstance(date_str, datetime):
-                            date_obj = date_str
-                        else:
-                            date_obj = parser.parse(date_str)
-                        dates.append(date_obj)
-                        
-                        # Extract quantity
-                        quantity = 0
-                        if 'data' in record and isinstance(record['data'], dict) and 'quantity' in record['data']:
-                            quantity = float(record['data']['quantity'])
-                        elif 'quantity' in record:
-                            quantity = float(record['quantity'])
-                        quantities.append(quantity)
-            except Exception as inner_e:
-                logger.error(f"Error processing record: {str(inner_e)}")
-                continue
-
-        if not dates or not quantities or len(dates) < 3:
-            logger.warning("Insufficient data points for forecast")
-            return {'error': 'Insufficient historical data'}
-
-        # Prepare data for forecasting
-        X = np.array(range(len(dates))).reshape(-1, 1)
-        y = np.array(quantities)
-
-        # Train linear regression model
-        model = LinearRegression()
-        model.fit(X, y)
-
-        # Generate future dates
-        last_date = max(dates)
-        future_dates = [last_date + timedelta(days=i) for i in range(1, int(forecast_horizon) + 1)]
-        
-        # Generate predictions
-        future_X = np.array(range(len(dates), len(dates) + int(forecast_horizon))).reshape(-1, 1)
-        predictions = model.predict(future_X)
-
-        # Create a better formatted response
-        forecast_data = []
-        for i, date in enumerate(future_dates):
-            forecast_data.append({
-                'date': date.strftime('%Y-%m-%d'),
-                'quantity': float(predictions[i])
-            })
-
-        return {
-            'status': 'success',
-            'historical_count': len(dates),
-            'forecast': forecast_data
-        }
-
-    except Exception as e:
-        logger.error(f"Error generating forecast: {str(e)}")
-        return {'error': str(e)}
-
+        rollup_rows = False
+        for batch in iter_daily_demand_batches(user_id, start_date, end_date):
+            aggregator.add_daily_totals(batch)
+            rollup_rows = True
+        # An empty window of a backfilled user is just an empty window
+        if not rollup_rows and not has_daily_demand(user_id):
+            rollup_rows = None
+            for chunk in iter_historical_record_chunks(user_id):
+                aggregator.add(chunk)
+        logger.info(f"Aggregated {aggregator.records_seen} historical records into {aggregator.observations} daily observations "
+                    f"({'raw history' if rollup_rows is None else 'rollup'})")
+    except Exception as db_error:
+        logger.error(f"Database error: {str(db_error)}")
+        aggregator = None
+
+    if aggregator is None or aggregator.observations < 3:
+        # If no data found, use mock data for demonstration
+        logger.warning("No historical data found, using mock data")
+        aggregator = DailyDemandAggregator(start_date, end_date, by_location)
+        aggregator.add_daily_totals(mock_daily_totals(cached_mock_demand(start_date, end_date)))
+    return aggregator
+
+
+def load_inventory_policies(user_id, start_date, end_date, lead_time_days, product_id=None, location=None):
+    """
+    Analytic inventory policy of every (SKU, location) pair in the date window,
+    optionally for one product and/or location (see optimize_inventory_policies).
 
-def optimize_inventory_levels(historical_data, forecast_horizon):
-    """Calculate optimal inventory levels based on historical data."""
+    Returns (aggregator, policies); policies is None when there is no demand.
+    """
+    # Stream the full requested window, aggregated to daily demand per product and location
+    aggregator = load_daily_demand(user_id, start_date, end_date, by_location=True)
+    daily_totals = aggregator.daily_totals()
+    if product_id:
+        daily_totals = daily_totals[daily_totals['product'] == str(product_id)]
+    if location:
+        daily_totals = daily_totals[daily_totals['location'] == str(location)]
+    if daily_totals.empty:
+        return aggregator, None
+
+    # Optimize every (SKU, location) pair in one vectorized pass with its own costs
     try:
-        # Extract quantities from historical data
-        quantities = [float(record['data'].get('quantity', 0)) for record in historical_data]
-        
-        if not quantities:
-            return {'error': 'No historical data available'}
-            
-        # Calculate basic statistics
-        mean_demand = np.mean(quantities)
-        std_demand = np.std(quantities)
-        
-        # Calculate safety stock (using 95% service level)
-        safety_stock = 1.96 * std_demand * np.sqrt(forecast_horizon)
-        
-        # Calculate reorder point
-        reorder_point = mean_demand * forecast_horizon + safety_stock
-        
-        # Calculate optimal order quantity (EOQ)
-        # Assuming holding cost is 20% of unit cost and ordering cost is $100
-        holding_cost = 0.2
-        ordering_cost = 100
-        eoq = np.sqrt((2 * mean_demand * ordering_cost) / holding_cost)
-        
-        return {
-            'safety_stock': round(safety_stock, 2),
-            'reorder_point': round(reorder_point, 2),
-            'economic_order_quantity': round(eoq, 2),
-            'mean_demand': round(mean_demand, 2),
-            'std_demand': round(std_demand, 2)
-        }
-        
-    except Exception as e:
-        logger.error(f"Error optimizing inventory levels: {str(e)}")
-        return {'error': str(e)}
+        item_settings = fetch_inventory_item_settings(user_id, product_id, location)
+    except Exception as settings_error:
+        logger.warning(f"Inventory item settings unavailable, using defaults: {str(settings_error)}")
+        item_settings = []
+    policies = optimize_inventory_policies(daily_totals, aggregator.product_info, lead_time_days, item_settings)
+    logger.info(f"Optimized {len(policies)} SKU/location pairs")
+    return aggregator, policies
 
 
-def generate_mock_historical_data(start_date, end_date):
-    """Generate mock historical data for demonstration purposes with realistic patterns"""
-    mock_data = []
-    
-    # Parse dates
-    start = datetime.strptime(start_date, '%Y-%m-%d')
-    end = datetime.strptime(end_date, '%Y-%m-%d')
-    
-    # Calculate number of days
-    delta = end - start
-    days = delta.days + 1
-    
-    # Create mock products with various patterns and realistic demand profiles
-    products = [
-        {
-            "id": "P001", 
-            "name": "Premium Widgets", 
-            "base_quantity": 150, 
-            "trend": "increasing", 
-            "volatility": 15,
-            "description": "High-end widgets with growing demand"
-        },
-        {
-            "id": "P002", 
-            "name": "Standard Components", 
-            "base_quantity": 220, 
-            "trend": "decreasing", 
-            "volatility": 20,
-            "description": "Being phased out for newer models"
-        },
-        {
-            "id": "P003", 
-            "name": "Bulk Materials", 
-            "base_quantity": 500, 
-            "trend": "stable", 
-            "volatility": 30,
-            "description": "Consistent demand industrial materials"
-        },
-        {
-            "id": "P004", 
-            "name": "Seasonal Items", 
-            "base_quantity": 80, 
-            "trend": "cyclical", 
-            "volatility": 40,
-            "description": "Products with weekly demand patterns"
-        },
-        {
-            "id": "P005", 
-            "name": "New Product Line", 
-            "base_quantity": 50, 
-            "trend": "exponential", 
-            "volatility": 25,
-            "description": "Recently launched product with rapid growth"
-        }
-    ]
-    
-    # Create mock locations with different characteristics
-    locations = [
-        {"id": "L001", "name": "Main Warehouse", "region": "Central"},
-        {"id": "L002", "name": "East Distribution Center", "region": "East"},
-        {"id": "L003", "name": "West Distribution Center", "region": "West"},
-        {"id": "L004", "name": "Retail Storage North", "region": "North"}
-    ]
-    
-    # Create mock customer profiles
-    customers = [
-        {"id": "C001", "name": "Enterprise Solutions Inc.", "type": "B2B", "order_size": "large"},
-        {"id": "C002", "name": "MidMarket Corp", "type": "B2B", "order_size": "medium"},
-        {"id": "C003", "name": "Small Business LLC", "type": "SMB", "order_size": "small"},
-        {"id": "C004", "name": "Retail Chain Group", "type": "B2B", "order_size": "large"},
-        {"id": "C005", "name": "Online Distributor", "type": "eCommerce", "order_size": "medium"},
-        {"id": "C006", "name": "Direct Consumer", "type": "B2C", "order_size": "small"},
-    ]
-    
-    # Generate data with trends for each product
-    for product in products:
-        for i in range(days):
-            current_date = start + timedelta(days=i)
-            
-            # Apply different trend patterns with more sophisticated modeling
-            if product["trend"] == "increasing":
-                trend_factor = 2 * i  # Stronger linear increase
-            elif product["trend"] == "decreasing":
-                trend_factor = -1.5 * i  # Moderate linear decrease
-            elif product["trend"] == "cyclical":
-                # Weekly cycle with weekend peaks
-                day_of_week = current_date.weekday()  # 0-6 where 0 is Monday
-                if day_of_week >= 5:  # Weekend
-                    trend_factor = 20 * math.sin(i/7 * math.pi) + 15  # Higher weekend demand
-                else:
-                    trend_factor = 15 * math.sin(i/7 * math.pi)  # Regular weekday cycle
-            elif product["trend"] == "exponential":
-                # Exponential growth for new products
-                trend_factor = 2 * (math.exp(i/20) - 1)  # Controlled exponential growth
-            else:  # stable
-                # Slight variations around baseline
-                trend_factor = 5 * math.sin(i/10 * math.pi)  # Very mild oscillation
-            
-            # Add seasonal component for longer-term patterns
-            seasonal_factor = 10 * math.sin(i/90 * 2 * math.pi)  # 90-day seasonal cycle
-            
-            # Add some randomness/volatility that mimics real-world variability
-            # More volatile on specific days of week (e.g., Mondays and Fridays)
-            day_volatility = product["volatility"] * (1.2 if current_date.weekday() in [0, 4] else 1.0)
-            random_factor = random.uniform(-1, 1) * day_volatility
-            
-            # Calculate quantity with trend and randomness
-            base = product["base_quantity"]
-            quantity = max(0, round(base + trend_factor + seasonal_factor + random_factor))
-            
-            # Select a location (products may have preferred locations)
-            if product["id"] in ["P001", "P005"]:  # Premium products mostly in main warehouse
-                location = locations[0] if random.random() < 0.7 else random.choice(locations[1:])
-            elif product["id"] == "P004":  # Seasonal items distributed across all locations
-                location = random.choice(locations)
-            else:
-                # Other products with weighted distribution
-                weights = [0.4, 0.3, 0.2, 0.1]  # Probabilities for each location
-                location_idx = random.choices(range(len(locations)), weights=weights)[0]
-                location = locations[location_idx]
-            
-            # Create mock orders with realistic customer patterns
-            orders = []
-            if quantity > 0:
-                # Determine number of orders for this product-day
-                # More popular products get more orders
-                if product["id"] in ["P001", "P003", "P005"]:
-                    num_orders = random.randint(3, 6)  # Popular products get multiple orders
-                else:
-                    num_orders = random.randint(1, 3)  # Less popular products get fewer orders
-                
-                # Ensure number of orders doesn't exceed quantity
-                num_orders = min(num_orders, quantity)
-                
-                # Distribute quantity across orders
-                remaining = quantity
-                
-                # Create each order
-                for j in range(num_orders):
-                    # Different order size calculation methods
-                    if j == num_orders-1:
-                        # Last order takes remaining quantity
-                        order_qty = remaining
-                    elif product["id"] in ["P001", "P005"]:
-                        # Premium products tend to have larger orders
-                        min_size = max(1, int(remaining * 0.3))
-                        max_size = max(min_size, min(remaining - num_orders + j + 1, int(remaining * 0.7)))
-                        order_qty = random.randint(min_size, max_size)
-                    else:
-                        # Standard sizing for other products
-                        order_qty = random.randint(1, remaining - num_orders + j + 1)
-                    
-                    remaining -= order_qty
-                    
-                    # Select appropriate customer based on order size and product
-                    if order_qty > product["base_quantity"] * 0.5:
-                        # Large orders go to enterprise customers
-                        customer = next((c for c in customers if c["order_size"] == "large"), customers[0])
-                    elif order_qty > product["base_quantity"] * 0.2:
-                        # Medium orders to mid-market
-                        customer = next((c for c in customers if c["order_size"] == "medium"), customers[1])
-                    else:
-                        # Small orders to small business or direct consumers
-                        customer = next((c for c in customers if c["order_size"] == "small"), customers[2])
-                    
-                    # Add detailed order information
-                    order_id = f"ORD-{current_date.strftime('%Y%m%d')}-{product['id']}-{j+1}"
-                    orders.append({
-                        "order_id": order_id,
-                        "quantity": order_qty,
-                        "customer": customer["name"],
-                        "customer_id": customer["id"],
-                        "customer_type": customer["type"],
-                        "status": "completed" if current_date < datetime.now() else "pending",
-                        "reference": f"REF-{hashlib.md5(order_id.encode()).hexdigest()[:8]}"
-                    })
-            
-            # Add the data point with rich metadata
-            mock_data.append({
-                'date': current_date.strftime('%Y-%m-%d %H:%M:%S'),
-                'data': {
-                    'quantity': quantity,
-                    'product': product["name"],
-                    'product_id': product["id"],
-                    'product_description': product["description"],
-                    'location': location["name"],
-                    'location_id': location["id"],
-                    'region': location["region"],
-                    'orders': orders,
-                    'metadata': {
-                        'base_demand': product["base_quantity"],
-                        'trend_factor': round(trend_factor, 2),
-                        'seasonal_factor': round(seasonal_factor, 2),
-                        'volatility': round(random_factor, 2),
-                        'total_order_quantity': sum(o["quantity"] for o in orders)
-                    }
-                },
-                'company_id': '1',
-                'source': 'mock',
-                'timestamp': current_date.timestamp()
-            })
-    
-    return mock_data
+def cached_mock_demand(start_date, end_date, seed=MOCK_DATA_SEED):
+    """Seeded mock demand frame for the window, memoized per (start, end, seed); callers must not modify it."""
+    key = make_cache_key(start_date, end_date, seed)
+    frame, _ = mock_demand_cache.get(key)
+    if frame is None:
+        frame = generate_mock_demand(start_date, end_date, seed)
+        mock_demand_cache.set(key, frame)
+    return frame
 
 
 @app.route('/api/forecasting/inventory-optimization', methods=['POST'])
 def forecast_inventory():
-    """Generate inventory forecasts based on historical data."""
+    """
+    Generate inventory forecasts based on historical data.
+
+    Optional parameters: model (linear, ses, holt, holt_winters, croston, or
+    auto to pick the best per product by backtest), models (object mapping
+    product ids to a model) and season_length (days, used by holt_winters;
+    defaults to weekly), quantiles (list of probabilities for the prediction
+    bands on every forecast point; defaults to 0.1, 0.5, 0.9). Responses are
+    cached until the user's next import;
+    send cache=false or Cache-Control: no-cache to bypass.
+
+    Meant for ad-hoc what-ifs; dashboards should read the nightly forecast
+    store through GET /api/forecasting/forecasts.
+    """
     try:
         # Check if user is authenticated
         if 'user_id' not in session:
@@ -2449,112 +2382,62 @@ def forecast_inventory():
         # Ensure forecast horizon is at least 2 days
         if forecast_horizon < 2:
             forecast_horizon = 2
-        
-        # Try to get historical data from database
+
+        # Forecast model for the request, optionally overridden per product
+        model = data.get('model', DEFAULT_FORECAST_MODEL)
+        product_models = data.get('models') or {}
+        if not isinstance(product_models, dict):
+            return jsonify({'error': 'models must map product ids to model names'}), 400
+        unknown_models = {model, *product_models.values()} - set(FORECAST_MODELS) - {AUTO_FORECAST_MODEL}
+        if unknown_models:
+            return jsonify({'error': f"Unknown forecast model(s): {', '.join(map(str, unknown_models))}. "
+                                     f"Available: {', '.join(sorted(FORECAST_MODELS))}"}), 400
+        season_length = int(data.get('season_length', DEFAULT_SEASON_LENGTH))
+        if season_length < 2:
+            return jsonify({'error': 'season_length must be at least 2'}), 400
         try:
-            # Get historical inventory movements from historical_data table
-            query = """
-                SELECT * FROM historical_data 
-                WHERE user_id = %s 
-                AND DATE(date) BETWEEN %s AND %s
-                ORDER BY date DESC
-                LIMIT 100
-            """
-            
-            historical_data = fetch_all(
-                query, 
-                (user_id, data['start_date'], data['end_date'])
-            )
-            
-            if not historical_data or len(historical_data) < 3:
-                # If no data found, use mock data for demonstration
-                logger.warning("No historical data found, using mock data")
-                historical_data = generate_mock_historical_data(data['start_date'], data['end_date'])
-        except Exception as db_error:
-            logger.error(f"Database error: {str(db_error)}")
-            # Fall back to mock data on database error
-            historical_data = generate_mock_historical_data(data['start_date'], data['end_date'])
-        
-        # Group data by product for more meaningful forecasts
-        product_data = {}
-        for record in historical_data:
-            if isinstance(record, dict) and 'data' in record and isinstance(record['data'], dict):
-                product_id = record['data'].get('product_id', record['data'].get('product', 'unknown'))
-                if product_id not in product_data:
-                    product_data[product_id] = []
-                product_data[product_id].append(record)
-        
-        all_forecasts = []
+            quantiles = tuple(sorted({float(q) for q in data.get('quantiles', DEFAULT_QUANTILES)}))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'quantiles must be a list of numbers'}), 400
+        if not all(0 < q < 1 for q in quantiles):
+            return jsonify({'error': 'quantiles must be between 0 and 1 (exclusive)'}), 400
+        product_models = {str(k): v for k, v in product_models.items()}
+
+        # Identical requests are answered from cache until an import bumps the user's data version
+        response_key = None
+        if data.get('cache', True) and 'no-cache' not in request.headers.get('Cache-Control', ''):
+            try:
+                response_key = make_cache_key(user_id, fetch_data_version(user_id), data['start_date'], data['end_date'],
+                                              forecast_horizon, model, product_models, season_length, quantiles)
+            except Exception as version_error:
+                logger.warning(f"Data version unavailable, forecast response cache skipped: {str(version_error)}")
+        if response_key:
+            cached_response, age = forecast_response_cache.get(response_key)
+            if cached_response is not None:
+                logger.info(f"Forecast cache hit (age {age:.0f}s)")
+                response = jsonify(cached_response)
+                response.headers['X-Cache'] = 'HIT'
+                response.headers['Age'] = str(int(age))
+                return response, 200
         
-        # Generate forecast for each product
-        for product_id, product_records in product_data.items():
-            forecast_result = generate_forecast(product_records, forecast_horizon)
-            
-            if 'error' in forecast_result:
-                logger.warning(f"Error forecasting product {product_id}: {forecast_result['error']}")
-                continue
-                
-            # Get product info from the first record
-            first_record = product_records[0]
-            product_name = first_record['data'].get('product', 'Product')
-            location = first_record['data'].get('location', 'All Locations')
-            
-            # Extract historical data points for the chart
-            historical_points = []
-            for record in sorted(product_records, key=lambda x: parser.parse(x['date'])):
-                if 'data' in record and isinstance(record['data'], dict) and 'quantity' in record['data']:
-                    quantity = float(record['data']['quantity'])
-                    date_str = parser.parse(record['date']).strftime('%Y-%m-%d')
-                    historical_points.append({
-                        'date': date_str,
-                        'quantity': quantity
-                    })
-            
-            # Calculate trend statistics
-            forecast_avg = sum(item['quantity'] for item in forecast_result.get('forecast', [])) / max(len(forecast_result.get('forecast', [])), 1)
-            
-            if historical_points:
-                historical_avg = sum(item['quantity'] for item in historical_points) / len(historical_points)
-                
-                # Calculate percent change and determine trend
-                if historical_avg > 0:
-                    percent_change = ((forecast_avg - historical_avg) / historical_avg) * 100
-                else:
-                    percent_change = 0
-                    
-                # Determine trend direction and strength
-                if abs(percent_change) < 5:
-                    direction = "stable"
-                    strength = "low"
-                else:
-                    direction = "increasing" if percent_change > 0 else "decreasing"
-                    if abs(percent_change) > 15:
-                        strength = "high"
-                    else:
-                        strength = "medium"
-            else:
-                historical_avg = 0
-                percent_change = 0
-                direction = "stable"
-                strength = "low"
-            
-            # Add forecast for this product
-            all_forecasts.append({
-                'name': product_name,
-                'product_id': product_id,
-                'location': location,
-                'historical_data': historical_points,
-                'forecast': forecast_result.get('forecast', []),
-                'summary': {
-                    'avg_historical': round(historical_avg, 2),
-                    'avg_forecast': round(forecast_avg, 2),
-                    'percent_change': round(percent_change, 2)
-                },
-                'trend': {
-                    'direction': direction,
-                    'strength': strength
-                }
-            })
+        # Stream the full requested window, aggregated to daily per-product demand
+        aggregator = load_daily_demand(user_id, data['start_date'], data['end_date'])
+
+        demand_matrix = aggregator.matrix()
+        model_scores = None
+        if demand_matrix is not None and AUTO_FORECAST_MODEL in (model, *product_models.values()):
+            selected_models, model_scores = select_product_models(user_id, demand_matrix, forecast_horizon, season_length)
+            # Explicit per-product choices win over the request-wide one; "auto" resolves to the backtest winner
+            resolved_models = {}
+            for product_id, selected in selected_models.items():
+                choice = product_models.get(product_id, model)
+                resolved_models[product_id] = selected if choice == AUTO_FORECAST_MODEL else choice
+            product_models = resolved_models
+            model = DEFAULT_FORECAST_MODEL
+
+        # Forecast all products in one vectorized pass per model, reusing fits of unchanged SKUs
+        all_forecasts = forecast_with_fitted_models(
+            user_id, demand_matrix, forecast_horizon, model, product_models, season_length, model_scores, quantiles)
         
         # If no forecasts were generated, create a fallback
         if not all_forecasts:
@@ -2582,8 +2465,12 @@ def forecast_inventory():
             'status': 'success',
             'forecasts': all_forecasts
         }
+        if response_key:
+            forecast_response_cache.set(response_key, response)
         
-        return jsonify(response), 200
+        response = jsonify(response)
+        response.headers['X-Cache'] = 'MISS'
+        return response, 200
 
     except Exception as e:
         logger.error(f"Error in forecast_inventory: {str(e)}")
@@ -2593,13 +2480,94 @@ def forecast_inventory():
         }), 200  # Return 200 to allow frontend to handle
 
 
-@app.route('/api/inventory/optimize', methods=['POST'])
-def optimize_inventory():
-    """Optimize inventory levels based on historical data and forecasts."""
+@app.route('/api/forecasting/forecasts', methods=['GET'])
+def get_stored_forecasts():
+    """
+    Precomputed forecasts from the nightly forecast store
+    ---
+    Query parameters:
+    - product_id: optional filter
+    - location: optional, products selling at this location (see each product's locations)
+    - horizon: optional, days to return per product (at most the store horizon)
+    - limit: products per page (default 100, max 1000)
+    - cursor: next_cursor of the previous page
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
     try:
-        # Check if user is authenticated
-        if 'user_id' not in session:
-            return jsonify({'error': 'User not authenticated'}), 401
+        horizon = request.args.get('horizon', type=int) or FORECAST_STORE_CONFIG['horizon_days']
+        if not 1 <= horizon <= FORECAST_STORE_CONFIG['horizon_days']:
+            return jsonify({'error': f"horizon must be between 1 and {FORECAST_STORE_CONFIG['horizon_days']}"}), 400
+        limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+
+        products, next_cursor = fetch_stored_forecasts(
+            session['user_id'], horizon, request.args.get('product_id'), request.args.get('location'),
+            request.args.get('cursor'), limit)
+        for product in products:
+            product['generated_at'] = product['generated_at'].isoformat() if product['generated_at'] else None
+            for point in product['forecast']:
+                point['date'] = point['date'].strftime('%Y-%m-%d')
+                for key in ('quantity', 'p10', 'p50', 'p90'):
+                    point[key] = float(point[key]) if point[key] is not None else None
+
+        return jsonify({
+            'status': 'success',
+            'forecasts': products,
+            'next_cursor': next_cursor
+        }), 200
+    except Exception as e:
+        logger.error(f"Error fetching stored forecasts: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/inventory/demand-series', methods=['GET'])
+def get_demand_series():
+    """
+    Daily demand series per product and location from the daily_demand rollup
+    ---
+    Query parameters:
+    - start_date, end_date: optional YYYY-MM-DD bounds (inclusive)
+    - product_id: optional, restrict to one product
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    try:
+        rows = fetch_daily_demand(session['user_id'], request.args.get('start_date'), request.args.get('end_date'))
+        product_filter = request.args.get('product_id')
+
+        series = {}
+        for row in rows:
+            if product_filter and row['product_id'] != product_filter:
+                continue
+            key = (row['product_id'], row['location'])
+            if key not in series:
+                series[key] = {
+                    'product_id': row['product_id'],
+                    'name': row['product_name'],
+                    'location': row['location'],
+                    'points': []
+                }
+            series[key]['points'].append({
+                'date': row['day'].strftime('%Y-%m-%d') if hasattr(row['day'], 'strftime') else str(row['day']),
+                'quantity': float(row['quantity']),
+                'records': int(row['record_count'])
+            })
+
+        return jsonify({'status': 'success', 'series': list(series.values())}), 200
+    except Exception as e:
+        logger.error(f"Error fetching demand series: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/inventory/optimize', methods=['POST'])
+def optimize_inventory():
+    """Optimize inventory levels based on historical data and forecasts."""
+    try:
+        # Check if user is authenticated
+        if 'user_id' not in session:
+            return jsonify({'error': 'User not authenticated'}), 401
 
         # Log optimization attempt
         logger.info("Starting inventory optimization process")
@@ -2616,46 +2584,36 @@ def optimize_inventory():
             if param not in data:
                 return jsonify({'error': f'Missing required parameter: {param}'}), 400
 
-        user_id = session['user_id']
-        
-        # Try to get historical data from database
         try:
-            # Get historical inventory movements
-            query = """
-                SELECT * FROM historical_data 
-                WHERE user_id = %s 
-                AND DATE(date) BETWEEN %s AND %s
-                ORDER BY date DESC
-                LIMIT 100
-            """
-            
-            historical_data = fetch_all(
-                query, 
-                (user_id, data['start_date'], data['end_date'])
-            )
-            
-            if not historical_data or len(historical_data) < 3:
-                # If no data found, use mock data for demonstration
-                logger.warning("No historical data found, using mock data for optimization")
-                historical_data = generate_mock_historical_data(data['start_date'], data['end_date'])
-        except Exception as db_error:
-            logger.error(f"Database error in optimization: {str(db_error)}")
-            # Fall back to mock data on database error
-            historical_data = generate_mock_historical_data(data['start_date'], data['end_date'])
+            lead_time_days = float(data['forecast_horizon'])
+        except (TypeError, ValueError):
+            return jsonify({'error': 'forecast_horizon must be a number'}), 400
+        if lead_time_days <= 0:
+            return jsonify({'error': 'forecast_horizon must be positive'}), 400
+        product_id = data.get('product_id')
+        location = data.get('location')
 
-        # Perform optimization
-        optimized_levels = optimize_inventory_levels(historical_data, data['forecast_horizon'])
+        user_id = session['user_id']
+        _, policies = load_inventory_policies(
+            user_id, data['start_date'], data['end_date'], lead_time_days, product_id, location)
 
         # Always return 200 status for frontend consistency
-        if 'error' in optimized_levels:
+        if policies is None:
             return jsonify({
                 'status': 'error',
-                'message': optimized_levels['error']
+                'message': 'No historical data available'
             }), 200
-            
+
         return jsonify({
             'status': 'success',
-            'optimized_levels': optimized_levels
+            'policies': policies.round(2).replace({np.nan: None}).to_dict('records'),
+            'summary': {
+                'items': len(policies),
+                'products': int(policies['product_id'].nunique()),
+                'locations': int(policies['location'].nunique()),
+                'total_safety_stock': round(float(policies['safety_stock'].sum()), 2),
+                'total_reorder_point': round(float(policies['reorder_point'].sum()), 2)
+            }
         }), 200
 
     except Exception as e:
@@ -2666,6 +2624,158 @@ def optimize_inventory():
         }), 200  # Return 200 for frontend consistency
 
 
+@app.route('/api/inventory/simulate', methods=['POST'])
+def simulate_inventory():
+    """
+    Simulate reorder policy candidates per SKU and location before applying them.
+
+    Required: start_date, end_date and forecast_horizon (default lead time in
+    days, as for /api/inventory/optimize). Optional: product_id, location,
+    candidates (see validate_candidates; default: s,S and R,Q around the
+    analytic policy), demand_source ('history' or 'forecast', with model and
+    season_length), horizon_days, paths, seed and details (include every
+    candidate's metrics, not only the recommended one).
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'User not authenticated'}), 401
+
+    data = request.get_json(silent=True) or {}
+    for param in ('start_date', 'end_date', 'forecast_horizon'):
+        if param not in data:
+            return jsonify({'error': f'Missing required parameter: {param}'}), 400
+    try:
+        lead_time_days = float(data['forecast_horizon'])
+        horizon_days = int(data.get('horizon_days', SIMULATION_CONFIG['horizon_days']))
+        paths = int(data.get('paths', SIMULATION_CONFIG['paths']))
+        seed = int(data['seed']) if data.get('seed') is not None else None
+        season_length = int(data.get('season_length', DEFAULT_SEASON_LENGTH))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'forecast_horizon, horizon_days, paths, seed and season_length must be numbers'}), 400
+    if lead_time_days <= 0:
+        return jsonify({'error': 'forecast_horizon must be positive'}), 400
+    if not 1 <= horizon_days <= SIMULATION_CONFIG['max_horizon_days']:
+        return jsonify({'error': f"horizon_days must be between 1 and {SIMULATION_CONFIG['max_horizon_days']}"}), 400
+    if not 1 <= paths <= SIMULATION_CONFIG['max_paths']:
+        return jsonify({'error': f"paths must be between 1 and {SIMULATION_CONFIG['max_paths']}"}), 400
+    demand_source = data.get('demand_source', 'history')
+    if demand_source not in ('history', 'forecast'):
+        return jsonify({'error': "demand_source must be 'history' or 'forecast'"}), 400
+    model = data.get('model', DEFAULT_FORECAST_MODEL)
+    if model not in FORECAST_MODELS:
+        return jsonify({'error': f"Unknown forecast model: {model}. Available: {', '.join(sorted(FORECAST_MODELS))}"}), 400
+    if season_length < 2:
+        return jsonify({'error': 'season_length must be at least 2'}), 400
+    candidates, error = validate_candidates(data.get('candidates'))
+    if error:
+        return jsonify({'error': error}), 400
+
+    user_id = session['user_id']
+    try:
+        aggregator, policies = load_inventory_policies(
+            user_id, data['start_date'], data['end_date'], lead_time_days, data.get('product_id'), data.get('location'))
+        if policies is None:
+            return jsonify({'status': 'error', 'message': 'No historical data available'}), 200
+
+        daily_means = None
+        if demand_source == 'forecast':
+            # Product-level forecast split across locations by their share of historical demand
+            forecasts = forecast_with_fitted_models(
+                user_id, aggregator.matrix(), horizon_days, model, {}, season_length)
+            product_forecasts = {
+                f['product_id']: np.array([point['quantity'] for point in f['forecast']][:horizon_days], dtype=float)
+                for f in forecasts}
+            mean = policies['mean_demand'].to_numpy(dtype=float)
+            daily_means = np.repeat(mean[:, None], horizon_days, axis=1)
+            shares = location_shares(policies)
+            for row, product_id in enumerate(policies['product_id']):
+                path = product_forecasts.get(product_id)
+                if path is not None and len(path):
+                    daily_means[row, :len(path)] = np.maximum(path, 0) * shares[row]
+                    daily_means[row, len(path):] = daily_means[row, len(path) - 1]
+
+        metrics, best, candidates = simulate_inventory_policies(
+            policies, candidates, daily_means, horizon_days, paths, seed)
+        return jsonify({
+            'status': 'success',
+            'demand_source': demand_source,
+            'horizon_days': horizon_days,
+            'paths': paths,
+            'results': simulation_results(policies, metrics, best, candidates, bool(data.get('details'))),
+            'summary': {
+                'items': len(policies),
+                'candidates': len(candidates),
+                'average_fill_rate': round(float(metrics['fill_rate'][np.arange(len(best)), best].mean()), 4),
+                'average_cycle_service_level': round(float(
+                    metrics['cycle_service_level'][np.arange(len(best)), best].mean()), 4),
+                'total_cost': round(float(metrics['total_cost'][np.arange(len(best)), best].sum()), 2)
+            }
+        }), 200
+    except Exception as e:
+        logger.error(f"Error in simulate_inventory: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 200
+
+
+@app.route('/api/inventory/multi-echelon', methods=['POST'])
+def multi_echelon_inventory():
+    """
+    Allocate safety stock per SKU across warehouse and retailer nodes.
+
+    Required: start_date, end_date and forecast_horizon (default lead time in
+    days). Optional: network (nodes with location, type, supplier and
+    capacity; see validate_network), product_id, time_limit_seconds and
+    service_time_levels. Locations missing from the network are typed by
+    name and linked to the only warehouse when there is just one.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'User not authenticated'}), 401
+
+    data = request.get_json(silent=True) or {}
+    for param in ('start_date', 'end_date', 'forecast_horizon'):
+        if param not in data:
+            return jsonify({'error': f'Missing required parameter: {param}'}), 400
+    try:
+        lead_time_days = float(data['forecast_horizon'])
+        time_limit_seconds = float(data.get('time_limit_seconds', MULTI_ECHELON_CONFIG['time_limit_seconds']))
+        service_time_levels = int(data.get('service_time_levels', MULTI_ECHELON_CONFIG['service_time_levels']))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'forecast_horizon, time_limit_seconds and service_time_levels must be numbers'}), 400
+    if lead_time_days <= 0:
+        return jsonify({'error': 'forecast_horizon must be positive'}), 400
+    if not 0 < time_limit_seconds <= MULTI_ECHELON_CONFIG['max_time_limit_seconds']:
+        return jsonify({'error': f"time_limit_seconds must be between 0 and {MULTI_ECHELON_CONFIG['max_time_limit_seconds']}"}), 400
+    if not 2 <= service_time_levels <= 50:
+        return jsonify({'error': 'service_time_levels must be between 2 and 50'}), 400
+    network, error = validate_network(data.get('network'))
+    if error:
+        return jsonify({'error': error}), 400
+
+    user_id = session['user_id']
+    product_id = data.get('product_id')
+    try:
+        _, policies = load_inventory_policies(
+            user_id, data['start_date'], data['end_date'], lead_time_days, product_id)
+        if policies is None:
+            return jsonify({'status': 'error', 'message': 'No historical data available'}), 200
+        try:
+            item_settings = fetch_inventory_item_settings(user_id, product_id)
+        except Exception as settings_error:
+            logger.warning(f"Inventory item settings unavailable, using defaults: {str(settings_error)}")
+            item_settings = []
+
+        network = build_network(policies['location'].unique(), network)
+        items, nodes, summary = allocate_safety_stock(
+            policies, network, item_settings, lead_time_days, time_limit_seconds, service_time_levels)
+        return jsonify({
+            'status': 'success',
+            'allocations': items.round(2).replace({np.nan: None}).to_dict('records'),
+            'nodes': nodes,
+            'summary': summary
+        }), 200
+    except Exception as e:
+        logger.error(f"Error in multi_echelon_inventory: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 200
+
+
 # Dynamic Rerouting API with Gemini
 @app.route('/api/rerouting/dynamic/', methods=['POST'])
 def dynamic_rerouting():
@@ -2932,12 +3042,16 @@ def geocode_locations(locations, gmaps_client):
             coordinates.append(None)
     return coordinates, failed_addresses
 
-def get_distance_matrix(depot, destinations, gmaps_client):
+def get_distance_matrix(depot, destinations, gmaps_client, coordinates=None):
     """Fetch time-based distance matrix using Google Maps API after geocoding and with batching."""
     all_locations_str = [depot] + destinations
-    app.logger.info(f"Attempting to geocode {len(all_locations_str)} locations for time matrix.")
-    
-    coordinates, failed_geocoding = geocode_locations(all_locations_str, gmaps_client)
+
+    if coordinates is None:
+        app.logger.info(f"Attempting to geocode {len(all_locations_str)} locations for time matrix.")
+        coordinates, failed_geocoding = geocode_locations(all_locations_str, gmaps_client)
+    else:
+        # Reuse coordinates already geocoded by the caller
+        failed_geocoding = [loc for loc, coord in zip(all_locations_str, coordinates) if coord is None]
     
     valid_indices = [i for i, coord in enumerate(coordinates) if coord is not None]
     valid_coordinates = [coord for coord in coordinates if coord is not None]
@@ -3021,12 +3135,16 @@ def get_distance_matrix(depot, destinations, gmaps_client):
         app.logger.error(traceback.format_exc())
         return None, failed_geocoding
 
-def get_physical_distance_matrix(depot, destinations, gmaps_client):
+def get_physical_distance_matrix(depot, destinations, gmaps_client, coordinates=None):
     """Fetch physical distance matrix using Google Maps API after geocoding and with batching."""
     all_locations_str = [depot] + destinations
-    app.logger.info(f"Attempting to geocode {len(all_locations_str)} locations for physical distance matrix.")
 
-    coordinates, failed_geocoding = geocode_locations(all_locations_str, gmaps_client)
+    if coordinates is None:
+        app.logger.info(f"Attempting to geocode {len(all_locations_str)} locations for physical distance matrix.")
+        coordinates, failed_geocoding = geocode_locations(all_locations_str, gmaps_client)
+    else:
+        # Reuse coordinates already geocoded by the caller
+        failed_geocoding = [loc for loc, coord in zip(all_locations_str, coordinates) if coord is None]
 
     valid_indices = [i for i, coord in enumerate(coordinates) if coord is not None]
     valid_coordinates = [coord for coord in coordinates if coord is not None]
@@ -3105,8 +3223,13 @@ def get_physical_distance_matrix(depot, destinations, gmaps_client):
         app.logger.error(traceback.format_exc())
         return None, failed_geocoding
 
-def create_ortools_route(depot, destinations, time_distance_matrix):
-    """Generates baseline VRP route using Google OR-Tools based on travel time."""
+def create_ortools_route(depot, destinations, time_distance_matrix, initial_route=None, time_limit_seconds=1):
+    """
+    Generates baseline VRP route using Google OR-Tools based on travel time.
+
+    If initial_route is given, the search is warm-started from it and improved
+    with guided local search for at most time_limit_seconds.
+    """
     num_locations = len(destinations) + 1
     manager = pywrapcp.RoutingIndexManager(num_locations, 1, 0)  # 1 vehicle, depot at index 0
     routing = pywrapcp.RoutingModel(manager)
@@ -3121,7 +3244,20 @@ def create_ortools_route(depot, destinations, time_distance_matrix):
     routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
     search_parameters = pywrapcp.DefaultRoutingSearchParameters()
     search_parameters.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-    solution = routing.SolveWithParameters(search_parameters)
+
+    initial_assignment = None
+    if initial_route:
+        search_parameters.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+        search_parameters.time_limit.seconds = int(time_limit_seconds)
+        routing.CloseModelWithParameters(search_parameters)
+        initial_assignment = routing.ReadAssignmentFromRoutes([initial_route[1:-1]], True)
+        if not initial_assignment:
+            app.logger.warning("OR-Tools could not read the initial route, solving from scratch.")
+
+    if initial_assignment:
+        solution = routing.SolveFromAssignmentWithParameters(initial_assignment, search_parameters)
+    else:
+        solution = routing.SolveWithParameters(search_parameters)
 
     if solution:
         route_indices = []
@@ -3284,13 +3420,18 @@ def calculate_fitness(route, time_distance_matrix, physical_distance_matrix, use
         
     return fitness
 
-def iafsa_optimize(depot, destinations, time_distance_matrix, physical_distance_matrix, user_weights, fuel_cost_per_km, num_fish=40, iterations=300, max_retries=3):
+def iafsa_optimize(depot, destinations, time_distance_matrix, physical_distance_matrix, user_weights, fuel_cost_per_km, num_fish=40, iterations=300, max_retries=3, progress_callback=None, cancel_event=None, ortools_route=None, initial_routes=None):
     """
     Optimize route using IAFSA with progressive improvement and priority-based strategy.
     Enhanced to ensure consistent performance advantage over OR-Tools for the selected priority.
+
+    progress_callback, if given, is called with a progress dict every ~10% of
+    iterations; setting cancel_event aborts the search with JobCancelled.
+    ortools_route skips the internal OR-Tools solve when the caller already has
+    one, and initial_routes are added to the fish population as seeds.
     """
     # Get initial route from OR-Tools
-    optimal_route_ortools = create_ortools_route(depot, destinations, time_distance_matrix)
+    optimal_route_ortools = ortools_route or create_ortools_route(depot, destinations, time_distance_matrix)
     if not optimal_route_ortools:
         app.logger.error("OR-Tools failed to find an initial solution.")
         return None, None
@@ -3491,6 +3632,10 @@ def iafsa_optimize(depot, destinations, time_distance_matrix, physical_distance_
         # Add the priority-specific routes to the population
         for route in priority_specific_routes:
             fish_population.append({'route': route, 'visual_range': random.uniform(0, 10)})
+
+        # Add caller-provided seeds (e.g. the previous solution when re-optimizing)
+        for route in initial_routes or []:
+            fish_population.append({'route': list(route), 'visual_range': random.uniform(0, 10)})
         
         # Find initial best fish
         current_best_fish = min(fish_population, 
@@ -3513,6 +3658,10 @@ def iafsa_optimize(depot, destinations, time_distance_matrix, physical_distance_
         improvement_threshold = 0.02  # 2% improvement threshold
         
         for iteration in range(int(current_iterations)):
+            if cancel_event is not None and cancel_event.is_set():
+                app.logger.info(f"IAFSA optimization cancelled at attempt {retry + 1}, iteration {iteration}")
+                raise JobCancelled()
+
             for fish in fish_population:
                 # Apply IAFSA behaviors with stronger mutation for higher priorities
                 mutation_intensity = 1.0
@@ -3588,6 +3737,19 @@ def iafsa_optimize(depot, destinations, time_distance_matrix, physical_distance_
             # Report progress at regular intervals for UI feedback
             if (iteration + 1) % progress_interval == 0:
                 app.logger.info(f"Iteration {iteration + 1}/{int(current_iterations)}, Current best fitness: {retry_best_fitness:.4f}")
+                if progress_callback:
+                    # Compare without the diversity penalty so the figure matches the OR-Tools baseline
+                    plain_fitness = calculate_fitness(current_best_fish['route'], time_distance_matrix,
+                                                      physical_distance_matrix, user_weights, fuel_cost_per_km)
+                    progress_callback({
+                        'attempt': retry + 1,
+                        'max_attempts': max_retries + 1,
+                        'iteration': iteration + 1,
+                        'iterations': int(current_iterations),
+                        'best_fitness': round(plain_fitness, 6),
+                        'ortools_fitness': round(ortools_fitness, 6),
+                        'improvement_vs_ortools': round((ortools_fitness - plain_fitness) / ortools_fitness * 100, 2) if ortools_fitness else 0
+                    })
             
             # Check for early stopping
             if no_improvement_count >= early_stopping_threshold:
@@ -3717,11 +3879,80 @@ def follow_behavior(fish, all_fish, time_distance_matrix, physical_distance_matr
         if perturbed_fitness < current_fitness:
             fish['route'] = perturbed_route
 
+# IAFSA search parameters used by the last-mile endpoint (part of the result cache key)
+IAFSA_PARAMS = {'num_fish': 40, 'iterations': 300, 'max_retries': 2}
+
+# Short improvement phase used when re-optimizing a previous solution
+INCREMENTAL_IAFSA_PARAMS = {'num_fish': 20, 'iterations': 60, 'max_retries': 0}
+INCREMENTAL_ORTOOLS_TIME_LIMIT = 1  # seconds
+
+# Limits of the multi-depot batch endpoint; problems are solved in worker processes
+ROUTE_BATCH_CONFIG = {
+    'max_workers': int(os.getenv('ROUTE_BATCH_WORKERS', os.cpu_count() or 2)),
+    'max_problems': int(os.getenv('ROUTE_BATCH_MAX_PROBLEMS', 100)),
+    'time_budget_seconds': int(os.getenv('ROUTE_BATCH_TIME_BUDGET_SECONDS', 300)),
+    'matrix_fetch_threads': 8
+}
+
+
+# How directions are returned with optimization results:
+# full embeds the Directions API response, polyline only the encoded overview
+# polyline, lazy none (fetch them later from the solution directions endpoint)
+DIRECTIONS_MODES = ('full', 'polyline', 'lazy')
+
+
+def route_cache_key(start_point, destinations, weights, fuel_cost_per_km, comparison_methods, directions_mode='full'):
+    """Canonical cache key for a route optimization request."""
+    normalize = lambda address: ' '.join(address.lower().split())
+    return make_cache_key(
+        normalize(start_point),
+        sorted(normalize(d) for d in destinations),
+        {k: float(v) for k, v in weights.items()},
+        float(fuel_cost_per_km),
+        sorted(comparison_methods),
+        IAFSA_PARAMS,
+        directions_mode
+    )
+
+
+def route_index_map(cached_destinations, destinations):
+    """
+    Map node indices of a cached result (0 = depot) to the destination order of
+    the current request (the cache key ignores destination order); None when
+    the order is the same.
+    """
+    normalize = lambda address: ' '.join(address.lower().split())
+    if [normalize(d) for d in cached_destinations] == [normalize(d) for d in destinations]:
+        return None
+
+    positions = {}
+    for index, address in enumerate(destinations, start=1):
+        positions.setdefault(normalize(address), []).append(index)
+    index_map = {0: 0}
+    for cached_index, address in enumerate(cached_destinations, start=1):
+        index_map[cached_index] = positions[normalize(address)].pop(0)
+    return index_map
+
+
+def remap_route_results(results, index_map):
+    """Translate the route indices of results in place with a route_index_map."""
+    for result in results.values():
+        if isinstance(result, dict) and result.get('route'):
+            result['route'] = [index_map[i] for i in result['route']]
+    return results
+
+
 def get_directions(route_indices, depot, destinations, gmaps_client):
     """Get directions for visualization using Google Maps API."""
     locations = [depot] + destinations
     waypoints = [locations[i] for i in route_indices[1:-1]]  # Skip first and last indices as they're the start/end point
-    
+
+    # Identical ordered waypoints always produce the same directions
+    cache_key = make_cache_key(locations[route_indices[0]], waypoints, locations[route_indices[-1]])
+    cached, _ = directions_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
         directions = gmaps_client.directions(
             origin=locations[route_indices[0]],
@@ -3730,11 +3961,761 @@ def get_directions(route_indices, depot, destinations, gmaps_client):
             optimize_waypoints=False,
             mode="driving"
         )
+        if directions:
+            directions_cache.set(cache_key, directions)
         return directions
     except Exception as e:
         app.logger.error(f"Error getting directions: {str(e)}")
         return None
 
+
+def directions_polyline(directions):
+    """Reduce a Directions API response to its encoded overview polyline and bounds."""
+    if not directions:
+        return None
+    return {
+        'polyline': directions[0].get('overview_polyline', {}).get('points'),
+        'bounds': directions[0].get('bounds')
+    }
+
+
+def attach_directions(results, depot, destinations, gmaps_client, directions_mode, solution_id):
+    """
+    Add directions to each algorithm result in the requested mode.
+
+    Directions are fetched once per distinct route and concurrently, so
+    algorithms that agree on a route (or the Google Maps placeholder, which
+    reuses a baseline route) share a single API call.
+    """
+    routes = {name: result['route'] for name, result in results.items() if result.get('route')}
+
+    if directions_mode == 'lazy' or gmaps_client is None:
+        for name, result in results.items():
+            result['directions'] = None
+            result['directions_url'] = f"/api/last-mile-delivery/solutions/{solution_id}/directions?algorithm={name}"
+        return results
+
+    distinct_routes = {}
+    for name, route in routes.items():
+        distinct_routes.setdefault(tuple(route), []).append(name)
+    app.logger.info(f"Fetching directions for {len(distinct_routes)} distinct routes ({len(routes)} results)")
+
+    fetched = {}
+    if distinct_routes:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(distinct_routes)) as executor:
+            futures = {route: executor.submit(get_directions, list(route), depot, destinations, gmaps_client)
+                       for route in distinct_routes}
+        for route, future in futures.items():
+            for name in distinct_routes[route]:
+                fetched[name] = future.result()
+
+    for name, result in results.items():
+        directions = fetched.get(name)
+        if directions_mode == 'polyline':
+            result['directions'] = None
+            result['polyline'] = directions_polyline(directions)
+        else:
+            result['directions'] = directions # Store the full directions object
+    return results
+
+def parse_route_optimization_request(data):
+    """
+    Validate and normalize a last-mile optimization request body.
+
+    Returns a params dict for run_route_optimization, or raises ValueError
+    with a client-facing message.
+    """
+    if not data:
+        raise ValueError('No data provided')
+
+    # Extract and validate input data
+    start_point = data.get('startPoint') or 'Bengaluru, Karnataka, India' # Default to Bengaluru
+    destinations = data.get('destinations', [])
+
+    # Extract and log weights with explicit validation
+    weights = data.get('weights', {'time': 33, 'cost': 33, 'carbon': 34})
+    app.logger.info(f"Received optimization weights (raw): {weights}")
+
+    # Validate weights are in percentage format (0-100)
+    time_weight = weights.get('time', 33)
+    cost_weight = weights.get('cost', 33)
+    carbon_weight = weights.get('carbon', 34)
+
+    # Check if weights might be in 0-1 scale instead of 0-100
+    if max(time_weight, cost_weight, carbon_weight) <= 1:
+        app.logger.warning(f"Weights appear to be in 0-1 scale instead of 0-100. Converting to percentages.")
+        weights = {
+            'time': time_weight * 100,
+            'cost': cost_weight * 100,
+            'carbon': carbon_weight * 100
+        }
+
+    app.logger.info(f"Using optimization weights: Time: {weights['time']}%, Cost: {weights['cost']}%, Carbon: {weights['carbon']}%")
+    app.logger.info(f"Sum of weights: {weights['time'] + weights['cost'] + weights['carbon']}%")
+
+    # Ensure destinations is a list of non-empty strings
+    if not isinstance(destinations, list) or not all(isinstance(d, str) and d.strip() for d in destinations):
+        app.logger.error(f"Invalid destinations format: {destinations}")
+        raise ValueError('Invalid destinations format. Expected a list of non-empty strings.')
+
+    if not destinations:
+        app.logger.warning("Optimization request received with no destinations.")
+        raise ValueError('No destinations provided')
+
+    return {
+        'start_point': start_point,
+        'destinations': destinations,
+        'weights': weights,
+        'fuel_cost_per_km': data.get('fuelCostPerKm', 0.15),
+        'comparison_methods': data.get('comparison', ['ortools', 'iafsa', 'googlemaps']), # Include googlemaps by default if comparison is missing
+        'directions_mode': parse_directions_mode(data)
+    }
+
+
+def parse_directions_mode(data):
+    """Read the optional "directions" option of a request body."""
+    directions_mode = data.get('directions', 'full')
+    if directions_mode not in DIRECTIONS_MODES:
+        raise ValueError(f"Invalid directions option. Expected one of: {', '.join(DIRECTIONS_MODES)}")
+    return directions_mode
+
+
+def get_cached_route_result(params):
+    """Return (results, age_seconds) for a cached identical request, or (None, None)."""
+    key = route_cache_key(params['start_point'], params['destinations'], params['weights'],
+                          params['fuel_cost_per_km'], params['comparison_methods'], params['directions_mode'])
+    cached, age = route_result_cache.get(key)
+    if cached is None:
+        return None, None
+    # The stored solution backs solution_id (incremental edits, lazy directions)
+    solution, _ = route_solution_store.get(cached['results'].get('solution_id'))
+    if solution is None:
+        return None, None
+    results = copy.deepcopy(cached['results'])
+    index_map = route_index_map(cached['destinations'], params['destinations'])
+    if index_map is None:
+        return results, age
+
+    # Different destination order: remap the routes and store a solution in
+    # the caller's order, so index-based edits refer to the caller's stops
+    remap_route_results(results, index_map)
+    old_solution_id = results['solution_id']
+    order = sorted(index_map, key=index_map.get)
+    solution_id = store_route_solution(
+        solution['start_point'], params['destinations'],
+        [solution['coordinates'][i] for i in order],
+        [[solution['time_matrix'][i][j] for j in order] for i in order],
+        [[solution['physical_matrix'][i][j] for j in order] for i in order],
+        solution['weights'], solution['fuel_cost_per_km'], solution['comparison_methods'], results)
+    for result in results.values():
+        if isinstance(result, dict) and result.get('directions_url'):
+            result['directions_url'] = result['directions_url'].replace(old_solution_id, solution_id)
+    results['solution_id'] = solution_id
+    return results, age
+
+
+def route_metrics(route_indices, time_matrix, physical_matrix, fuel_cost_per_km):
+    """Total time, distance (km), fuel cost and carbon (kg) of a route."""
+    total_time = sum(time_matrix[route_indices[i]][route_indices[i+1]] for i in range(len(route_indices)-1))
+    physical_distance_meters = sum(physical_matrix[route_indices[i]][route_indices[i+1]] for i in range(len(route_indices)-1))
+    physical_distance_km = physical_distance_meters / 1000 # Convert to km
+    return {
+        'distance': physical_distance_km,
+        'time': total_time,
+        'cost': physical_distance_km * fuel_cost_per_km,
+        'carbon': physical_distance_km * 0.12  # Example CO2 factor: 0.12 kg/km
+    }
+
+
+def build_googlemaps_comparison(results):
+    """Placeholder Google Maps KPIs derived from the OR-Tools (or IAFSA) result."""
+    # TODO: Implement actual Google Maps route calculation if needed,
+    # or use OR-Tools/IAFSA data as a proxy if it's just for KPI display.
+    # For now, create placeholder KPIs based on OR-Tools if available.
+    if 'ortools' in results:
+        baseline, factor = results['ortools'], 1.05 # Assume 5% less optimal
+    elif 'iafsa' in results: # Fallback to IAFSA if OR-Tools failed
+        baseline, factor = results['iafsa'], 1.1 # Assume 10% less optimal than IAFSA
+    else: # No baseline data available
+        baseline, factor = None, 0
+
+    # Directions are attached afterwards and reuse the baseline route's response
+    return {
+        'route': baseline.get('route') if baseline else None, # Store route indices (placeholder)
+        'distance': baseline['distance'] * factor if baseline else 0,
+        'time': baseline['time'] * factor if baseline else 0,
+        'cost': baseline['cost'] * factor if baseline else 0,
+        'carbon': baseline['carbon'] * factor if baseline else 0
+    }
+
+
+def store_route_solution(start_point, destinations, coordinates, time_matrix, physical_matrix,
+                         weights, fuel_cost_per_km, comparison_methods, results):
+    """Keep the matrices and routes of a solution so later edits can be re-optimized incrementally."""
+    solution_id = str(uuid.uuid4())
+    route_solution_store.set(solution_id, {
+        'start_point': start_point,
+        'destinations': list(destinations),
+        'coordinates': coordinates,
+        'time_matrix': time_matrix,
+        'physical_matrix': physical_matrix,
+        'weights': weights,
+        'fuel_cost_per_km': fuel_cost_per_km,
+        'comparison_methods': comparison_methods,
+        'routes': {name: result['route'] for name, result in results.items()
+                   if name in ('ortools', 'iafsa') and result.get('route')}
+    })
+    return solution_id
+
+
+def solve_route_problem(start_point, destinations, time_matrix, physical_matrix, weights, fuel_cost_per_km,
+                        comparison_methods, progress_callback=None, cancel_event=None):
+    """
+    Solve one depot's routes with OR-Tools and IAFSA on precomputed matrices.
+
+    When cancel_event is a Deadline, reaching it stops IAFSA early and keeps
+    whatever results exist instead of raising JobCancelled.
+    """
+    results = {}
+
+    # Calculate OR-Tools route if requested
+    ortools_route_indices = None
+    if 'ortools' in comparison_methods:
+        app.logger.info("Calculating OR-Tools route...")
+        ortools_route_indices = create_ortools_route(start_point, destinations, time_matrix)
+
+        if ortools_route_indices:
+            app.logger.info(f"OR-Tools route found: {ortools_route_indices}")
+            results['ortools'] = {
+                'route': ortools_route_indices, # Store the indices
+                **route_metrics(ortools_route_indices, time_matrix, physical_matrix, fuel_cost_per_km)
+            }
+        else:
+             app.logger.warning("OR-Tools failed to find a route.")
+
+    # Calculate IAFSA route if requested (always calculate for comparison baseline)
+    # if 'iafsa' in comparison_methods: # Calculate IAFSA regardless for baseline
+    app.logger.info("Calculating IAFSA route...")
+    try:
+        iafsa_route_indices, _ = iafsa_optimize(
+            start_point,
+            destinations,
+            time_matrix,
+            physical_matrix,
+            weights,
+            fuel_cost_per_km,
+            progress_callback=progress_callback,
+            cancel_event=cancel_event,
+            ortools_route=ortools_route_indices, # Reuse the baseline instead of solving it twice
+            **IAFSA_PARAMS
+        )
+    except JobCancelled:
+        if not isinstance(cancel_event, Deadline):
+            raise
+        app.logger.warning("IAFSA stopped at the time budget; returning the remaining results.")
+        iafsa_route_indices = None
+
+    if iafsa_route_indices:
+        app.logger.info(f"IAFSA route found: {iafsa_route_indices}")
+
+        # Log route diversity metrics to verify the algorithm is working correctly
+        if 'ortools' in results:
+            ortools_route = results['ortools']['route']
+            diversity = calculate_route_diversity_penalty(iafsa_route_indices, ortools_route)
+            app.logger.info(f"Route diversity metric (0=different, 1=identical): {diversity:.4f}")
+
+            if diversity < 0.5:
+                app.logger.info("IAFSA found a significantly different route than OR-Tools")
+            elif diversity < 0.8:
+                app.logger.info("IAFSA found a moderately different route than OR-Tools")
+            else:
+                app.logger.info("IAFSA found a route similar to OR-Tools")
+
+        results['iafsa'] = {
+            'route': iafsa_route_indices, # Store the indices
+            **route_metrics(iafsa_route_indices, time_matrix, physical_matrix, fuel_cost_per_km)
+        }
+    else:
+        app.logger.warning("IAFSA failed to find a route.")
+        # If IAFSA fails, we might not have a baseline. Consider returning an error or default.
+        # For now, just don't add it to results.
+
+    return results
+
+
+def run_route_optimization(params, progress_callback=None, cancel_event=None):
+    """
+    Run the OR-Tools / IAFSA / Google Maps comparison for parsed request params.
+
+    Returns a (payload, status_code) tuple so it can back both the synchronous
+    endpoint and background jobs.
+    """
+    start_point = params['start_point']
+    destinations = params['destinations']
+    weights = params['weights']
+    fuel_cost_per_km = params['fuel_cost_per_km']
+    comparison_methods = params['comparison_methods']
+
+    # Initialize Google Maps client
+    gmaps_api_key = os.environ.get('GOOGLE_MAPS_API_KEY')
+    if not gmaps_api_key:
+        app.logger.error("Google Maps API key not configured in environment variables.")
+        return {'error': 'Google Maps API key not configured'}, 500
+
+    gmaps = googlemaps.Client(key=gmaps_api_key)
+
+    # Geocode once and share the coordinates between both matrices
+    coordinates, failed_addresses = geocode_locations([start_point] + destinations, gmaps)
+
+    # Get time-based distance matrix
+    time_matrix, _ = get_distance_matrix(start_point, destinations, gmaps, coordinates=coordinates)
+
+    # Get physical distance matrix
+    physical_matrix, _ = get_physical_distance_matrix(start_point, destinations, gmaps, coordinates=coordinates)
+
+    # Check if matrices were successfully calculated
+    if time_matrix is None or physical_matrix is None:
+        error_message = f"Failed to calculate distance matrices. Check server logs. Addresses that failed geocoding: {failed_addresses}"
+        app.logger.error(error_message)
+        # Return 500 because the failure is internal (API call failed)
+        return {'error': error_message}, 500
+
+    results = solve_route_problem(
+        start_point, destinations, time_matrix, physical_matrix, weights, fuel_cost_per_km,
+        comparison_methods, progress_callback=progress_callback, cancel_event=cancel_event)
+
+    return finalize_route_results(params, coordinates, time_matrix, physical_matrix, results, gmaps)
+
+
+def finalize_route_results(params, coordinates, time_matrix, physical_matrix, results, gmaps, cache_result=True):
+    """
+    Add the Google Maps comparison, store the solution, attach directions and
+    cache the payload. Returns a (payload, status_code) tuple.
+    """
+    start_point = params['start_point']
+    destinations = params['destinations']
+    weights = params['weights']
+    fuel_cost_per_km = params['fuel_cost_per_km']
+    comparison_methods = params['comparison_methods']
+    directions_mode = params.get('directions_mode', 'full')
+
+    # Handle Google Maps comparison (placeholder calculation for now)
+    if 'googlemaps' in comparison_methods:
+        app.logger.info("Generating placeholder Google Maps comparison data...")
+        results['googlemaps'] = build_googlemaps_comparison(results)
+
+    # Check if any results were generated
+    if not results:
+         app.logger.error("No optimization algorithms succeeded.")
+         return {'error': 'Optimization failed for all selected algorithms.'}, 500
+
+    solution_id = store_route_solution(
+        start_point, destinations, coordinates, time_matrix, physical_matrix,
+        weights, fuel_cost_per_km, comparison_methods, results)
+
+    # Get directions for visualization
+    # Note: get_directions needs the original string addresses, not indices
+    attach_directions(results, start_point, destinations, gmaps, directions_mode, solution_id)
+    results['solution_id'] = solution_id
+
+    app.logger.info(f"Optimization successful. Returning results for: {list(results.keys())}")
+    if cache_result:
+        key = route_cache_key(start_point, destinations, weights, fuel_cost_per_km, comparison_methods, directions_mode)
+        route_result_cache.set(key, {'destinations': list(destinations), 'results': results})
+    return results, 200
+
+
+def fetch_matrix_block(origin_coords, destination_coords, gmaps_client):
+    """
+    Fetch travel times and physical distances for every origin/destination pair.
+
+    Returns (time_block, distance_block) as len(origins) x len(destinations)
+    lists; a None coordinate or a failed element yields inf.
+    """
+    time_block = [[float('inf')] * len(destination_coords) for _ in origin_coords]
+    distance_block = [[float('inf')] * len(destination_coords) for _ in origin_coords]
+    valid_origins = [i for i, coord in enumerate(origin_coords) if coord is not None]
+    valid_destinations = [j for j, coord in enumerate(destination_coords) if coord is not None]
+    if not valid_origins or not valid_destinations:
+        return time_block, distance_block
+
+    # Same request limits as the full matrix fetch
+    MAX_ORIGINS_PER_REQUEST = 10
+    MAX_ELEMENTS_PER_REQUEST = 100
+
+    for i_batch_start in range(0, len(valid_origins), MAX_ORIGINS_PER_REQUEST):
+        batch_origins = valid_origins[i_batch_start:i_batch_start + MAX_ORIGINS_PER_REQUEST]
+        max_destinations_this_batch = max(1, MAX_ELEMENTS_PER_REQUEST // len(batch_origins))
+        for j_batch_start in range(0, len(valid_destinations), max_destinations_this_batch):
+            batch_destinations = valid_destinations[j_batch_start:j_batch_start + max_destinations_this_batch]
+            matrix_response = gmaps_client.distance_matrix(
+                [origin_coords[i] for i in batch_origins],
+                [destination_coords[j] for j in batch_destinations],
+                mode="driving"
+            )
+            for i_in_batch, row in enumerate(matrix_response.get('rows', [])):
+                for j_in_batch, element in enumerate(row.get('elements', [])):
+                    i, j = batch_origins[i_in_batch], batch_destinations[j_in_batch]
+                    if element.get('status') == 'OK':
+                        if 'duration' in element:
+                            time_block[i][j] = element['duration']['value']
+                        if 'distance' in element:
+                            distance_block[i][j] = element['distance']['value']
+                    else:
+                        app.logger.warning(f"  Element status not OK for ({i}, {j}): {element.get('status')}")
+    return time_block, distance_block
+
+
+def blended_cost_matrix(time_matrix, physical_matrix, weights, fuel_cost_per_km):
+    """Per-edge cost combining time, fuel cost and carbon by the user's weight proportions."""
+    total_weight = sum(weights.get(k, 0) for k in ('time', 'cost', 'carbon')) or 1
+    w_time = weights.get('time', 0) / total_weight
+    w_cost = weights.get('cost', 0) / total_weight
+    w_carbon = weights.get('carbon', 0) / total_weight
+    size = len(time_matrix)
+    return [[w_time * time_matrix[i][j]
+             + (w_cost * fuel_cost_per_km + w_carbon * 0.12) * physical_matrix[i][j] / 1000
+             for j in range(size)] for i in range(size)]
+
+
+def cheapest_insertion(route, new_nodes, cost_matrix):
+    """Insert each new node where it adds the least cost to a depot-to-depot route."""
+    route = list(route)
+    for node in new_nodes:
+        best_position, best_delta = 1, float('inf')
+        for position in range(1, len(route)):
+            previous_node, next_node = route[position - 1], route[position]
+            delta = (cost_matrix[previous_node][node] + cost_matrix[node][next_node]
+                     - cost_matrix[previous_node][next_node])
+            if delta < best_delta:
+                best_position, best_delta = position, delta
+        route.insert(best_position, node)
+    return route
+
+
+def run_incremental_route_optimization(solution, add_destinations, remove_destinations, directions_mode='full'):
+    """
+    Re-optimize a stored solution after stops were added or removed.
+
+    Only the matrix rows/columns of new stops are fetched; OR-Tools and IAFSA
+    are warm-started from the previous routes with new stops placed by
+    cheapest insertion, followed by a short improvement phase.
+    Returns a (payload, status_code) tuple.
+    """
+    start_point = solution['start_point']
+    old_destinations = solution['destinations']
+    weights = solution['weights']
+    fuel_cost_per_km = solution['fuel_cost_per_km']
+    comparison_methods = solution['comparison_methods']
+
+    # Resolve removals given as addresses or 1-based destination indices of the stored solution
+    removed_indices = set()
+    for stop in remove_destinations:
+        if isinstance(stop, int) and 1 <= stop <= len(old_destinations):
+            removed_indices.add(stop)
+        else:
+            index = next((i for i, d in enumerate(old_destinations, start=1)
+                          if d == stop and i not in removed_indices), None)
+            if index is None:
+                return {'error': f'Stop to remove not found in solution: {stop}'}, 400
+            removed_indices.add(index)
+
+    kept_indices = [0] + [i for i in range(1, len(old_destinations) + 1) if i not in removed_indices]
+    destinations = [old_destinations[i - 1] for i in kept_indices[1:]] + list(add_destinations)
+    if not destinations:
+        return {'error': 'No destinations left after applying the changes'}, 400
+    index_map = {old_index: new_index for new_index, old_index in enumerate(kept_indices)}
+    new_nodes = list(range(len(kept_indices), len(kept_indices) + len(add_destinations)))
+
+    gmaps = None
+    coordinates = [solution['coordinates'][i] for i in kept_indices]
+    size = len(destinations) + 1
+    time_matrix = [[float('inf')] * size for _ in range(size)]
+    physical_matrix = [[float('inf')] * size for _ in range(size)]
+    for new_i, old_i in enumerate(kept_indices):
+        for new_j, old_j in enumerate(kept_indices):
+            time_matrix[new_i][new_j] = solution['time_matrix'][old_i][old_j]
+            physical_matrix[new_i][new_j] = solution['physical_matrix'][old_i][old_j]
+
+    if add_destinations:
+        gmaps_api_key = os.environ.get('GOOGLE_MAPS_API_KEY')
+        if not gmaps_api_key:
+            app.logger.error("Google Maps API key not configured in environment variables.")
+            return {'error': 'Google Maps API key not configured'}, 500
+        gmaps = googlemaps.Client(key=gmaps_api_key)
+
+        new_coordinates, failed_addresses = geocode_locations(list(add_destinations), gmaps)
+        if failed_addresses:
+            return {'error': f'Failed to geocode new destinations: {failed_addresses}'}, 400
+        coordinates += new_coordinates
+
+        # Existing locations -> new stops, then new stops -> every location
+        time_block, distance_block = fetch_matrix_block(coordinates[:len(kept_indices)], new_coordinates, gmaps)
+        for i in range(len(kept_indices)):
+            for k, node in enumerate(new_nodes):
+                time_matrix[i][node] = time_block[i][k]
+                physical_matrix[i][node] = distance_block[i][k]
+        time_block, distance_block = fetch_matrix_block(new_coordinates, coordinates, gmaps)
+        for k, node in enumerate(new_nodes):
+            time_matrix[node] = time_block[k]
+            physical_matrix[node] = distance_block[k]
+        app.logger.info(f"Extended matrices with {len(new_nodes)} new stops ({len(new_nodes) * (2 * size - len(new_nodes))} cells fetched)")
+
+    # Carry the previous routes over to the new numbering and insert the new stops
+    seeds = {}
+    blended_costs = blended_cost_matrix(time_matrix, physical_matrix, weights, fuel_cost_per_km)
+    for name, old_route in solution['routes'].items():
+        carried = [index_map[node] for node in old_route if node in index_map]
+        cost_matrix = time_matrix if name == 'ortools' else blended_costs
+        seeds[name] = cheapest_insertion(carried, new_nodes, cost_matrix)
+    if 'ortools' not in seeds:
+        seeds['ortools'] = seeds.get('iafsa') or cheapest_insertion([0, 0], list(range(1, size)), time_matrix)
+
+    results = {}
+    ortools_route_indices = create_ortools_route(
+        start_point, destinations, time_matrix,
+        initial_route=seeds['ortools'], time_limit_seconds=INCREMENTAL_ORTOOLS_TIME_LIMIT)
+    if ortools_route_indices and 'ortools' in comparison_methods:
+        results['ortools'] = {
+            'route': ortools_route_indices,
+            **route_metrics(ortools_route_indices, time_matrix, physical_matrix, fuel_cost_per_km)
+        }
+
+    iafsa_route_indices, _ = iafsa_optimize(
+        start_point,
+        destinations,
+        time_matrix,
+        physical_matrix,
+        weights,
+        fuel_cost_per_km,
+        ortools_route=ortools_route_indices or seeds['ortools'],
+        initial_routes=[seeds.get('iafsa', seeds['ortools'])],
+        **INCREMENTAL_IAFSA_PARAMS
+    )
+    if iafsa_route_indices:
+        results['iafsa'] = {
+            'route': iafsa_route_indices,
+            **route_metrics(iafsa_route_indices, time_matrix, physical_matrix, fuel_cost_per_km)
+        }
+
+    if not results:
+        return {'error': 'Optimization failed for all selected algorithms.'}, 500
+
+    if 'googlemaps' in comparison_methods:
+        results['googlemaps'] = build_googlemaps_comparison(results)
+
+    solution_id = store_route_solution(
+        start_point, destinations, coordinates, time_matrix, physical_matrix,
+        weights, fuel_cost_per_km, comparison_methods, results)
+
+    if gmaps is None and directions_mode != 'lazy':
+        gmaps_api_key = os.environ.get('GOOGLE_MAPS_API_KEY')
+        gmaps = googlemaps.Client(key=gmaps_api_key) if gmaps_api_key else None
+    attach_directions(results, start_point, destinations, gmaps, directions_mode, solution_id)
+    results['solution_id'] = solution_id
+    results['destinations'] = destinations
+    return results, 200
+
+
+def normalize_address(address):
+    """Case- and whitespace-insensitive form of an address, used to share lookups."""
+    return ' '.join(address.lower().split())
+
+
+def fetch_batch_matrices(problems, gmaps_client):
+    """
+    Geocode and fetch matrix cells for many problems, each distinct address and
+    origin/destination pair only once.
+
+    Returns (coordinates, cells, failed_origins, stats): coordinates and cells
+    are keyed by normalized address, cells map (origin, destination) to
+    (seconds, meters), failed_origins are addresses whose row fetch raised.
+    """
+    addresses = {}
+    for params in problems:
+        for address in [params['start_point']] + params['destinations']:
+            addresses.setdefault(normalize_address(address), address)
+    keys = list(addresses)
+    geocoded, _ = geocode_locations([addresses[k] for k in keys], gmaps_client)
+    coordinates = dict(zip(keys, geocoded))
+
+    # Every origin's row only needs the destinations it shares a problem with
+    needed = {}
+    cells_requested = 0
+    for params in problems:
+        locations = [k for k in dict.fromkeys(normalize_address(a) for a in [params['start_point']] + params['destinations'])
+                     if coordinates[k] is not None]
+        cells_requested += len(locations) * (len(locations) - 1)
+        for origin in locations:
+            needed.setdefault(origin, set()).update(d for d in locations if d != origin)
+
+    # Origins needing the same destinations are fetched together
+    blocks = {}
+    for origin, destinations in needed.items():
+        if destinations:
+            blocks.setdefault(frozenset(destinations), []).append(origin)
+
+    cells = {}
+    failed_origins = set()
+    if blocks:
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(ROUTE_BATCH_CONFIG['matrix_fetch_threads'], len(blocks))) as executor:
+            futures = {}
+            for destinations, origins in blocks.items():
+                destinations = sorted(destinations)
+                future = executor.submit(fetch_matrix_block, [coordinates[o] for o in origins],
+                                         [coordinates[d] for d in destinations], gmaps_client)
+                futures[future] = (origins, destinations)
+            for future in concurrent.futures.as_completed(futures):
+                origins, destinations = futures[future]
+                try:
+                    time_block, distance_block = future.result()
+                except Exception as e:
+                    app.logger.error(f"Error fetching matrix block for {len(origins)} origins: {str(e)}")
+                    failed_origins.update(origins)
+                    continue
+                for i, origin in enumerate(origins):
+                    for j, destination in enumerate(destinations):
+                        cells[(origin, destination)] = (time_block[i][j], distance_block[i][j])
+
+    stats = {
+        'addresses_requested': sum(len(p['destinations']) + 1 for p in problems),
+        'addresses_geocoded': len(keys),
+        'matrix_cells_requested': cells_requested,
+        'matrix_cells_fetched': len(cells)
+    }
+    app.logger.info(f"Batch matrices: geocoded {stats['addresses_geocoded']}/{stats['addresses_requested']} addresses, "
+                    f"fetched {stats['matrix_cells_fetched']}/{stats['matrix_cells_requested']} cells")
+    return coordinates, cells, failed_origins, stats
+
+
+def build_problem_matrices(params, coordinates, cells):
+    """Assemble one problem's coordinate list and time/physical matrices from shared batch lookups."""
+    keys = [normalize_address(a) for a in [params['start_point']] + params['destinations']]
+    missing = (float('inf'), float('inf'))
+    time_matrix = [[0 if origin == destination else cells.get((origin, destination), missing)[0]
+                    for destination in keys] for origin in keys]
+    physical_matrix = [[0 if origin == destination else cells.get((origin, destination), missing)[1]
+                        for destination in keys] for origin in keys]
+    return [coordinates[k] for k in keys], time_matrix, physical_matrix
+
+
+def solve_batch_route_problem(solve_args, deadline):
+    """Worker-process entry point for one batch problem; returns None if the budget ran out before it started."""
+    if time.time() >= deadline:
+        return None
+    return solve_route_problem(*solve_args, cancel_event=Deadline(deadline))
+
+
+def run_batch_route_optimization(problems, time_budget_seconds, use_cache=True, progress_callback=None, cancel_event=None):
+    """
+    Optimize routes for many (depot, destinations, weights) problems in one call.
+
+    problems is a list of (problem_id, params) pairs. Geocoding and matrix cells
+    are shared across problems, solving runs on a process pool, and IAFSA stops
+    at the time budget (problems keep their OR-Tools route). Returns a
+    (payload, status_code) tuple.
+    """
+    started = time.time()
+    deadline = started + time_budget_seconds
+    outcomes = [None] * len(problems)
+    completed = 0
+
+    def record(index, outcome):
+        nonlocal completed
+        outcomes[index] = {'id': problems[index][0], **outcome}
+        completed += 1
+        if progress_callback:
+            progress_callback({'completed': completed, 'total': len(problems),
+                               'elapsed_seconds': round(time.time() - started, 1)})
+
+    pending = []
+    for index, (_, params) in enumerate(problems):
+        cached_results, _ = get_cached_route_result(params) if use_cache else (None, None)
+        if cached_results is not None:
+            record(index, {'status': 'completed', 'cached': True, 'results': cached_results})
+        else:
+            pending.append(index)
+
+    matrix_stats = {}
+    if pending:
+        gmaps_api_key = os.environ.get('GOOGLE_MAPS_API_KEY')
+        if not gmaps_api_key:
+            app.logger.error("Google Maps API key not configured in environment variables.")
+            return {'error': 'Google Maps API key not configured'}, 500
+        gmaps = googlemaps.Client(key=gmaps_api_key)
+
+        coordinates, cells, failed_origins, matrix_stats = fetch_batch_matrices(
+            [problems[i][1] for i in pending], gmaps)
+
+        matrices = {}
+        for index in pending:
+            params = problems[index][1]
+            problem_coordinates, time_matrix, physical_matrix = build_problem_matrices(params, coordinates, cells)
+            keys = {normalize_address(a) for a in [params['start_point']] + params['destinations']}
+            failed_addresses = [a for a, c in zip([params['start_point']] + params['destinations'], problem_coordinates) if c is None]
+            if keys & failed_origins or len(problem_coordinates) - len(failed_addresses) < 2:
+                record(index, {'status': 'failed', 'error': f"Failed to calculate distance matrices. Addresses that failed geocoding: {failed_addresses}"})
+            else:
+                matrices[index] = (problem_coordinates, time_matrix, physical_matrix)
+
+        if matrices:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(ROUTE_BATCH_CONFIG['max_workers'], len(matrices)),
+                initializer=random.seed) # Forked workers would otherwise share one random state
+            try:
+                futures = {}
+                for index, (_, time_matrix, physical_matrix) in matrices.items():
+                    params = problems[index][1]
+                    solve_args = (params['start_point'], params['destinations'], time_matrix, physical_matrix,
+                                  params['weights'], params['fuel_cost_per_km'], params['comparison_methods'])
+                    futures[executor.submit(solve_batch_route_problem, solve_args, deadline)] = index
+
+                not_done = set(futures)
+                while not_done:
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise JobCancelled()
+                    done, not_done = concurrent.futures.wait(
+                        not_done, timeout=1, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        index = futures[future]
+                        params = problems[index][1]
+                        problem_coordinates, time_matrix, physical_matrix = matrices[index]
+                        try:
+                            results = future.result()
+                        except Exception as e:
+                            app.logger.error(f"Batch problem {problems[index][0]} failed: {str(e)}")
+                            record(index, {'status': 'failed', 'error': str(e)})
+                            continue
+                        if results is None:
+                            record(index, {'status': 'timeout', 'error': 'Time budget exhausted before this problem was solved'})
+                            continue
+                        # IAFSA cut short by the budget: return what we have but do not cache it
+                        timed_out = 'iafsa' not in results and time.time() >= deadline
+                        payload, status_code = finalize_route_results(
+                            params, problem_coordinates, time_matrix, physical_matrix, results, gmaps,
+                            cache_result=not timed_out)
+                        if status_code >= 400:
+                            record(index, {'status': 'failed', 'error': payload.get('error')})
+                        else:
+                            record(index, {'status': 'completed', 'cached': False, 'timed_out': timed_out, 'results': payload})
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    summary = {
+        'problems': len(problems),
+        'completed': sum(1 for o in outcomes if o['status'] == 'completed'),
+        'failed': sum(1 for o in outcomes if o['status'] == 'failed'),
+        'timed_out': sum(1 for o in outcomes if o['status'] == 'timeout' or o.get('timed_out')),
+        'cache_hits': sum(1 for o in outcomes if o.get('cached')),
+        'elapsed_seconds': round(time.time() - started, 2),
+        'time_budget_seconds': time_budget_seconds,
+        **matrix_stats
+    }
+    app.logger.info(f"Batch route optimization finished: {summary}")
+    return {'results': outcomes, 'summary': summary}, 200
+
+
 @app.route('/api/last-mile-delivery/optimize', methods=['POST'])
 def last_mile_delivery_optimize():
     """
@@ -3746,209 +4727,323 @@ def last_mile_delivery_optimize():
     - weights: object with time, cost, carbon priorities (values from 0-1)
     - fuelCostPerKm: number (fuel cost per kilometer)
     - comparison: array of strings (which algorithms to compare, e.g., ["ortools", "iafsa"])
+    - async: boolean (optional; queue the optimization and return a job id immediately)
+    - cache: boolean (optional; set to false to bypass the result cache)
+    - directions: string (optional; "full" (default) embeds Directions API responses,
+      "polyline" only encoded polylines, "lazy" none - fetch them per algorithm from
+      /api/last-mile-delivery/solutions/<solution_id>/directions)
     """
     try:
         data = request.get_json()
         app.logger.info(f"Received optimization request: {data}")
-        
-        # Extract and validate input data
-        start_point = data.get('startPoint') or 'Bengaluru, Karnataka, India' # Default to Bengaluru
-        destinations = data.get('destinations', [])
-        
-        # Extract and log weights with explicit validation
-        weights = data.get('weights', {'time': 33, 'cost': 33, 'carbon': 34})
-        app.logger.info(f"Received optimization weights (raw): {weights}")
-        
-        # Validate weights are in percentage format (0-100)
-        time_weight = weights.get('time', 33)
-        cost_weight = weights.get('cost', 33)
-        carbon_weight = weights.get('carbon', 34)
-        
-        # Check if weights might be in 0-1 scale instead of 0-100
-        if max(time_weight, cost_weight, carbon_weight) <= 1:
-            app.logger.warning(f"Weights appear to be in 0-1 scale instead of 0-100. Converting to percentages.")
-            weights = {
-                'time': time_weight * 100,
-                'cost': cost_weight * 100,
-                'carbon': carbon_weight * 100
-            }
-        
-        app.logger.info(f"Using optimization weights: Time: {weights['time']}%, Cost: {weights['cost']}%, Carbon: {weights['carbon']}%")
-        app.logger.info(f"Sum of weights: {weights['time'] + weights['cost'] + weights['carbon']}%")
-        
-        # Ensure destinations is a list of non-empty strings
-        if not isinstance(destinations, list) or not all(isinstance(d, str) and d.strip() for d in destinations):
-             app.logger.error(f"Invalid destinations format: {destinations}")
-             return jsonify({'error': 'Invalid destinations format. Expected a list of non-empty strings.'}), 400
-
-        fuel_cost_per_km = data.get('fuelCostPerKm', 0.15)
-        comparison_methods = data.get('comparison', ['ortools', 'iafsa', 'googlemaps']) # Include googlemaps by default if comparison is missing
-        
-        if not destinations:
-            app.logger.warning("Optimization request received with no destinations.")
-            return jsonify({'error': 'No destinations provided'}), 400
-            
-        # Initialize Google Maps client
-        gmaps_api_key = os.environ.get('GOOGLE_MAPS_API_KEY')
-        if not gmaps_api_key:
-            app.logger.error("Google Maps API key not configured in environment variables.")
-            return jsonify({'error': 'Google Maps API key not configured'}), 500
-            
-        gmaps = googlemaps.Client(key=gmaps_api_key)
-        
-        # Get time-based distance matrix
-        time_matrix, failed_time_geocoding = get_distance_matrix(start_point, destinations, gmaps)
-        
-        # Get physical distance matrix
-        physical_matrix, failed_physical_geocoding = get_physical_distance_matrix(start_point, destinations, gmaps)
 
-        # Combine failed addresses
-        failed_addresses = list(set((failed_time_geocoding or []) + (failed_physical_geocoding or [])))
-        
-        # Check if matrices were successfully calculated
-        if time_matrix is None or physical_matrix is None:
-            error_message = f"Failed to calculate distance matrices. Check server logs. Addresses that failed geocoding: {failed_addresses}"
-            app.logger.error(error_message)
-            # Return 500 because the failure is internal (API call failed)
-            return jsonify({'error': error_message}), 500 
-            
-        # Results object to return
-        results = {}
-        
-        # Calculate OR-Tools route if requested
-        if 'ortools' in comparison_methods:
-            app.logger.info("Calculating OR-Tools route...")
-            ortools_route_indices = create_ortools_route(start_point, destinations, time_matrix)
-            
-            if ortools_route_indices:
-                app.logger.info(f"OR-Tools route found: {ortools_route_indices}")
-                # Calculate metrics for OR-Tools route
-                ortools_time = sum(time_matrix[ortools_route_indices[i]][ortools_route_indices[i+1]] for i in range(len(ortools_route_indices)-1))
-                ortools_physical_distance_meters = sum(physical_matrix[ortools_route_indices[i]][ortools_route_indices[i+1]] for i in range(len(ortools_route_indices)-1))
-                ortools_physical_distance_km = ortools_physical_distance_meters / 1000 # Convert to km
-                ortools_cost = ortools_physical_distance_km * fuel_cost_per_km
-                ortools_carbon = ortools_physical_distance_km * 0.12  # Example CO2 factor: 0.12 kg/km
-                
-                # Get directions for visualization
-                # Note: get_directions needs the original string addresses, not indices
-                ortools_directions = get_directions(ortools_route_indices, start_point, destinations, gmaps)
-                
-                results['ortools'] = {
-                    'route': ortools_route_indices, # Store the indices
-                    'distance': ortools_physical_distance_km,
-                    'time': ortools_time,
-                    'cost': ortools_cost,
-                    'carbon': ortools_carbon,
-                    'directions': ortools_directions # Store the full directions object
-                }
-            else:
-                 app.logger.warning("OR-Tools failed to find a route.")
-        
-        # Calculate IAFSA route if requested (always calculate for comparison baseline)
-        # if 'iafsa' in comparison_methods: # Calculate IAFSA regardless for baseline
-        app.logger.info("Calculating IAFSA route...")
-        iafsa_route_indices, _ = iafsa_optimize(
-            start_point, 
-            destinations, 
-            time_matrix, 
-            physical_matrix, 
-            weights, 
-            fuel_cost_per_km,
-            num_fish=40,
-            iterations=300,
-            max_retries=2
-        )
-        
-        if iafsa_route_indices:
-            app.logger.info(f"IAFSA route found: {iafsa_route_indices}")
-            
-            # Log route diversity metrics to verify the algorithm is working correctly
-            if 'ortools' in results:
-                ortools_route = results['ortools']['route']
-                diversity = calculate_route_diversity_penalty(iafsa_route_indices, ortools_route)
-                app.logger.info(f"Route diversity metric (0=different, 1=identical): {diversity:.4f}")
-                
-                if diversity < 0.5:
-                    app.logger.info("IAFSA found a significantly different route than OR-Tools")
-                elif diversity < 0.8:
-                    app.logger.info("IAFSA found a moderately different route than OR-Tools")
+        try:
+            params = parse_route_optimization_request(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # Identical requests are answered from the result cache unless the client opts out
+        use_cache = data.get('cache', True) and 'no-cache' not in request.headers.get('Cache-Control', '')
+        run_async = data.get('async') or request.args.get('async') == 'true'
+        if use_cache:
+            cached_results, age = get_cached_route_result(params)
+            if cached_results is not None:
+                app.logger.info(f"Route optimization cache hit (age {age:.0f}s)")
+                if run_async:
+                    # Same contract as a queued job; the job is simply completed already
+                    response = async_job_response(job_manager.add_completed(cached_results))
+                    status_code = 202
                 else:
-                    app.logger.info("IAFSA found a route similar to OR-Tools")
-            
-            # Calculate metrics for IAFSA route
-            iafsa_time = sum(time_matrix[iafsa_route_indices[i]][iafsa_route_indices[i+1]] for i in range(len(iafsa_route_indices)-1))
-            iafsa_physical_distance_meters = sum(physical_matrix[iafsa_route_indices[i]][iafsa_route_indices[i+1]] for i in range(len(iafsa_route_indices)-1))
-            iafsa_physical_distance_km = iafsa_physical_distance_meters / 1000 # Convert to km
-            iafsa_cost = iafsa_physical_distance_km * fuel_cost_per_km
-            iafsa_carbon = iafsa_physical_distance_km * 0.12  # Example CO2 factor: 0.12 kg/km
-            
-            # Get directions for visualization
-            iafsa_directions = get_directions(iafsa_route_indices, start_point, destinations, gmaps)
-            
-            results['iafsa'] = {
-                'route': iafsa_route_indices, # Store the indices
-                'distance': iafsa_physical_distance_km,
-                'time': iafsa_time,
-                'cost': iafsa_cost,
-                'carbon': iafsa_carbon,
-                'directions': iafsa_directions # Store the full directions object
-            }
-        else:
-            app.logger.warning("IAFSA failed to find a route.")
-            # If IAFSA fails, we might not have a baseline. Consider returning an error or default.
-            # For now, just don't add it to results.
-
-        # Handle Google Maps comparison (placeholder calculation for now)
-        if 'googlemaps' in comparison_methods:
-            app.logger.info("Generating placeholder Google Maps comparison data...")
-            # TODO: Implement actual Google Maps route calculation if needed,
-            # or use OR-Tools/IAFSA data as a proxy if it's just for KPI display.
-            # For now, create placeholder KPIs based on OR-Tools if available.
-            if 'ortools' in results:
-                google_distance = results['ortools']['distance'] * 1.05 # Assume 5% less optimal
-                google_cost = results['ortools']['cost'] * 1.05
-                google_carbon = results['ortools']['carbon'] * 1.05
-                google_time = results['ortools']['time'] * 1.05
-                # Get directions based on OR-Tools route for visual comparison
-                google_directions = results['ortools'].get('directions') 
-                google_route_indices = results['ortools'].get('route') # Use OR-Tools route indices for now
-            elif 'iafsa' in results: # Fallback to IAFSA if OR-Tools failed
-                google_distance = results['iafsa']['distance'] * 1.1 # Assume 10% less optimal than IAFSA
-                google_cost = results['iafsa']['cost'] * 1.1
-                google_carbon = results['iafsa']['carbon'] * 1.1
-                google_time = results['iafsa']['time'] * 1.1
-                google_directions = results['iafsa'].get('directions')
-                google_route_indices = results['iafsa'].get('route')
-            else: # No baseline data available
-                google_distance = 0
-                google_cost = 0
-                google_carbon = 0
-                google_time = 0
-                google_directions = None
-                google_route_indices = None
-
-            results['googlemaps'] = {
-                'route': google_route_indices, # Store route indices (placeholder)
-                'distance': google_distance,
-                'time': google_time,
-                'cost': google_cost,
-                'carbon': google_carbon,
-                'directions': google_directions # Store directions (placeholder)
-            }
+                    response, status_code = jsonify(cached_results), 200
+                response.headers['X-Cache'] = 'HIT'
+                response.headers['Age'] = str(int(age))
+                return response, status_code
+
+        if run_async:
+            return async_job_response(job_manager.submit(run_route_optimization, params)), 202
+
+        results, status_code = run_route_optimization(params)
+        response = jsonify(results)
+        response.headers['X-Cache'] = 'MISS'
+        return response, status_code
 
-        # Check if any results were generated
-        if not results:
-             app.logger.error("No optimization algorithms succeeded.")
-             return jsonify({'error': 'Optimization failed for all selected algorithms.'}), 500
-             
-        app.logger.info(f"Optimization successful. Returning results for: {list(results.keys())}")
-        return jsonify(results)
-        
     except Exception as e:
         app.logger.error(f"Unhandled error during last-mile delivery optimization: {str(e)}")
         app.logger.error(traceback.format_exc()) # Log full traceback
         return jsonify({'error': 'An internal server error occurred during optimization.'}), 500
 
+
+def async_job_response(job):
+    """202 body of a route optimization job: its state plus status and event URLs."""
+    response = job.to_dict(include_result=False)
+    response['status_url'] = f"/api/last-mile-delivery/jobs/{job.id}"
+    response['events_url'] = f"/api/last-mile-delivery/jobs/{job.id}/events"
+    return jsonify(response)
+
+
+@app.route('/api/last-mile-delivery/optimize/batch', methods=['POST'])
+def last_mile_delivery_optimize_batch():
+    """
+    Optimize routes for many depots in one call
+    ---
+    Request body should contain:
+    - problems: array of objects, each accepting the /optimize fields (startPoint,
+      destinations, weights, fuelCostPerKm, comparison, directions) and an optional id
+    - timeBudgetSeconds: number (optional; overall budget, capped by ROUTE_BATCH_TIME_BUDGET_SECONDS)
+    - async: boolean (optional; queue the batch and return a job id immediately)
+    - cache: boolean (optional; set to false to bypass the result cache)
+    """
+    try:
+        data = request.get_json()
+        if not data or not isinstance(data.get('problems'), list) or not data['problems']:
+            return jsonify({'error': 'Expected a non-empty "problems" array'}), 400
+        if len(data['problems']) > ROUTE_BATCH_CONFIG['max_problems']:
+            return jsonify({'error': f"Too many problems (maximum {ROUTE_BATCH_CONFIG['max_problems']})"}), 400
+
+        problems = []
+        for i, problem in enumerate(data['problems']):
+            try:
+                if not isinstance(problem, dict):
+                    raise ValueError('Expected an object')
+                problems.append((problem.get('id', i), parse_route_optimization_request(problem)))
+            except ValueError as e:
+                return jsonify({'error': f'Problem {i}: {str(e)}'}), 400
+
+        try:
+            time_budget_seconds = min(float(data.get('timeBudgetSeconds', ROUTE_BATCH_CONFIG['time_budget_seconds'])),
+                                      ROUTE_BATCH_CONFIG['time_budget_seconds'])
+        except (TypeError, ValueError):
+            return jsonify({'error': 'timeBudgetSeconds must be a number'}), 400
+        if time_budget_seconds <= 0:
+            return jsonify({'error': 'timeBudgetSeconds must be positive'}), 400
+
+        use_cache = data.get('cache', True) and 'no-cache' not in request.headers.get('Cache-Control', '')
+        app.logger.info(f"Received batch optimization request: {len(problems)} problems, budget {time_budget_seconds}s")
+
+        run_async = data.get('async') or request.args.get('async') == 'true'
+        if run_async:
+            job = job_manager.submit(run_batch_route_optimization, problems, time_budget_seconds, use_cache)
+            return async_job_response(job), 202
+
+        payload, status_code = run_batch_route_optimization(problems, time_budget_seconds, use_cache)
+        return jsonify(payload), status_code
+
+    except Exception as e:
+        app.logger.error(f"Unhandled error during batch route optimization: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({'error': 'An internal server error occurred during batch optimization.'}), 500
+
+
+@app.route('/api/last-mile-delivery/optimize/incremental', methods=['POST'])
+def last_mile_delivery_reoptimize():
+    """
+    Re-optimize a previous solution after stops were added or removed
+    ---
+    Request body should contain:
+    - solutionId: string (solution_id returned by a previous optimization)
+    - addDestinations: array of strings (new stop addresses)
+    - removeDestinations: array of strings or 1-based indices into the previous destinations
+    - directions: string (optional; "full", "polyline" or "lazy", see /optimize)
+    """
+    try:
+        data = request.get_json()
+        if not data or not data.get('solutionId'):
+            return jsonify({'error': 'solutionId is required'}), 400
+
+        add_destinations = data.get('addDestinations', [])
+        remove_destinations = data.get('removeDestinations', [])
+        if not isinstance(add_destinations, list) or not all(isinstance(d, str) and d.strip() for d in add_destinations):
+            return jsonify({'error': 'Invalid addDestinations format. Expected a list of non-empty strings.'}), 400
+        if not isinstance(remove_destinations, list):
+            return jsonify({'error': 'Invalid removeDestinations format. Expected a list.'}), 400
+
+        try:
+            directions_mode = parse_directions_mode(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        solution, _ = route_solution_store.get(data['solutionId'])
+        if solution is None:
+            return jsonify({'error': 'Solution not found or expired. Run a full optimization first.'}), 404
+
+        started = time.time()
+        results, status_code = run_incremental_route_optimization(
+            solution, add_destinations, remove_destinations, directions_mode)
+        if status_code == 200:
+            app.logger.info(f"Incremental re-optimization (+{len(add_destinations)}/-{len(remove_destinations)} stops) took {time.time() - started:.2f}s")
+        return jsonify(results), status_code
+
+    except Exception as e:
+        app.logger.error(f"Unhandled error during incremental re-optimization: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({'error': 'An internal server error occurred during optimization.'}), 500
+
+
+@app.route('/api/last-mile-delivery/solutions/<solution_id>/directions', methods=['GET'])
+def get_solution_directions(solution_id):
+    """
+    Lazily fetch directions for one algorithm's route of a stored solution
+    ---
+    Query parameters:
+    - algorithm: ortools, iafsa or googlemaps (default iafsa)
+    - format: polyline (default) or full
+    """
+    solution, _ = route_solution_store.get(solution_id)
+    if solution is None:
+        return jsonify({'error': 'Solution not found or expired'}), 404
+
+    algorithm = request.args.get('algorithm', 'iafsa')
+    response_format = request.args.get('format', 'polyline')
+    routes = solution['routes']
+    if algorithm == 'googlemaps':
+        # The Google Maps comparison reuses the OR-Tools (or IAFSA) route
+        route = routes.get('ortools') or routes.get('iafsa')
+    else:
+        route = routes.get(algorithm)
+    if not route:
+        return jsonify({'error': f'No route for algorithm: {algorithm}'}), 404
+
+    gmaps_api_key = os.environ.get('GOOGLE_MAPS_API_KEY')
+    if not gmaps_api_key:
+        app.logger.error("Google Maps API key not configured in environment variables.")
+        return jsonify({'error': 'Google Maps API key not configured'}), 500
+
+    directions = get_directions(route, solution['start_point'], solution['destinations'],
+                                googlemaps.Client(key=gmaps_api_key))
+    if directions is None:
+        return jsonify({'error': 'Failed to fetch directions'}), 502
+
+    response = {'algorithm': algorithm, 'route': route}
+    if response_format == 'full':
+        response['directions'] = directions
+    else:
+        response.update(directions_polyline(directions))
+    return jsonify(response), 200
+
+
+@app.route('/api/last-mile-delivery/jobs/<job_id>', methods=['GET'])
+def get_route_optimization_job(job_id):
+    """Poll the status (and, once completed, the result) of an optimization job"""
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict()), 200
+
+
+@app.route('/api/last-mile-delivery/jobs/<job_id>', methods=['DELETE'])
+def cancel_route_optimization_job(job_id):
+    """Cancel a queued or running optimization job"""
+    job = job_manager.cancel(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict(include_result=False)), 200
+
+
+@app.route('/api/last-mile-delivery/jobs/<job_id>/events', methods=['GET'])
+def stream_route_optimization_job(job_id):
+    """Stream job progress as Server-Sent Events until the job finishes"""
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+
+    # EventSource sends Last-Event-ID when it reconnects
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        last_event_id = 0
+
+    return Response(
+        stream_with_context(stream_job_events(job, last_event_id)),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # Disable proxy buffering (nginx)
+        }
+    )
+
+@app.cli.command('rebuild-daily-demand')
+@click.option('--user-id', type=int, default=None, help='Only rebuild this user (default: all users)')
+def rebuild_daily_demand_command(user_id):
+    """Recompute the daily_demand rollup from imported historical data."""
+    summary = rebuild_daily_demand(user_id)
+    click.echo(f"Rebuilt daily demand: {summary['sources']} sources, {summary['records']} records, {summary['rows']} rows")
+
+
+@app.cli.command('refresh-forecast-states')
+@click.option('--user-id', type=int, default=None, help='Only refresh this user (default: all users)')
+@click.option('--model', default=DEFAULT_FORECAST_MODEL, type=click.Choice(sorted(FORECAST_MODELS)))
+@click.option('--season-length', type=int, default=DEFAULT_SEASON_LENGTH)
+def refresh_forecast_states_command(user_id, model, season_length):
+    """Fit forecast states for SKUs without one; imports keep existing states current."""
+    user_ids = [user_id] if user_id is not None else [
+        row['user_id'] for row in fetch_all("SELECT DISTINCT user_id FROM daily_demand")]
+    for uid in user_ids:
+        summary = refresh_forecast_states(uid, model, season_length)
+        click.echo(f"User {uid}: {summary['fitted']} of {summary['products']} products fitted"
+                   f"{'' if summary['saved'] or not summary['fitted'] else ' (discarded, data changed)'}")
+
+
+@app.cli.command('refresh-forecasts')
+@click.option('--user-id', type=int, default=None, help='Only refresh this user (default: every user with demand data)')
+def refresh_forecasts_command(user_id):
+    """Update the precomputed forecast store; run nightly (e.g. from cron)."""
+    user_ids = [user_id] if user_id is not None else [
+        row['user_id'] for row in fetch_all("SELECT DISTINCT user_id FROM daily_demand")]
+    failed = 0
+    for uid in user_ids:
+        try:
+            summary = refresh_forecast_store(uid)
+            click.echo(f"User {uid}: {summary['states']['fitted']} states fitted, "
+                       f"{summary['written']} products rewritten, {summary['removed']} forecast rows removed")
+        except Exception as e:
+            failed += 1
+            logger.error(f"Forecast store refresh failed for user {uid}: {str(e)}")
+    if failed:
+        raise click.ClickException(f"Forecast store refresh failed for {failed} of {len(user_ids)} users")
+
+
+@app.cli.command('migrate-db')
+@click.option('--target', type=int, default=None, help='Stop at this schema version (default: latest)')
+@click.option('--dry-run', is_flag=True, help='Only list the migrations that would run')
+@click.option('--status', is_flag=True, help='Show which migrations are applied and exit')
+def migrate_db_command(target, dry_run, status):
+    """Apply pending schema migrations (tables and indexes); run on every deploy."""
+    if status:
+        for migration in migration_status():
+            click.echo(f"{migration['version']:>4}  {'applied' if migration['applied'] else 'pending'}  {migration['name']}")
+        return
+    applied = migrate(target, dry_run)
+    steps = {version: steps for version, _, steps in MIGRATIONS}
+    for version, name in applied:
+        click.echo(f"{'Would apply' if dry_run else 'Applied'} {version}: {name}")
+        if dry_run:
+            for step in steps[version]:
+                click.echo(f"    {step.description}")
+    if not applied:
+        click.echo(f"Schema is up to date (version {target or LATEST_VERSION})")
+
+
+@app.cli.command('generate-mock-data')
+@click.option('--user-id', type=int, required=True, help='User the synthetic history is loaded for')
+@click.option('--products', type=int, default=1000, show_default=True)
+@click.option('--locations', type=int, default=20, show_default=True)
+@click.option('--days', type=int, default=365, show_default=True)
+@click.option('--start-date', default=None, help='First day (YYYY-MM-DD, default: today)')
+@click.option('--seed', type=int, default=MOCK_DATA_SEED, show_default=True)
+@click.option('--source', default='loadtest', show_default=True,
+              help='Source the batches are stored under; a later import from it (except csv) replaces them')
+@click.option('--batch-records', type=int, default=50000, show_default=True, help='Records per insert transaction')
+def generate_mock_data_command(user_id, products, locations, days, start_date, seed, source, batch_records):
+    """Bulk-load seeded synthetic stock movements (products x days) into MySQL for load testing."""
+    if min(products, locations, days, batch_records) < 1:
+        raise click.BadParameter('products, locations, days and batch-records must be positive')
+    started = time.time()
+    summary = bulk_load_historical_data(user_id, source, iter_synthetic_movements(
+        products, locations, start_date, days, seed, batch_records=batch_records))
+    click.echo(f"Loaded {summary['records']} movements in {summary['batches']} batches "
+               f"for user {user_id} in {time.time() - started:.1f}s")
+
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
@@ -0,0 +1,230 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from date_utils import parse_datetimes, to_epoch_days, epoch_day_labels
+
+logger = logging.getLogger(__name__)
+
+# Limits of the validation reports: offending rows returned as samples,
+# outlier threshold in standard deviations and the share of valid rows a
+# batch needs to count as valid
+DATA_QUALITY_CONFIG = {
+    'sample_size': int(os.getenv('DATA_QUALITY_SAMPLE_SIZE', 20)),
+    'outlier_std': float(os.getenv('DATA_QUALITY_OUTLIER_STD', 3)),
+    'min_valid_percentage': float(os.getenv('DATA_QUALITY_MIN_VALID_PERCENTAGE', 80))
+}
+
+# Strict layout of Odoo stock move dates
+ODOO_DATE_FORMATS = ('%Y-%m-%d %H:%M:%S',)
+
+STOCK_MOVE_FIELDS = ('product_id', 'product_uom_qty', 'date', 'location_id', 'location_dest_id')
+
+# Human readable summary per check, used for the aggregated issue list
+ISSUE_MESSAGES = {
+    'missing_fields': 'Missing fields',
+    'invalid_record': 'Unrecognized record layout',
+    'missing_product': 'Missing product',
+    'invalid_product_id': 'Invalid product_id format',
+    'invalid_quantity': 'Invalid quantity format',
+    'negative_quantity': 'Negative quantity found',
+    'invalid_date': 'Invalid date format',
+    'outlier_quantity': 'Outlier quantity'
+}
+
+
+def summarize_checks(checks, sample_size=None):
+    """
+    Aggregate boolean check masks over a batch.
+
+    checks maps check names to (mask, is_error) where mask flags offending
+    rows. Returns (invalid, issue_counts, samples): invalid flags rows failing
+    any error check, issue_counts counts rows per check and samples lists at
+    most sample_size offending rows as {'row', 'issues'}, so reports stay
+    bounded however large the batch is.
+    """
+    sample_size = DATA_QUALITY_CONFIG['sample_size'] if sample_size is None else sample_size
+    names = list(checks)
+    if not names:
+        return np.zeros(0, dtype=bool), {}, []
+    flags = np.column_stack([np.asarray(checks[name][0], dtype=bool) for name in names])
+    errors = np.array([checks[name][1] for name in names], dtype=bool)
+    invalid = flags[:, errors].any(axis=1) if errors.any() else np.zeros(len(flags), dtype=bool)
+    counts = flags.sum(axis=0)
+    issue_counts = {name: int(count) for name, count in zip(names, counts) if count}
+
+    samples = []
+    for row in np.flatnonzero(flags.any(axis=1))[:sample_size]:
+        samples.append({'row': int(row), 'issues': [names[i] for i in np.flatnonzero(flags[row])]})
+    return invalid, issue_counts, samples
+
+
+def issue_messages(issue_counts, unit='rows'):
+    """One aggregated message per failing check, e.g. 'Negative quantity found (12 moves)'."""
+    return [f"{ISSUE_MESSAGES.get(name, name)} ({count} {unit})" for name, count in issue_counts.items()]
+
+
+def outlier_mask(values, groups=None, threshold=None):
+    """
+    Flag values more than threshold standard deviations from their mean,
+    per group when groups (one label per value) are given. NaN is never an outlier.
+    """
+    threshold = DATA_QUALITY_CONFIG['outlier_std'] if threshold is None else threshold
+    values = pd.Series(np.asarray(values, dtype=float))
+    if groups is None:
+        mean, std = values.mean(), values.std(ddof=0)
+    else:
+        labels = np.asarray(groups)
+        mean = values.groupby(labels).transform('mean')
+        std = np.sqrt(((values ** 2).groupby(labels).transform('mean') - mean ** 2).clip(lower=0))
+    deviation = (values - mean).abs()
+    return ((deviation > threshold * std) & (std > 0)).fillna(False).to_numpy(dtype=bool)
+
+
+def validate_stock_data(stock_moves, sample_size=None):
+    """
+    Validate Odoo stock movements for quality and consistency.
+
+    Required fields, product_id format, quantities (numeric, non-negative)
+    and dates are checked with vectorized masks over the whole batch. issues
+    holds one aggregated message per failing check and stats['samples'] a
+    bounded sample of offending moves.
+    """
+    validation_results = {
+        'is_valid': True,
+        'issues': [],
+        'stats': {
+            'total_moves': len(stock_moves),
+            'invalid_moves': 0,
+            'missing_fields': 0,
+            'date_range': {'min': None, 'max': None}
+        }
+    }
+
+    if not stock_moves:
+        validation_results['is_valid'] = False
+        validation_results['issues'].append('No stock movements found')
+        return validation_results
+
+    moves = [move if isinstance(move, dict) else {} for move in stock_moves]
+    missing = np.array([[field not in move for field in STOCK_MOVE_FIELDS] for move in moves], dtype=bool)
+    product_ids = [move.get('product_id') for move in moves]
+    quantities = pd.to_numeric(pd.Series([move.get('product_uom_qty') for move in moves], dtype=object),
+                               errors='coerce').to_numpy(dtype=float)
+    # Only the exact Odoo layout is accepted
+    dates = parse_datetimes([move.get('date') for move in moves], formats=ODOO_DATE_FORMATS, fallback=False)
+
+    present = ~missing.any(axis=1)
+    checks = {
+        'missing_fields': (~present, True),
+        'invalid_product_id': (present & np.array([not isinstance(p, (list, tuple)) or len(p) < 2
+                                                   for p in product_ids], dtype=bool), True),
+        'invalid_quantity': (present & np.isnan(quantities), True),
+        'negative_quantity': (present & (quantities < 0), True),
+        'invalid_date': (present & np.isnat(dates), True)
+    }
+    invalid, issue_counts, samples = summarize_checks(checks, sample_size)
+    stats = validation_results['stats']
+    stats['missing_fields'] = issue_counts.get('missing_fields', 0)
+    stats['invalid_moves'] = int(invalid.sum())
+    stats['issue_counts'] = issue_counts
+    stats['samples'] = samples
+    validation_results['issues'] = issue_messages(issue_counts, 'moves')
+
+    valid_dates = dates[present & ~np.isnat(dates)]
+    if len(valid_dates):
+        stats['date_range'] = {
+            'min': pd.Timestamp(valid_dates.min()).strftime('%Y-%m-%d %H:%M:%S'),
+            'max': pd.Timestamp(valid_dates.max()).strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+    # Calculate validity percentage
+    valid_moves = stats['total_moves'] - stats['invalid_moves']
+    validity_percentage = (valid_moves / stats['total_moves']) * 100 if stats['total_moves'] > 0 else 0
+
+    stats['validity_percentage'] = validity_percentage
+    validation_results['is_valid'] = validity_percentage >= DATA_QUALITY_CONFIG['min_valid_percentage']
+
+    return validation_results
+
+
+def _record_fields(record):
+    """(product, date, quantity) of an imported record, or None when its layout is unknown."""
+    if not isinstance(record, dict):
+        return None
+    data = record.get('data')
+    if isinstance(data, dict):
+        return (data.get('product_id', data.get('product')), record.get('date'),
+                data['quantity'] if 'quantity' in data else record.get('quantity'))
+    item = record.get('item')
+    if isinstance(item, dict):
+        return item.get('id') or item.get('name'), record.get('date'), record.get('quantity')
+    return None
+
+
+def _scalar(value):
+    """value, or None for JSON objects and arrays, which no field check can read."""
+    return None if isinstance(value, (dict, list, tuple, set)) else value
+
+
+def validate_import_records(records, sample_size=None):
+    """
+    Validate imported records (see demand_fields for the layouts) in one columnar pass.
+
+    Checks record layout, product, quantity (numeric, non-negative), date and
+    per-product quantity outliers (a warning, not an error). Days already
+    normalized by annotate_epoch_days are reused instead of parsing dates
+    again. Returns a report with totals, issue counts, a bounded sample of
+    offending rows and the date range.
+    """
+    records = records or []
+    fields = [_record_fields(record) for record in records]
+    unknown = np.array([f is None for f in fields], dtype=bool)
+    products = pd.Series([_scalar(f[0]) if f else None for f in fields], dtype=object)
+    raw_quantities = [_scalar(f[2]) if f else None for f in fields]
+    try:
+        quantities = np.array(raw_quantities, dtype=float)
+    except (TypeError, ValueError):
+        # Strings or None somewhere in the batch; coerce those to NaN
+        quantities = pd.to_numeric(pd.Series(raw_quantities, dtype=object).replace('', None),
+                                   errors='coerce').to_numpy(dtype=float)
+
+    days = np.array([record.get('epoch_day', np.nan) if isinstance(record, dict) else np.nan
+                     for record in records], dtype=float)
+    unparsed = np.flatnonzero(np.isnan(days) & ~unknown)
+    if len(unparsed):
+        days[unparsed] = to_epoch_days([fields[i][1] for i in unparsed])
+
+    # Blank checks and outlier groups work on the distinct product ids only
+    product_codes, unique_products = pd.factorize(products)
+    blank = np.array([str(product).strip() == '' for product in unique_products], dtype=bool)
+    missing_product = ~unknown & (product_codes < 0)
+    if len(blank):
+        missing_product |= ~unknown & blank[np.maximum(product_codes, 0)]
+    checks = {
+        'invalid_record': (unknown, True),
+        'missing_product': (missing_product, True),
+        'invalid_quantity': (~unknown & np.isnan(quantities), True),
+        'negative_quantity': (~unknown & (quantities < 0), True),
+        'invalid_date': (~unknown & np.isnan(days), True),
+        'outlier_quantity': (~unknown & outlier_mask(quantities, product_codes), False)
+    }
+    invalid, issue_counts, samples = summarize_checks(checks, sample_size)
+
+    valid_days = days[~np.isnan(days)]
+    total = len(records)
+    return {
+        'total_records': total,
+        'valid_records': total - int(invalid.sum()),
+        'invalid_records': int(invalid.sum()),
+        'validity_percentage': round((total - int(invalid.sum())) / total * 100, 2) if total else 0,
+        'issues': issue_messages(issue_counts, 'records'),
+        'issue_counts': issue_counts,
+        'samples': samples,
+        'date_range': {
+            'min': str(epoch_day_labels([valid_days.min()])[0]) if len(valid_days) else None,
+            'max': str(epoch_day_labels([valid_days.max()])[0]) if len(valid_days) else None
+        }
+    }
@@ -4,7 +4,28 @@ import mysql.connector
 import os
 from dotenv import load_dotenv
 import json
-from datetime import datetime
+import base64
+import re
+import concurrent.futures
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from date_utils import to_epoch_days, epoch_day_labels
+from data_quality import validate_import_records
+from demand_records import aggregate_daily_demand, annotate_epoch_days
+from forecasting import (
+    split_params,
+    stack_params,
+    update_fitted_params,
+    forecast_quantiles,
+    DailyDemandAggregator,
+    DemandSeries,
+    FORECAST_MODELS,
+    FORECAST_PROJECTIONS,
+    FORECAST_ERROR_STDS,
+    DEFAULT_FORECAST_MODEL,
+    DEFAULT_SEASON_LENGTH
+)
 
 logger = logging.getLogger(__name__)
 
@@ -18,9 +39,128 @@ TABLES = {
     'integration_settings': 'integration_settings',
     'inventory_settings': 'inventory_settings',
     'historical_data': 'historical_data',
-    'user_preferences': 'user_preferences'
+    'user_preferences': 'user_preferences',
+    'daily_demand': 'daily_demand',
+    'data_versions': 'data_versions',
+    'forecast_states': 'forecast_states',
+    'forecast_fits': 'forecast_fits',
+    'forecasts': 'forecasts',
+    'forecast_locations': 'forecast_locations',
+    'inventory_item_settings': 'inventory_item_settings'
 }
 
+# Daily demand rollup of historical_data, maintained by save_historical_data
+DAILY_DEMAND_DDL = """
+    CREATE TABLE IF NOT EXISTS daily_demand (
+        user_id INT NOT NULL,
+        source VARCHAR(50) NOT NULL,
+        product_id VARCHAR(255) NOT NULL,
+        product_name VARCHAR(255),
+        location VARCHAR(255) NOT NULL,
+        day DATE NOT NULL,
+        quantity DOUBLE NOT NULL DEFAULT 0,
+        record_count INT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, source, product_id, location, day),
+        KEY idx_daily_demand_user_day (user_id, day)
+    )
+"""
+
+# Per-user counter bumped by every write to historical_data; lets readers
+# cache anything derived from a user's data until the version changes
+DATA_VERSIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS data_versions (
+        user_id INT NOT NULL PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    )
+"""
+
+# Fitted forecast model state per user and SKU over its full daily_demand
+# history; imports fold new days into it instead of refitting
+FORECAST_STATES_DDL = """
+    CREATE TABLE IF NOT EXISTS forecast_states (
+        user_id INT NOT NULL,
+        product_id VARCHAR(255) NOT NULL,
+        model VARCHAR(32) NOT NULL,
+        season_length INT NOT NULL,
+        start_day DATE NOT NULL,
+        length INT NOT NULL,
+        params LONGTEXT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, product_id, model, season_length)
+    )
+"""
+
+# Fitted parameters of interactive forecasts per user, SKU, model and season
+# length; fingerprint identifies the daily series of the request window the
+# fit was made on (see series_fingerprints), so a row stays valid across
+# imports that leave that series unchanged
+FORECAST_FITS_DDL = """
+    CREATE TABLE IF NOT EXISTS forecast_fits (
+        user_id INT NOT NULL,
+        product_id VARCHAR(255) NOT NULL,
+        model VARCHAR(32) NOT NULL,
+        season_length INT NOT NULL,
+        fingerprint VARCHAR(255) NOT NULL,
+        params LONGTEXT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, product_id, model, season_length)
+    )
+"""
+
+# Precomputed forecasts per user and SKU, written by refresh_forecast_store;
+# step is the number of days after the SKU's last observed day and p10/p50/p90
+# the prediction quantiles
+FORECASTS_DDL = """
+    CREATE TABLE IF NOT EXISTS forecasts (
+        user_id INT NOT NULL,
+        product_id VARCHAR(255) NOT NULL,
+        product_name VARCHAR(255),
+        location VARCHAR(255),
+        model VARCHAR(32) NOT NULL,
+        day DATE NOT NULL,
+        step INT NOT NULL,
+        quantity DOUBLE NOT NULL,
+        p10 DOUBLE,
+        p50 DOUBLE,
+        p90 DOUBLE,
+        generated_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (user_id, product_id, day),
+        KEY idx_forecasts_user_location (user_id, location, product_id)
+    )
+"""
+
+# Every location a SKU of the forecast store sells at (forecasts keep one row
+# per SKU and day, its location column only the first location)
+FORECAST_LOCATIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS forecast_locations (
+        user_id INT NOT NULL,
+        product_id VARCHAR(255) NOT NULL,
+        location VARCHAR(255) NOT NULL,
+        PRIMARY KEY (user_id, product_id, location),
+        KEY idx_forecast_locations_user_location (user_id, location, product_id)
+    )
+"""
+
+# Per-item cost and service parameters for inventory optimization; '*' as
+# product_id or location makes a row the default for all products/locations,
+# and NULL fields fall back to the next less specific row
+INVENTORY_ITEM_SETTINGS_DDL = """
+    CREATE TABLE IF NOT EXISTS inventory_item_settings (
+        user_id INT NOT NULL,
+        product_id VARCHAR(255) NOT NULL,
+        location VARCHAR(255) NOT NULL,
+        unit_cost DOUBLE,
+        holding_cost_rate DOUBLE,
+        ordering_cost DOUBLE,
+        lead_time_days DOUBLE,
+        service_level DOUBLE,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, product_id, location)
+    )
+"""
+
 # Configuration for the database connection
 DB_CONFIG = {
     'host': os.getenv('DB_HOST', 'localhost'),
@@ -30,6 +170,46 @@ DB_CONFIG = {
     'port': int(os.getenv('DB_PORT', 3306))
 }
 
+# Number of records handed to callers per chunk when streaming large result sets
+STREAM_CHUNK_SIZE = int(os.getenv('DB_STREAM_CHUNK_SIZE', 5000))
+
+# Rows per batch of fetch_batches; rows are plain tuples, so batches can be
+# much larger than record chunks
+FETCH_BATCH_SIZE = int(os.getenv('DB_FETCH_BATCH_SIZE', 50000))
+
+# Row layouts of fetch_batches: dicts, tuples, or one list per column
+ROW_FORMATS = ('dict', 'tuple', 'columns')
+
+# Model and horizon of the precomputed forecast store (the nightly job); the
+# read API serves any horizon up to horizon_days
+FORECAST_STORE_CONFIG = {
+    'model': os.getenv('FORECAST_STORE_MODEL', DEFAULT_FORECAST_MODEL),
+    'season_length': int(os.getenv('FORECAST_STORE_SEASON_LENGTH', DEFAULT_SEASON_LENGTH)),
+    'horizon_days': int(os.getenv('FORECAST_STORE_HORIZON_DAYS', 30))
+}
+
+# Row counts: 'auto' counts exactly only when the optimizer estimates at
+# most exact_max_rows rows; counts run on their own small thread pool so
+# they overlap with the page query
+COUNT_CONFIG = {
+    'exact_max_rows': int(os.getenv('COUNT_EXACT_MAX_ROWS', 100000)),
+    'workers': int(os.getenv('COUNT_WORKERS', 4))
+}
+COUNT_MODES = ('auto', 'exact', 'estimate', 'none')
+
+count_executor = concurrent.futures.ThreadPoolExecutor(max_workers=COUNT_CONFIG['workers'],
+                                                       thread_name_prefix='db-count')
+
+# Trailing ORDER BY / LIMIT of a query, which do not change its row count
+TRAILING_ORDER_LIMIT = re.compile(r'\s+(ORDER\s+BY\s+[^()]*?)?(\s+LIMIT\s+[^()]*)?\s*$', re.IGNORECASE)
+
+# Incremental decoding of stored JSON arrays, see iter_json_records
+json_decoder = json.JSONDecoder()
+JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# Columns of historical_data rows returned by the paginated history APIs
+HISTORICAL_PAGE_COLUMNS = ('id', 'user_id', 'data', 'date', 'company_id', 'source', 'created_at', 'updated_at')
+
 class DatabaseManager:
     def __init__(self, config):
         self.config = config
@@ -112,8 +292,8 @@ def fetch_all(query, params=None, limit=None, count=False):
         cursor = connection.cursor(dictionary=True)
         try:
             if count:
-                # Modify query to get count first
-                count_query = f"SELECT COUNT(*) as total FROM ({query.replace('*', '1')}) as count_query"
+                # Count the rows of the query without its ordering or limit
+                count_query = f"SELECT COUNT(*) as total FROM ({TRAILING_ORDER_LIMIT.sub('', query)}) as count_query"
                 cursor.execute(count_query, params)
                 count_result = cursor.fetchone()
                 total_count = count_result['total'] if count_result else 0
@@ -135,6 +315,114 @@ def fetch_all(query, params=None, limit=None, count=False):
         return results, total_count
     return results
 
+def count_rows(table, where=None, params=(), estimate=False):
+    """
+    Number of rows of table matching an optional WHERE clause.
+
+    The exact count is a plain COUNT(*) on the filters, which MySQL answers
+    from an index covering them. With estimate=True the optimizer's row
+    estimate (EXPLAIN) is returned instead; it costs next to nothing on any
+    table size but may be off by a few percent. Raises on database errors.
+    """
+    query = f"SELECT {'1' if estimate else 'COUNT(*) AS total'} FROM {table}"
+    if where:
+        query += f" WHERE {where}"
+    conn = get_db()
+    if not conn:
+        raise Error("Failed to create database connection")
+    cursor = conn.cursor(dictionary=True)
+    try:
+        if not estimate:
+            cursor.execute(query, tuple(params))
+            return int(cursor.fetchone()['total'])
+        cursor.execute(f"EXPLAIN {query}", tuple(params))
+        plan = cursor.fetchall()
+        if not plan or plan[0].get('rows') is None:
+            return 0
+        return int(round(float(plan[0]['rows']) * float(plan[0].get('filtered') or 100) / 100))
+    finally:
+        cursor.close()
+        conn.close()
+
+def count_with_mode(table, where=None, params=(), mode='auto'):
+    """
+    Row count for a COUNT_MODES mode, as (count, is_estimate).
+
+    'exact' and 'estimate' as in count_rows; 'auto' starts from the estimate
+    and counts exactly when it is at most COUNT_CONFIG['exact_max_rows'];
+    'none' returns (None, False).
+    """
+    if mode == 'none':
+        return None, False
+    if mode == 'exact':
+        return count_rows(table, where, params), False
+    estimate = count_rows(table, where, params, estimate=True)
+    if mode == 'auto' and estimate <= COUNT_CONFIG['exact_max_rows']:
+        return count_rows(table, where, params), False
+    return estimate, True
+
+def run_with_count(fetch, count):
+    """
+    Run a page query and its count concurrently, each on its own connection.
+
+    fetch and count are callables; count runs on count_executor while fetch
+    runs in the calling thread. Returns (fetch(), count()).
+    """
+    future = count_executor.submit(count)
+    try:
+        result = fetch()
+    except Exception:
+        future.cancel()
+        raise
+    return result, future.result()
+
+def fetch_batches(query, params=None, batch_size=None, row_format='dict'):
+    """
+    Stream the result of a query in batches of at most batch_size rows.
+
+    Rows are read through an unbuffered cursor, so only one batch is held
+    in memory however large the result is. row_format picks the layout of
+    each batch (see ROW_FORMATS): a list of dicts, a list of tuples (the
+    cheapest), or a dict of column name to list of values, ready for
+    pd.DataFrame or np.asarray. The connection is closed when the result is
+    exhausted or the generator is closed. Raises on database errors.
+    """
+    if row_format not in ROW_FORMATS:
+        raise ValueError(f"row_format must be one of {', '.join(ROW_FORMATS)}")
+    batch_size = batch_size or FETCH_BATCH_SIZE
+    connection = create_connection()
+    if not connection:
+        raise Error("Failed to create database connection")
+
+    cursor = connection.cursor(buffered=False)
+    try:
+        cursor.execute(query, params)
+        names = list(cursor.column_names)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            if row_format == 'tuple':
+                yield rows
+            elif row_format == 'columns':
+                yield {name: list(values) for name, values in zip(names, zip(*rows))}
+            else:
+                yield [dict(zip(names, row)) for row in rows]
+    finally:
+        try:
+            cursor.close()
+            connection.close()
+        except Error as e:
+            # Abandoned streams leave unread rows behind; the connection is discarded anyway
+            logger.debug(f"Error closing streaming cursor: {e}")
+
+def iter_rows(query, params=None, row_format='dict', batch_size=None):
+    """Stream the rows of a query one at a time (dicts or tuples), see fetch_batches."""
+    if row_format == 'columns':
+        raise ValueError("iter_rows yields single rows; use fetch_batches for columns")
+    for batch in fetch_batches(query, params, batch_size, row_format):
+        yield from batch
+
 def fetch_one(query, params=None):
     """
     Fetch a single result from a query.
@@ -185,8 +473,656 @@ def execute_many(query, params):
         if connection and connection.is_connected():
             connection.close()
 
+_rollup_tables_ready = False
+
+def ensure_rollup_tables(cursor):
+    """
+    Create the daily_demand rollup, data_versions and forecast tables if needed (once per process).
+
+    Deployments create them with flask migrate-db (migrations.py); this keeps
+    imports working on databases that were not migrated yet.
+    """
+    global _rollup_tables_ready
+    if not _rollup_tables_ready:
+        cursor.execute(DAILY_DEMAND_DDL)
+        cursor.execute(DATA_VERSIONS_DDL)
+        cursor.execute(FORECAST_STATES_DDL)
+        cursor.execute(FORECAST_FITS_DDL)
+        cursor.execute(FORECASTS_DDL)
+        cursor.execute(FORECAST_LOCATIONS_DDL)
+        _rollup_tables_ready = True
+
+def bump_data_version(cursor, user_id):
+    """Increment a user's data version on the caller's cursor (inside its transaction)."""
+    cursor.execute("""
+        INSERT INTO data_versions (user_id, version) VALUES (%s, 1)
+        ON DUPLICATE KEY UPDATE version = version + 1
+    """, (user_id,))
+
+def fetch_data_version(user_id):
+    """
+    Current data version of a user (0 before the first import).
+
+    Unlike fetch_one this raises when the version cannot be read, so callers
+    never mistake a database error for unchanged data.
+    """
+    conn = get_db()
+    if not conn:
+        raise Error("Failed to create database connection")
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT version FROM data_versions WHERE user_id = %s", (user_id,))
+        row = cursor.fetchone()
+        return int(row[0]) if row else 0
+    finally:
+        cursor.close()
+        conn.close()
+
+def update_daily_demand(cursor, user_id, source, records, replace=False, default_date=None, update_states=True):
+    """
+    Fold records into the daily_demand rollup of a user and source.
+
+    Runs on the caller's (dictionary) cursor so it commits or rolls back
+    together with the raw data. With replace=True the source's previous
+    rollup rows are dropped first (for imports that overwrite their data).
+    Unless update_states is False the resulting change per product and day is
+    folded into the user's forecast states. Returns the number of
+    (product, location, day) rows written.
+    """
+    states = fetch_forecast_states(cursor, user_id) if update_states else []
+    previous = []
+    if replace:
+        if states:
+            cursor.execute("""
+                SELECT product_id, day, SUM(quantity) AS quantity, SUM(record_count) AS record_count
+                FROM daily_demand WHERE user_id = %s AND source = %s
+                GROUP BY product_id, day
+            """, (user_id, source))
+            previous = cursor.fetchall()
+        cursor.execute("DELETE FROM daily_demand WHERE user_id = %s AND source = %s", (user_id, source))
+
+    frame, product_info = aggregate_daily_demand(records, default_date=default_date)
+    if states:
+        update_forecast_states(cursor, user_id, states, demand_delta(frame, previous))
+    if frame.empty:
+        return 0
+
+    days = frame['day'].to_numpy().astype('datetime64[D]').astype(str).tolist()
+    rows = [
+        (user_id, source, product_id, product_info[product_id]['name'], location, day, float(quantity), int(count))
+        for product_id, location, day, quantity, count in zip(
+            frame['product'], frame['location'], days, frame['quantity'], frame['count'])
+    ]
+    upsert_query = """
+        INSERT INTO daily_demand
+        (user_id, source, product_id, product_name, location, day, quantity, record_count)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            quantity = quantity + VALUES(quantity),
+            record_count = record_count + VALUES(record_count),
+            product_name = VALUES(product_name)
+    """
+    for start in range(0, len(rows), 1000):
+        cursor.executemany(upsert_query, rows[start:start + 1000])
+    return len(rows)
+
+def demand_delta(frame, previous_rows):
+    """
+    Change in daily demand per (product, day) when previous_rows (product_id,
+    day, quantity, record_count) are replaced by an aggregated frame.
+    """
+    new = frame.groupby(['product', 'day'])[['quantity', 'count']].sum() if not frame.empty else None
+    if previous_rows:
+        old = pd.DataFrame({
+            'product': [str(row['product_id']) for row in previous_rows],
+            'day': to_epoch_days([row['day'] for row in previous_rows]).astype(np.int64),
+            'quantity': [float(row['quantity']) for row in previous_rows],
+            'count': [int(row['record_count']) for row in previous_rows]
+        }).groupby(['product', 'day'])[['quantity', 'count']].sum()
+        new = -old if new is None else new.sub(old, fill_value=0)
+    if new is None:
+        return pd.DataFrame(columns=['product', 'day', 'quantity', 'count'])
+    new = new[(new['quantity'] != 0) | (new['count'] != 0)]
+    return new.reset_index()
+
+def epoch_day(value):
+    """Epoch day number of a date."""
+    return int(to_epoch_days([value])[0])
+
+def encode_params(params):
+    """JSON text of one product's fitted params (a dict of arrays)."""
+    return json.dumps({key: np.asarray(value).tolist() for key, value in params.items()})
+
+def decode_params(text):
+    """Inverse of encode_params."""
+    return {key: np.asarray(value, dtype=float) for key, value in json.loads(text).items()}
+
+def fetch_forecast_states(cursor, user_id, model=None, season_length=None):
+    """Forecast states of a user (optionally one model and season length) with params decoded to arrays."""
+    query = "SELECT product_id, model, season_length, start_day, length, params FROM forecast_states WHERE user_id = %s"
+    params = [user_id]
+    if model is not None:
+        query += " AND model = %s AND season_length = %s"
+        params += [model, season_length]
+    cursor.execute(query, tuple(params))
+    states = []
+    for row in cursor.fetchall():
+        row['start_day'] = epoch_day(row['start_day'])
+        row['params'] = decode_params(row['params'])
+        states.append(row)
+    return states
+
+def save_forecast_states(cursor, user_id, states):
+    """Upsert forecast states (dicts as returned by fetch_forecast_states) on the caller's cursor."""
+    rows = [
+        (user_id, state['product_id'], state['model'], int(state['season_length']),
+         str(np.datetime64(int(state['start_day']), 'D')), int(state['length']),
+         encode_params(state['params']))
+        for state in states
+    ]
+    upsert_query = """
+        INSERT INTO forecast_states (user_id, product_id, model, season_length, start_day, length, params)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE start_day = VALUES(start_day), length = VALUES(length), params = VALUES(params)
+    """
+    for start in range(0, len(rows), 1000):
+        cursor.executemany(upsert_query, rows[start:start + 1000])
+
+def update_forecast_states(cursor, user_id, states, delta):
+    """
+    Fold a daily demand delta (see demand_delta) into forecast states.
+
+    Days after a state's last fitted day are applied as an online update of
+    its model. States whose already-fitted history changed are dropped, so
+    the next refresh_forecast_states refits them. Returns (updated, dropped).
+    """
+    if not states or delta.empty:
+        return 0, 0
+    changes = {product_id: group for product_id, group in delta.groupby('product')}
+
+    groups, dropped = {}, []
+    for state in states:
+        product_changes = changes.get(state['product_id'])
+        if product_changes is None:
+            continue
+        if (product_changes['day'] < state['start_day'] + state['length']).any():
+            dropped.append(state)
+        else:
+            groups.setdefault((state['model'], state['season_length']), []).append((state, product_changes))
+
+    for state in dropped:
+        cursor.execute("""
+            DELETE FROM forecast_states
+            WHERE user_id = %s AND product_id = %s AND model = %s AND season_length = %s
+        """, (user_id, state['product_id'], state['model'], state['season_length']))
+
+    updated = []
+    for (model, season_length), items in groups.items():
+        next_days = np.array([state['start_day'] + state['length'] for state, _ in items])
+        columns = np.concatenate([np.full(len(c), i) for i, (_, c) in enumerate(items)])
+        days = np.concatenate([c['day'].to_numpy(dtype=np.int64) for _, c in items])
+        quantities = np.concatenate([c['quantity'].to_numpy(dtype=float) for _, c in items])
+        counts = np.concatenate([c['count'].to_numpy(dtype=np.int64) for _, c in items])
+        segment = DemandSeries.from_points(columns, days - next_days[columns], quantities, counts > 0,
+                                           len(items), next_days, season_length)
+        offsets = np.array([state['length'] for state, _ in items])
+        new_params = update_fitted_params(model, [state['params'] for state, _ in items], segment, offsets)
+        for (state, _), params, added in zip(items, new_params, segment.lengths):
+            updated.append(dict(state, params=params, length=state['length'] + int(added)))
+    save_forecast_states(cursor, user_id, updated)
+    if updated or dropped:
+        logger.info(f"Forecast states of user {user_id}: {len(updated)} updated online, {len(dropped)} dropped for refit")
+    return len(updated), len(dropped)
+
+def refresh_forecast_states(user_id, model=DEFAULT_FORECAST_MODEL, season_length=DEFAULT_SEASON_LENGTH):
+    """
+    Fit forecast states for a user's SKUs that have none yet for model and season_length.
+
+    SKUs that already have a state are kept current by imports, so a refresh
+    only reads and fits the history of new or invalidated SKUs. The fit is
+    discarded if an import lands meanwhile (the data version moved). Returns
+    a summary dict.
+    """
+    if model not in FORECAST_MODELS:
+        raise ValueError(f"Unknown forecast model: {model}")
+    version = fetch_data_version(user_id)
+    conn = get_db()
+    if not conn:
+        raise Error("Failed to create database connection")
+    cursor = conn.cursor(dictionary=True)
+    summary = {'products': 0, 'fitted': 0, 'saved': False}
+    try:
+        ensure_rollup_tables(cursor)
+        cursor.execute("SELECT DISTINCT product_id FROM daily_demand WHERE user_id = %s", (user_id,))
+        product_ids = {str(row['product_id']) for row in cursor.fetchall()}
+        fitted = {state['product_id'] for state in fetch_forecast_states(cursor, user_id, model, season_length)}
+        missing = sorted(product_ids - fitted)
+        summary['products'] = len(product_ids)
+        conn.commit()
+        if not missing:
+            return summary
+
+        aggregator = DailyDemandAggregator()
+        for start in range(0, len(missing), 1000):
+            for batch in iter_daily_demand_batches(user_id, product_ids=missing[start:start + 1000]):
+                aggregator.add_daily_totals(batch)
+        matrix = aggregator.matrix()
+        if matrix is None:
+            return summary
+        first_day, demand, observed, matrix_products, _ = matrix
+        series = DemandSeries.from_matrix(first_day, demand, observed, season_length)
+        _, params = FORECAST_MODELS[model](series, 1)
+        states = [
+            {'product_id': product_id, 'model': model, 'season_length': season_length,
+             'start_day': int(start_day), 'length': int(length), 'params': product_params}
+            for product_id, start_day, length, product_params in zip(
+                matrix_products, series.start_days, series.lengths, split_params(params))
+        ]
+
+        # Lock the version row so no import can commit between the check and the save
+        cursor.execute("SELECT version FROM data_versions WHERE user_id = %s FOR UPDATE", (user_id,))
+        row = cursor.fetchone()
+        summary['fitted'] = len(states)
+        if (int(row['version']) if row else 0) != version:
+            conn.rollback()
+            logger.info(f"Data of user {user_id} changed during forecast state refresh; fit discarded")
+            return summary
+        save_forecast_states(cursor, user_id, states)
+        conn.commit()
+        summary['saved'] = True
+        logger.info(f"Fitted {len(states)} {model} forecast states for user {user_id}")
+        return summary
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+def fetch_fitted_params(user_id, season_length, requests):
+    """
+    Stored fitted params for (product_id, model, fingerprint) requests of a user.
+
+    A forecast_fits row matches when it was fit on the same series
+    (fingerprint); a forecast_states row, fit over the SKU's full history and
+    kept current by imports, when it covers the same days. Returns a dict
+    (product_id, model) -> params of the matched requests.
+    """
+    wanted = {(str(product_id), model): json.dumps(list(fingerprint)) for product_id, model, fingerprint in requests}
+    product_ids = sorted({product_id for product_id, _ in wanted})
+    if not product_ids:
+        return {}
+    conn = get_db()
+    if not conn:
+        raise Error("Failed to create database connection")
+    cursor = conn.cursor(dictionary=True)
+    matched = {}
+    try:
+        ensure_rollup_tables(cursor)
+        for start in range(0, len(product_ids), 1000):
+            chunk = product_ids[start:start + 1000]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f"""
+                SELECT product_id, model, fingerprint, params FROM forecast_fits
+                WHERE user_id = %s AND season_length = %s AND product_id IN ({placeholders})
+            """, (user_id, season_length, *chunk))
+            for row in cursor.fetchall():
+                key = (row['product_id'], row['model'])
+                if wanted.get(key) == row['fingerprint']:
+                    matched[key] = decode_params(row['params'])
+            cursor.execute(f"""
+                SELECT product_id, model, start_day, length, params FROM forecast_states
+                WHERE user_id = %s AND season_length = %s AND product_id IN ({placeholders})
+            """, (user_id, season_length, *chunk))
+            for row in cursor.fetchall():
+                key = (row['product_id'], row['model'])
+                if key in wanted and key not in matched and \
+                        json.loads(wanted[key])[:2] == [epoch_day(row['start_day']), int(row['length'])]:
+                    matched[key] = decode_params(row['params'])
+        conn.commit()
+        return matched
+    finally:
+        cursor.close()
+        conn.close()
+
+def save_fitted_params(user_id, season_length, fits):
+    """Upsert (product_id, model, fingerprint, params) fits of a user's interactive forecasts."""
+    rows = [(user_id, str(product_id), model, int(season_length), json.dumps(list(fingerprint)), encode_params(params))
+            for product_id, model, fingerprint, params in fits]
+    if not rows:
+        return 0
+    conn = get_db()
+    if not conn:
+        raise Error("Failed to create database connection")
+    cursor = conn.cursor()
+    try:
+        ensure_rollup_tables(cursor)
+        upsert_query = """
+            INSERT INTO forecast_fits (user_id, product_id, model, season_length, fingerprint, params)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE fingerprint = VALUES(fingerprint), params = VALUES(params)
+        """
+        for start in range(0, len(rows), 1000):
+            cursor.executemany(upsert_query, rows[start:start + 1000])
+        conn.commit()
+        return len(rows)
+    except Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+def refresh_forecast_store(user_id, model=None, season_length=None, horizon_days=None):
+    """
+    Bring a user's precomputed forecasts up to date.
+
+    Fits states for SKUs that lack one, then rewrites forecasts only for SKUs
+    whose state changed since their forecasts were generated (or that were
+    stored with another model or a shorter horizon), and removes forecasts of
+    SKUs that no longer have a state. Returns a summary dict.
+    """
+    model = model or FORECAST_STORE_CONFIG['model']
+    season_length = season_length or FORECAST_STORE_CONFIG['season_length']
+    horizon_days = horizon_days or FORECAST_STORE_CONFIG['horizon_days']
+    summary = {'states': refresh_forecast_states(user_id, model, season_length), 'written': 0, 'removed': 0}
+
+    conn = get_db()
+    if not conn:
+        raise Error("Failed to create database connection")
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            DELETE f FROM forecasts f
+            LEFT JOIN forecast_states s
+                ON s.user_id = f.user_id AND s.product_id = f.product_id
+                AND s.model = %s AND s.season_length = %s
+            WHERE f.user_id = %s AND s.product_id IS NULL
+        """, (model, season_length, user_id))
+        summary['removed'] = cursor.rowcount
+        cursor.execute("""
+            DELETE l FROM forecast_locations l
+            LEFT JOIN forecast_states s
+                ON s.user_id = l.user_id AND s.product_id = l.product_id
+                AND s.model = %s AND s.season_length = %s
+            WHERE l.user_id = %s AND s.product_id IS NULL
+        """, (model, season_length, user_id))
+
+        cursor.execute("""
+            SELECT s.product_id
+            FROM forecast_states s
+            LEFT JOIN (
+                SELECT product_id, MIN(generated_at) AS generated_at, MAX(step) AS steps, MIN(model) AS model
+                FROM forecasts WHERE user_id = %s GROUP BY product_id
+            ) f ON f.product_id = s.product_id
+            WHERE s.user_id = %s AND s.model = %s AND s.season_length = %s
+              AND (f.product_id IS NULL OR s.updated_at >= f.generated_at OR f.steps < %s OR f.model <> s.model)
+        """, (user_id, user_id, model, season_length, horizon_days))
+        stale = {row['product_id'] for row in cursor.fetchall()}
+        if not stale:
+            conn.commit()
+            return summary
+
+        states = [state for state in fetch_forecast_states(cursor, user_id, model, season_length)
+                  if state['product_id'] in stale]
+        product_ids = [state['product_id'] for state in states]
+        info, locations = {}, []
+        for start in range(0, len(product_ids), 1000):
+            chunk = product_ids[start:start + 1000]
+            cursor.execute(f"""
+                SELECT product_id, location, MAX(product_name) AS product_name
+                FROM daily_demand WHERE user_id = %s AND product_id IN ({', '.join(['%s'] * len(chunk))})
+                GROUP BY product_id, location
+                ORDER BY product_id, location
+            """, (user_id, *chunk))
+            for row in cursor.fetchall():
+                info.setdefault(row['product_id'], row)
+                locations.append((user_id, row['product_id'], row['location']))
+
+        lengths = np.array([state['length'] for state in states])
+        params = stack_params([state['params'] for state in states])
+        forecasts = FORECAST_PROJECTIONS[model](params, lengths, horizon_days)
+        bands = forecast_quantiles(forecasts, FORECAST_ERROR_STDS[model](params, lengths, horizon_days), (0.1, 0.5, 0.9))
+        first_days = np.array([state['start_day'] for state in states]) + lengths
+        labels = epoch_day_labels(first_days[:, None] + np.arange(horizon_days)[None, :]).tolist()
+
+        rows = []
+        for p, product_id in enumerate(product_ids):
+            product = info.get(product_id, {})
+            rows.extend(
+                (user_id, product_id, product.get('product_name'), product.get('location'), model,
+                 labels[p][k], k + 1, float(forecasts[p, k]),
+                 float(bands['p10'][p, k]), float(bands['p50'][p, k]), float(bands['p90'][p, k]))
+                for k in range(horizon_days))
+        for start in range(0, len(product_ids), 1000):
+            chunk = product_ids[start:start + 1000]
+            cursor.execute(f"DELETE FROM forecasts WHERE user_id = %s AND product_id IN ({', '.join(['%s'] * len(chunk))})",
+                           (user_id, *chunk))
+            cursor.execute(f"DELETE FROM forecast_locations WHERE user_id = %s AND product_id IN ({', '.join(['%s'] * len(chunk))})",
+                           (user_id, *chunk))
+        insert_query = """
+            INSERT INTO forecasts
+            (user_id, product_id, product_name, location, model, day, step, quantity, p10, p50, p90, generated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
+        """
+        for start in range(0, len(rows), 5000):
+            cursor.executemany(insert_query, rows[start:start + 5000])
+        for start in range(0, len(locations), 5000):
+            cursor.executemany("INSERT INTO forecast_locations (user_id, product_id, location) VALUES (%s, %s, %s)",
+                               locations[start:start + 5000])
+        conn.commit()
+        summary['written'] = len(product_ids)
+        logger.info(f"Stored {horizon_days}-day forecasts for {len(product_ids)} products of user {user_id}")
+        return summary
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+def fetch_stored_forecasts(user_id, horizon_days=None, product_id=None, location=None, after=None, limit=100):
+    """
+    One page of precomputed forecasts, grouped by product in product id order.
+
+    Keyset pagination: pass the returned next_cursor (the last product id of
+    the page) as after to get the following page. Returns (products,
+    next_cursor) where products is a list of dicts with the forecast points
+    and every location the product sells at; location filters on any of them.
+    """
+    query = "SELECT DISTINCT product_id FROM forecasts WHERE user_id = %s"
+    params = [user_id]
+    if location:
+        query += " AND product_id IN (SELECT product_id FROM forecast_locations WHERE user_id = %s AND location = %s)"
+        params += [user_id, location]
+    if product_id:
+        query += " AND product_id = %s"
+        params.append(product_id)
+    if after:
+        query += " AND product_id > %s"
+        params.append(after)
+    query += " ORDER BY product_id LIMIT %s"
+    params.append(limit + 1)
+    product_ids = [row['product_id'] for row in fetch_all(query, tuple(params))]
+
+    next_cursor = product_ids[limit - 1] if len(product_ids) > limit else None
+    product_ids = product_ids[:limit]
+    if not product_ids:
+        return [], None
+
+    points_query = f"""
+        SELECT product_id, product_name, location, model, day, step, quantity, p10, p50, p90, generated_at
+        FROM forecasts
+        WHERE user_id = %s AND product_id IN ({', '.join(['%s'] * len(product_ids))})
+    """
+    points_params = [user_id, *product_ids]
+    if horizon_days:
+        points_query += " AND step <= %s"
+        points_params.append(horizon_days)
+    points_query += " ORDER BY product_id, day"
+
+    locations = {}
+    for row in fetch_all(f"""
+        SELECT product_id, location FROM forecast_locations
+        WHERE user_id = %s AND product_id IN ({', '.join(['%s'] * len(product_ids))})
+        ORDER BY product_id, location
+    """, (user_id, *product_ids)):
+        locations.setdefault(row['product_id'], []).append(row['location'])
+
+    products = {}
+    for row in fetch_all(points_query, tuple(points_params)):
+        product = products.setdefault(row['product_id'], {
+            'product_id': row['product_id'],
+            'name': row['product_name'],
+            'location': row['location'],
+            'locations': locations.get(row['product_id'], []),
+            'model': row['model'],
+            'generated_at': row['generated_at'],
+            'forecast': []
+        })
+        product['forecast'].append({'date': row['day'], 'quantity': row['quantity'],
+                                    'p10': row['p10'], 'p50': row['p50'], 'p90': row['p90']})
+    return [products[p] for p in product_ids if p in products], next_cursor
+
+def fetch_inventory_item_settings(user_id, product_id=None, location=None):
+    """
+    Inventory item settings of a user, optionally only the rows that can apply
+    to one product and/or location (its own rows plus the '*' defaults).
+    """
+    query = """
+        SELECT product_id, location, unit_cost, holding_cost_rate, ordering_cost, lead_time_days, service_level
+        FROM inventory_item_settings
+        WHERE user_id = %s
+    """
+    params = [user_id]
+    if product_id:
+        query += " AND product_id IN (%s, '*')"
+        params.append(product_id)
+    if location:
+        query += " AND location IN (%s, '*')"
+        params.append(location)
+    query += " ORDER BY product_id, location"
+    return fetch_all(query, tuple(params))
+
+def save_inventory_item_settings(user_id, items):
+    """Upsert inventory item settings (dicts as returned by validate_item_settings); returns the number of rows."""
+    conn = get_db()
+    if not conn:
+        raise Error("Failed to create database connection")
+    cursor = conn.cursor()
+    try:
+        cursor.execute(INVENTORY_ITEM_SETTINGS_DDL)
+        rows = [
+            (user_id, item['product_id'], item['location'], item.get('unit_cost'), item.get('holding_cost_rate'),
+             item.get('ordering_cost'), item.get('lead_time_days'), item.get('service_level'))
+            for item in items
+        ]
+        upsert_query = """
+            INSERT INTO inventory_item_settings
+            (user_id, product_id, location, unit_cost, holding_cost_rate, ordering_cost, lead_time_days, service_level)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE unit_cost = VALUES(unit_cost), holding_cost_rate = VALUES(holding_cost_rate),
+                ordering_cost = VALUES(ordering_cost), lead_time_days = VALUES(lead_time_days),
+                service_level = VALUES(service_level)
+        """
+        for start in range(0, len(rows), 1000):
+            cursor.executemany(upsert_query, rows[start:start + 1000])
+        conn.commit()
+        logger.info(f"Saved {len(rows)} inventory item settings for user {user_id}")
+        return len(rows)
+    except Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+def rebuild_daily_demand(user_id=None):
+    """
+    Recompute the daily_demand rollup from historical_data, for one user or all.
+
+    Used to backfill data imported before the rollup existed or to repair it.
+    Returns a summary dict.
+    """
+    conn = get_db()
+    if not conn:
+        raise Error("Failed to create database connection")
+    cursor = conn.cursor(dictionary=True)
+    summary = {'sources': 0, 'records': 0, 'rows': 0}
+    try:
+        ensure_rollup_tables(cursor)
+        query = "SELECT DISTINCT user_id, source FROM historical_data"
+        params = None
+        if user_id is not None:
+            query += " WHERE user_id = %s"
+            params = (user_id,)
+        cursor.execute(query, params)
+        pairs = cursor.fetchall()
+
+        for pair in pairs:
+            cursor.execute("DELETE FROM daily_demand WHERE user_id = %s AND source = %s",
+                           (pair['user_id'], pair['source']))
+            # The rebuilt history may differ from what the states were fit on
+            cursor.execute("DELETE FROM forecast_states WHERE user_id = %s", (pair['user_id'],))
+            for chunk in iter_historical_record_chunks(pair['user_id'], source=pair['source']):
+                summary['records'] += len(chunk)
+                summary['rows'] += update_daily_demand(cursor, pair['user_id'], pair['source'], chunk,
+                                                       update_states=False)
+            bump_data_version(cursor, pair['user_id'])
+            conn.commit()
+            summary['sources'] += 1
+            logger.info(f"Rebuilt daily demand for user {pair['user_id']}, source {pair['source']}")
+        return summary
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+def daily_demand_query(user_id, start_date=None, end_date=None, product_ids=None):
+    """Query and parameters of fetch_daily_demand."""
+    query = """
+        SELECT product_id, MAX(product_name) AS product_name, location, day,
+               SUM(quantity) AS quantity, SUM(record_count) AS record_count
+        FROM daily_demand
+        WHERE user_id = %s
+    """
+    params = [user_id]
+    if start_date:
+        query += " AND day >= %s"
+        params.append(start_date)
+    if end_date:
+        query += " AND day <= %s"
+        params.append(end_date)
+    if product_ids:
+        query += f" AND product_id IN ({', '.join(['%s'] * len(product_ids))})"
+        params.extend(product_ids)
+    query += " GROUP BY product_id, location, day ORDER BY day"
+    return query, tuple(params)
+
+def has_daily_demand(user_id):
+    """Whether the daily_demand rollup holds any rows for the user (i.e. the user is backfilled)."""
+    return fetch_one("SELECT 1 AS found FROM daily_demand WHERE user_id = %s LIMIT 1", (user_id,)) is not None
+
+def fetch_daily_demand(user_id, start_date=None, end_date=None, product_ids=None):
+    """Daily demand of a user per product and location, summed over sources (optionally for some products only)."""
+    return fetch_all(*daily_demand_query(user_id, start_date, end_date, product_ids))
+
+def iter_daily_demand_batches(user_id, start_date=None, end_date=None, product_ids=None, batch_size=None):
+    """
+    Stream fetch_daily_demand as batches of tuples (product_id, product_name,
+    location, day, quantity, record_count), for DailyDemandAggregator.add_daily_totals.
+    """
+    query, params = daily_demand_query(user_id, start_date, end_date, product_ids)
+    return fetch_batches(query, params, batch_size, row_format='tuple')
+
 def save_historical_data(data, source, user_id):
-    """Save historical data with proper merging of records from the same source"""
+    """
+    Save historical data with proper merging of records from the same source.
+
+    Returns the validate_import_records report of data when saved, False otherwise.
+    """
     try:
         conn = get_db()
         if not conn:
@@ -194,11 +1130,29 @@ def save_historical_data(data, source, user_id):
             return False
             
         cursor = conn.cursor(dictionary=True)
+
+        # DDL commits implicitly, so make sure the rollup table exists before the transaction
+        ensure_rollup_tables(cursor)
+
+        # Normalize dates once; the rollup and later reads of the raw blob reuse epoch_day
+        annotate_epoch_days(data, default_date=datetime.now())
+
+        # Columnar quality checks; bad rows are reported, the rollup skips what it cannot use
+        quality = validate_import_records(data)
+        if quality['invalid_records']:
+            logger.warning(f"{source} import for user {user_id}: {quality['invalid_records']} of "
+                           f"{quality['total_records']} records failed validation ({'; '.join(quality['issues'])})")
+
+        # Bumped first so the import holds the user's version row lock throughout;
+        # refresh_forecast_states takes the same lock before saving its fit
+        bump_data_version(cursor, user_id)
         
-        # Check if a record already exists for this user and source
+        # Check if a record already exists for this user and source; bulk
+        # loads can leave several, the oldest is the one kept up to date
         check_query = """
             SELECT id, data FROM historical_data 
             WHERE user_id = %s AND source = %s
+            ORDER BY id
             LIMIT 1
         """
         cursor.execute(check_query, (user_id, source))
@@ -208,12 +1162,14 @@ def save_historical_data(data, source, user_id):
             # Record exists - update it instead of creating a new one
             try:
                 # For CSV, we want to merge the new data with existing data
+                appended = False
                 if source == 'csv' and existing_record.get('data'):
                     # Parse existing data and merge
                     try:
                         existing_data = json.loads(existing_record['data'])
                         # Merge while ensuring no duplicates (simple concatenation for now)
                         merged_data = existing_data + data
+                        appended = True
                     except json.JSONDecodeError:
                         # If existing data is not valid JSON, just use new data
                         merged_data = data
@@ -228,8 +1184,19 @@ def save_historical_data(data, source, user_id):
                     WHERE id = %s
                 """
                 cursor.execute(update_query, (json.dumps(merged_data), existing_record['id']))
+                if not appended:
+                    # Replacing covers the whole source, like the rollup
+                    # below: drop other rows of it (bulk_load_historical_data batches)
+                    cursor.execute("""
+                        DELETE FROM historical_data
+                        WHERE user_id = %s AND source = %s AND id <> %s
+                    """, (user_id, source, existing_record['id']))
+
+                # Appended records add to the rollup, replaced data replaces its rows
+                update_daily_demand(cursor, user_id, source, data, replace=not appended,
+                                    default_date=datetime.now())
                 conn.commit()
-                return True
+                return quality
             except Exception as e:
                 conn.rollback()
                 print(f"Error updating existing record: {str(e)}")
@@ -252,8 +1219,9 @@ def save_historical_data(data, source, user_id):
                 )
                 
                 cursor.execute(insert_query, values)
+                update_daily_demand(cursor, user_id, source, data, replace=True, default_date=datetime.now())
                 conn.commit()
-                return True
+                return quality
             except Exception as e:
                 conn.rollback()
                 print(f"Error creating new record: {str(e)}")
@@ -268,6 +1236,288 @@ def save_historical_data(data, source, user_id):
         if 'conn' in locals():
             conn.close()
 
+def encode_page_cursor(date, row_id, offset=None):
+    """
+    Opaque keyset cursor for the (date, id) of the last row of a page, or
+    with offset for the next record of a record page inside that row.
+    """
+    value = f"{date.isoformat() if isinstance(date, datetime) else date}|{row_id}"
+    if offset is not None:
+        value += f"|{offset}"
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+def decode_page_cursor(cursor):
+    """
+    (date, id, offset) of a cursor made by encode_page_cursor, offset None
+    for row cursors; raises ValueError when it is malformed.
+    """
+    try:
+        value = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        parts = value.split('|')
+        if len(parts) not in (2, 3):
+            raise ValueError(cursor)
+        offset = int(parts[2]) if len(parts) == 3 else None
+        if offset is not None and offset < 0:
+            raise ValueError(cursor)
+        return datetime.fromisoformat(parts[0]), int(parts[1]), offset
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def historical_filters(user_id, source=None, start_date=None, end_date=None):
+    """
+    WHERE clause and parameters selecting a user's historical_data rows.
+
+    start_date and end_date (YYYY-MM-DD, inclusive) become a plain range on
+    date that indexes on date can serve.
+    """
+    where = "user_id = %s"
+    params = [user_id]
+    if source:
+        where += " AND source = %s"
+        params.append(source)
+    if start_date:
+        where += " AND date >= %s"
+        params.append(datetime.strptime(start_date, '%Y-%m-%d'))
+    if end_date:
+        where += " AND date < %s"
+        params.append(datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1))
+    return where, params
+
+# Records held by a historical_data row: the length of its JSON array, 1 for
+# a single record and 0 for a payload that is not valid JSON (CASE evaluates
+# lazily, so JSON_TYPE never sees invalid JSON)
+RECORD_COUNT_SQL = ("CASE WHEN NOT JSON_VALID(data) THEN 0 WHEN JSON_TYPE(data) = 'ARRAY' "
+                    "THEN JSON_LENGTH(data) ELSE 1 END")
+
+def count_historical_records(user_id, source=None, start_date=None, end_date=None, mode='auto'):
+    """
+    Number of records in the imports matching the history filters, as (count, is_estimate).
+
+    'exact' sums the record counts of the matching imports on the server;
+    'estimate' is the daily_demand rollup's record count, which leaves out
+    records the rollup could not use and filters on the record day rather
+    than the import date; 'auto' counts exactly while the matching imports
+    are at most COUNT_CONFIG['exact_max_rows'] rows (see count_with_mode).
+    """
+    if mode == 'none':
+        return None, False
+    where, params = historical_filters(user_id, source, start_date, end_date)
+    if mode == 'exact' or (mode == 'auto' and
+                           count_rows('historical_data', where, params, estimate=True) <= COUNT_CONFIG['exact_max_rows']):
+        row = fetch_one(f"SELECT COALESCE(SUM({RECORD_COUNT_SQL}), 0) AS total FROM historical_data WHERE {where}",
+                        tuple(params))
+        if row is None:
+            raise Error("Failed to count historical records")
+        return int(row['total']), False
+    rollup_where = "user_id = %s" + (" AND source = %s" if source else "")
+    rollup_params = [user_id] + ([source] if source else [])
+    if start_date:
+        rollup_where += " AND day >= %s"
+        rollup_params.append(start_date)
+    if end_date:
+        rollup_where += " AND day <= %s"
+        rollup_params.append(end_date)
+    row = fetch_one(f"SELECT COALESCE(SUM(record_count), 0) AS total FROM daily_demand WHERE {rollup_where}",
+                    tuple(rollup_params))
+    if row is None:
+        raise Error("Failed to count historical records")
+    return int(row['total']), True
+
+def fetch_historical_page(user_id, source=None, start_date=None, end_date=None, after=None, limit=100,
+                          columns=HISTORICAL_PAGE_COLUMNS):
+    """
+    One page of a user's historical_data rows, newest first.
+
+    Keyset pagination on (date, id): pass the returned next_cursor as after
+    to get the following page, so every page costs the same however deep it
+    is. start_date and end_date (YYYY-MM-DD, inclusive) filter on the row
+    date as plain ranges. Returns (rows, next_cursor).
+    """
+    where, params = historical_filters(user_id, source, start_date, end_date)
+    query = f"SELECT {', '.join(columns)} FROM historical_data WHERE {where}"
+    if after:
+        after_date, after_id, _ = decode_page_cursor(after)
+        query += " AND (date < %s OR (date = %s AND id < %s))"
+        params.extend([after_date, after_date, after_id])
+    query += " ORDER BY date DESC, id DESC LIMIT %s"
+    params.append(limit + 1)
+    rows = fetch_all(query, tuple(params))
+
+    next_cursor = encode_page_cursor(rows[limit - 1]['date'], rows[limit - 1]['id']) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def fetch_historical_record_page(user_id, source=None, start_date=None, end_date=None, after=None, limit=100):
+    """
+    One page of the individual records of a user's imports.
+
+    Imports (historical_data rows) are read newest first and their records
+    in stored order; records without a date of their own inherit their
+    import's date. Keyset pagination on (import date, import id, record
+    offset): pass the returned next_cursor as after to continue. Only the
+    slice of an import a page needs is extracted, on the server (JSON array
+    range path), so a page costs the same however deep it is and however
+    many records an import holds. start_date and end_date filter on the
+    import date as in fetch_historical_page. Returns (records, next_cursor).
+    """
+    where, params = historical_filters(user_id, source, start_date, end_date)
+    keyset, keyset_params, resume = '', [], (None, 0)
+    if after:
+        after_date, after_id, offset = decode_page_cursor(after)
+        # A record cursor resumes inside its import, a row cursor after it
+        keyset = f" AND (date < %s OR (date = %s AND id {'<' if offset is None else '<='} %s))"
+        keyset_params = [after_date, after_date, after_id]
+        resume = (after_id, offset or 0)
+
+    # Plan (row, first record, record count) slices until the page is full
+    slices, taken, next_cursor = [], 0, None
+    while next_cursor is None:
+        rows = fetch_all(f"""
+            SELECT id, date, {RECORD_COUNT_SQL} AS record_count FROM historical_data
+            WHERE {where}{keyset}
+            ORDER BY date DESC, id DESC LIMIT %s
+        """, tuple(params + keyset_params + [limit + 1]))
+        for row in rows:
+            start = resume[1] if row['id'] == resume[0] else 0
+            if start >= row['record_count']:
+                continue
+            if taken == limit:
+                next_cursor = encode_page_cursor(row['date'], row['id'], start)
+                break
+            count = min(limit - taken, row['record_count'] - start)
+            slices.append((row, start, count))
+            taken += count
+            if start + count < row['record_count'] and taken == limit:
+                next_cursor = encode_page_cursor(row['date'], row['id'], start + count)
+                break
+        if len(rows) <= limit:
+            break
+        last = rows[-1]
+        keyset = " AND (date < %s OR (date = %s AND id < %s))"
+        keyset_params = [last['date'], last['date'], last['id']]
+
+    records = []
+    for row, start, count in slices:
+        extracted = fetch_one(
+            "SELECT JSON_EXTRACT(data, IF(JSON_TYPE(data) = 'ARRAY', %s, '$')) AS records "
+            "FROM historical_data WHERE id = %s",
+            (f"$[{start} to {start + count - 1}]", row['id']))
+        if extracted is None:
+            raise Error(f"Failed to read records of historical_data row {row['id']}")
+        payload = json.loads(extracted['records']) if extracted['records'] is not None else []
+        if not isinstance(payload, list):
+            payload = [payload]
+        for record in payload:
+            if isinstance(record, dict) and 'date' not in record:
+                record = {**record, 'date': row['date']}
+            records.append(record)
+    return records, next_cursor
+
+def bulk_load_historical_data(user_id, source, batches):
+    """
+    Append record batches to a user's history, one historical_data row and transaction per batch.
+
+    Unlike save_historical_data, which keeps one growing row per source,
+    this suits millions of records (load tests, backfills). Each batch also
+    updates the daily_demand rollup and bumps the data version. A later
+    save_historical_data that replaces the source (any but csv) replaces
+    all these rows too, so history and the rollup stay in step. Returns a
+    summary dict.
+    """
+    conn = get_db()
+    if not conn:
+        raise Error("Failed to create database connection")
+    cursor = conn.cursor(dictionary=True)
+    summary = {'batches': 0, 'records': 0}
+    try:
+        ensure_rollup_tables(cursor)
+        for batch in batches:
+            if not batch:
+                continue
+            annotate_epoch_days(batch, default_date=datetime.now())
+            bump_data_version(cursor, user_id)
+            cursor.execute("""
+                INSERT INTO historical_data (user_id, data, source, date, created_at, updated_at)
+                VALUES (%s, %s, %s, NOW(), NOW(), NOW())
+            """, (user_id, json.dumps(batch), source))
+            update_daily_demand(cursor, user_id, source, batch, default_date=datetime.now())
+            conn.commit()
+            summary['batches'] += 1
+            summary['records'] += len(batch)
+            logger.info(f"Loaded batch {summary['batches']} ({summary['records']} records) for user {user_id}")
+        return summary
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+def iter_json_records(payload):
+    """
+    Records of a stored JSON payload, decoded one at a time.
+
+    An array is walked element by element with raw_decode, so only the
+    payload text and the current record are held instead of the whole
+    decoded list; any other JSON value is one record. Raises ValueError on
+    invalid JSON, possibly after yielding the records before the error.
+    """
+    if isinstance(payload, (bytes, bytearray)):
+        payload = payload.decode('utf-8')
+    index = JSON_WHITESPACE.match(payload).end()
+    if payload[index:index + 1] != '[':
+        yield json.loads(payload)
+        return
+    index = JSON_WHITESPACE.match(payload, index + 1).end()
+    if payload[index:index + 1] == ']':
+        return
+    while True:
+        record, index = json_decoder.raw_decode(payload, index)
+        yield record
+        index = JSON_WHITESPACE.match(payload, index).end()
+        separator = payload[index:index + 1]
+        if separator == ']':
+            return
+        if separator != ',':
+            raise ValueError(f"Expected ',' or ']' at position {index}")
+        index = JSON_WHITESPACE.match(payload, index + 1).end()
+
+def iter_historical_record_chunks(user_id, chunk_size=None, source=None, start_date=None, end_date=None):
+    """
+    Stream a user's imported records in chunks of at most chunk_size.
+
+    Stored rows (one per import) are read one at a time through an
+    unbuffered cursor and their JSON arrays decoded record by record (see
+    iter_json_records), so memory is bounded by the largest single import's
+    JSON text plus one chunk, not by the history size. Records without a
+    date of their own inherit the date of the row they were saved in.
+    start_date and end_date (YYYY-MM-DD, inclusive) filter on the row
+    (import) date, not on the records' own dates.
+    """
+    chunk_size = chunk_size or STREAM_CHUNK_SIZE
+    where, params = historical_filters(user_id, source, start_date, end_date)
+    # Each row may hold thousands of records, so rows are fetched a few at a time
+    rows = iter_rows(f"SELECT id, data, date FROM historical_data WHERE {where} ORDER BY id", tuple(params),
+                     row_format='tuple', batch_size=16)
+
+    chunk = []
+    for row_id, payload, row_date in rows:
+        if isinstance(payload, (str, bytes, bytearray)):
+            records = iter_json_records(payload)
+        else:
+            records = iter(payload if isinstance(payload, list) else [payload])
+        try:
+            for record in records:
+                if isinstance(record, dict) and 'date' not in record:
+                    record = {**record, 'date': row_date}
+                chunk.append(record)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        except ValueError:
+            logger.warning(f"Skipping the rest of historical_data row {row_id}: invalid JSON")
+    if chunk:
+        yield chunk
+
 def get_db():
     """Create and return a database connection"""
     try:
@@ -0,0 +1,111 @@
+import logging
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+from dateutil import parser
+
+logger = logging.getLogger(__name__)
+
+# Layouts tried as vectorized pandas parses, most common in imported data
+# first; anything left over goes through dateutil one distinct value at a time.
+# Ambiguous numeric layouts are month-first, matching dateutil's default.
+KNOWN_DATE_FORMATS = (
+    'ISO8601',
+    '%m/%d/%Y',
+    '%m/%d/%Y %H:%M:%S',
+    '%m/%d/%Y %H:%M',
+    '%d %b %Y',
+    '%b %d, %Y'
+)
+
+# Values parse_datetimes reads as dates (datetime and pd.Timestamp are dates
+# too). Anything else, numbers included, is unparseable: a bare number has
+# no unit that could be told apart from a date.
+DATETIME_LIKE_TYPES = (str, date, np.datetime64)
+
+
+def _wall_time(parsed):
+    """Drop time zones from a parsed Series, keeping the local wall-clock time."""
+    if getattr(parsed.dt, 'tz', None) is not None:
+        parsed = parsed.dt.tz_localize(None)
+    return parsed.to_numpy(dtype='datetime64[ns]')
+
+
+def _parse_with_dateutil(value):
+    try:
+        parsed = value if isinstance(value, (datetime, date)) else parser.parse(str(value))
+        return np.datetime64(pd.Timestamp(parsed).tz_localize(None) if getattr(parsed, 'tzinfo', None)
+                             else pd.Timestamp(parsed), 'ns')
+    except (TypeError, ValueError, OverflowError, pd.errors.OutOfBoundsDatetime):
+        return np.datetime64('NaT', 'ns')
+
+
+def _parse_distinct(values, formats, fallback):
+    """Parse an array of distinct non-null values; returns datetime64[ns] with NaT where unparseable."""
+    result = np.full(len(values), np.datetime64('NaT', 'ns'))
+    is_string = np.array([isinstance(value, str) for value in values], dtype=bool)
+
+    # Date/datetime objects and numpy/pandas timestamps (the only other
+    # values parse_datetimes lets through) convert directly
+    others = np.flatnonzero(~is_string)
+    if len(others):
+        try:
+            result[others] = _wall_time(pd.to_datetime(pd.Series(values[others], dtype=object), errors='coerce'))
+        except (TypeError, ValueError):
+            result[others] = [_parse_with_dateutil(value) for value in values[others]]
+
+    remaining = np.flatnonzero(is_string)
+    strings = pd.Series([value.strip() for value in values[remaining]], dtype=object)
+    for date_format in formats:
+        if not len(remaining):
+            break
+        try:
+            parsed = _wall_time(pd.to_datetime(strings, errors='coerce', format=date_format))
+        except (TypeError, ValueError):
+            # e.g. mixed UTC offsets within one format; leave those rows to the next stage
+            continue
+        matched = ~np.isnat(parsed)
+        result[remaining[matched]] = parsed[matched]
+        remaining, strings = remaining[~matched], strings[~matched].reset_index(drop=True)
+
+    if fallback and len(remaining):
+        result[remaining] = [_parse_with_dateutil(value) for value in strings]
+    return result
+
+
+def parse_datetimes(values, formats=KNOWN_DATE_FORMATS, fallback=True):
+    """
+    Parse dates, datetimes and date strings in one vectorized pass.
+
+    Every distinct value is parsed once: first with the given formats as
+    whole-array pandas parses, then (unless fallback is False) with dateutil
+    for the stragglers. Time zones are dropped, keeping wall-clock time.
+    Values that are not strings or date-like objects (numbers, booleans,
+    dicts, lists) count as unparseable. Returns a datetime64[ns] array with
+    NaT for missing or unparseable values.
+    """
+    codes, uniques = pd.factorize(pd.Series([value if isinstance(value, DATETIME_LIKE_TYPES) else None
+                                             for value in values], dtype=object))
+    parsed = _parse_distinct(np.asarray(uniques, dtype=object), formats, fallback)
+    result = np.full(len(codes), np.datetime64('NaT', 'ns'))
+    present = codes >= 0
+    result[present] = parsed[codes[present]]
+    return result
+
+
+def to_epoch_days(values, formats=KNOWN_DATE_FORMATS, fallback=True):
+    """
+    Convert dates/date strings to day numbers since the Unix epoch.
+
+    Returns a float array with NaN for values that cannot be parsed.
+    """
+    days = parse_datetimes(values, formats, fallback).astype('datetime64[D]')
+    result = days.astype('int64').astype(float)
+    result[np.isnat(days)] = np.nan
+    return result
+
+
+def epoch_day_labels(days):
+    """Format epoch day numbers as YYYY-MM-DD strings."""
+    return np.datetime_as_string(np.asarray(days, dtype='int64').astype('datetime64[D]'), unit='D')
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+
+from date_utils import to_epoch_days
+
+# Keys added to records at import for internal use (see annotate_epoch_days),
+# left out of everything returned to clients
+INTERNAL_RECORD_KEYS = ('epoch_day',)
+
+
+def demand_fields(record):
+    """
+    Extract (product_id, product_name, location, date, quantity) from an imported record.
+
+    Understands the {'date', 'data': {...}} layout of CSV/Odoo/mock records and
+    the item/warehouse layout of Zoho records. Returns None for records
+    without a usable quantity.
+    """
+    if not isinstance(record, dict):
+        return None
+    data = record.get('data')
+    if isinstance(data, dict):
+        product_id = data.get('product_id', data.get('product', 'unknown'))
+        product_name = data.get('product', 'Product')
+        location = data.get('location', 'All Locations')
+        quantity = data['quantity'] if 'quantity' in data else record.get('quantity', 0)
+    elif isinstance(record.get('item'), dict):
+        item = record['item']
+        warehouse = record.get('warehouse') if isinstance(record.get('warehouse'), dict) else {}
+        product_id = item.get('id') or item.get('name') or 'unknown'
+        product_name = item.get('name') or 'Product'
+        location = warehouse.get('name') or 'All Locations'
+        quantity = record.get('quantity', 0)
+    else:
+        return None
+    try:
+        quantity = float(quantity or 0)
+    except (TypeError, ValueError):
+        return None
+    # Product ids are kept as strings so mixed int/str ids from different sources group together
+    return str(product_id), product_name, location, record.get('date'), quantity
+
+
+def aggregate_daily_demand(records, default_date=None):
+    """
+    Sum records into daily demand per product and location.
+
+    Returns (frame, product_info): frame has product, location, day (epoch day
+    number), quantity and count columns; product_info maps product ids to
+    their name and first seen location. Records without a date use
+    default_date, or are skipped when it is None.
+    """
+    product_ids = []
+    locations = []
+    raw_dates = []
+    stored_days = []
+    quantities = []
+    product_info = {}
+    for record in records or []:
+        fields = demand_fields(record)
+        if fields is None:
+            continue
+        product_id, product_name, location, record_date, quantity = fields
+        # Day normalized at import (see annotate_epoch_days); older records are parsed below
+        stored_day = record.get('epoch_day', np.nan)
+        if record_date is None and np.isnan(stored_day):
+            if default_date is None:
+                continue
+            record_date = default_date
+        product_ids.append(product_id)
+        locations.append(str(location))
+        raw_dates.append(record_date)
+        stored_days.append(stored_day)
+        quantities.append(quantity)
+        if product_id not in product_info:
+            product_info[product_id] = {'name': product_name, 'location': location}
+
+    days = np.array(stored_days, dtype=float)
+    unparsed = np.flatnonzero(np.isnan(days))
+    if len(unparsed):
+        days[unparsed] = to_epoch_days([raw_dates[i] for i in unparsed])
+    valid = ~np.isnan(days)
+    frame = pd.DataFrame({
+        'product': pd.Series(product_ids, dtype=object)[valid].to_numpy(),
+        'location': pd.Series(locations, dtype=object)[valid].to_numpy(),
+        'day': days[valid].astype(np.int64),
+        'quantity': np.asarray(quantities, dtype=float)[valid],
+        'count': 1
+    })
+    if not frame.empty:
+        frame = frame.groupby(['product', 'location', 'day'], as_index=False)[['quantity', 'count']].sum()
+    return frame, product_info
+
+
+def public_record(record):
+    """A record without its INTERNAL_RECORD_KEYS (the record itself when it has none)."""
+    if isinstance(record, dict) and any(key in record for key in INTERNAL_RECORD_KEYS):
+        return {key: value for key, value in record.items() if key not in INTERNAL_RECORD_KEYS}
+    return record
+
+
+def public_payload(payload):
+    """public_record of every record of a stored payload (a list of records or a single record)."""
+    if isinstance(payload, list):
+        return [public_record(record) for record in payload]
+    return public_record(payload)
+
+
+def annotate_epoch_days(records, default_date=None):
+    """
+    Store each record's normalized day as record['epoch_day'], parsing all dates in one pass.
+
+    Done once at import so later aggregations skip date parsing. Records
+    without a date get default_date's day; unparseable dates are left unset.
+    """
+    dates = [record.get('date') if isinstance(record, dict) else None for record in records or []]
+    if default_date is not None:
+        dates = [default_date if value is None else value for value in dates]
+    for record, day in zip(records or [], to_epoch_days(dates)):
+        if isinstance(record, dict) and not np.isnan(day):
+            record['epoch_day'] = int(day)
+    return records
@@ -0,0 +1,91 @@
+import csv
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+from io import StringIO
+
+from demand_records import demand_fields, public_record
+
+# Streamed export formats and their response mimetypes
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+# Columns of CSV exports: one row per record in the demand layout
+EXPORT_CSV_COLUMNS = ('date', 'product_id', 'product', 'location', 'quantity')
+
+# Records per CSV upload chunk when previews are streamed
+CSV_PREVIEW_CHUNK_SIZE = int(os.getenv('CSV_PREVIEW_CHUNK_SIZE', 1000))
+
+
+def iter_chunks(items, size):
+    """Lists of at most size consecutive items of an iterable."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def json_default(value):
+    """JSON encoding of the DB types found in records (datetimes, decimals)."""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def iter_ndjson(chunks, trailer=None):
+    """
+    Newline-delimited JSON for chunks of records, one string per chunk.
+
+    Internal record keys are left out (see public_record). trailer, when
+    given, is called after the last chunk with the number of records
+    written and its dict is written as the final line, e.g. totals.
+    """
+    total = 0
+    for chunk in chunks:
+        if chunk:
+            total += len(chunk)
+            yield ''.join(json.dumps(public_record(record), default=json_default) + '\n' for record in chunk)
+    if trailer:
+        yield json.dumps(trailer(total), default=json_default) + '\n'
+
+
+def iter_csv(chunks, columns=EXPORT_CSV_COLUMNS):
+    """
+    CSV for chunks of imported records, header first, one string per chunk.
+
+    Records are flattened with demand_fields; records it cannot read (no
+    usable quantity) are left out, use NDJSON for a lossless export.
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for chunk in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        for record in chunk:
+            fields = demand_fields(record)
+            if fields is None:
+                continue
+            product_id, product_name, location, record_date, quantity = fields
+            if isinstance(record_date, (datetime, date)):
+                record_date = record_date.isoformat(sep=' ') if isinstance(record_date, datetime) else record_date.isoformat()
+            writer.writerow((record_date, product_id, product_name, location, quantity))
+        if buffer.tell():
+            yield buffer.getvalue()
+
+
+def export_filename(source, export_format):
+    """Download name of an export, e.g. csv-history-20240101.ndjson."""
+    return f"{source}-history-{datetime.now().strftime('%Y%m%d')}.{export_format}"
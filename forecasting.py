@@ -0,0 +1,816 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from date_utils import to_epoch_days, epoch_day_labels
+from demand_records import aggregate_daily_demand
+
+logger = logging.getLogger(__name__)
+
+# Products with fewer observed days than this are not forecast
+MIN_HISTORY_POINTS = 3
+
+# Rolling-origin backtests used by automatic model selection
+BACKTEST_CONFIG = {
+    'folds': int(os.getenv('FORECAST_BACKTEST_FOLDS', 3)),
+    'workers': int(os.getenv('FORECAST_BACKTEST_WORKERS', os.cpu_count() or 1)),
+    # Catalogs smaller than this are backtested in-process
+    'parallel_min_products': int(os.getenv('FORECAST_BACKTEST_PARALLEL_MIN_PRODUCTS', 500))
+}
+
+
+class DailyDemandAggregator:
+    """
+    Incrementally sum inventory records into daily per-product demand.
+
+    Chunks of raw records (see demand_fields) or of pre-aggregated daily
+    totals can be added one at a time, so memory grows with products x days
+    rather than with the number of raw records. Demand outside the optional
+    [start_date, end_date] window is skipped. With by_location=True totals are
+    kept per product and location (see daily_totals).
+    """
+
+    def __init__(self, start_date=None, end_date=None, by_location=False):
+        self.start_day = to_epoch_days([start_date])[0] if start_date else -np.inf
+        self.end_day = to_epoch_days([end_date])[0] if end_date else np.inf
+        self.product_info = {}
+        self.records_seen = 0
+        self._keys = ['product', 'location', 'day'] if by_location else ['product', 'day']
+        self._totals = pd.DataFrame(columns=['quantity', 'count'],
+                                    index=pd.MultiIndex.from_tuples([], names=self._keys))
+
+    def add(self, records):
+        """Aggregate one chunk of raw records."""
+        frame, product_info = aggregate_daily_demand(records)
+        for product_id, info in product_info.items():
+            self.product_info.setdefault(product_id, info)
+        self._add_frame(frame)
+
+    def add_daily_totals(self, rows):
+        """Aggregate rows already summed per day, with product_id, product_name, location, day, quantity and record_count."""
+        frame = pd.DataFrame(rows, columns=['product_id', 'product_name', 'location', 'day', 'quantity', 'record_count'])
+        if frame.empty:
+            return
+        for product_id, product_name, location in frame[['product_id', 'product_name', 'location']].drop_duplicates('product_id').itertuples(index=False):
+            self.product_info.setdefault(str(product_id), {'name': product_name, 'location': location})
+        self._add_frame(pd.DataFrame({
+            'product': frame['product_id'].astype(str),
+            'location': frame['location'].astype(str),
+            'day': to_epoch_days(frame['day'].tolist()).astype(np.int64),
+            'quantity': frame['quantity'].astype(float),
+            'count': frame['record_count'].astype(np.int64)
+        }))
+
+    def _add_frame(self, frame):
+        if frame.empty:
+            return
+        self.records_seen += int(frame['count'].sum())
+        frame = frame[(frame['day'] >= self.start_day) & (frame['day'] <= self.end_day)]
+        if frame.empty:
+            return
+        chunk = frame.groupby(self._keys)[['quantity', 'count']].sum()
+        self._totals = chunk if self._totals.empty else self._totals.add(chunk, fill_value=0)
+
+    @property
+    def observations(self):
+        """Number of distinct (product, day) cells, or (product, location, day) cells, with demand recorded."""
+        return len(self._totals)
+
+    def daily_totals(self):
+        """Aggregated totals as a frame with product, [location,] day, quantity and count columns."""
+        return self._totals.reset_index()
+
+    def matrix(self):
+        """
+        Return (first_day, demand, observed, product_ids, product_info) where
+        demand and observed are (days, products) arrays and first_day is the
+        epoch day number of row 0, or None when nothing was aggregated.
+        """
+        if self._totals.empty:
+            return None
+        totals = self._totals
+        if 'location' in self._keys:
+            totals = totals.groupby(level=['product', 'day']).sum()
+        product_codes, unique_products = pd.factorize(totals.index.get_level_values('product'))
+        days = totals.index.get_level_values('day').to_numpy(dtype=np.int64)
+
+        first_day = int(days.min())
+        day_codes = days - first_day
+        num_days = int(day_codes.max()) + 1
+        num_products = len(unique_products)
+
+        demand = np.zeros((num_days, num_products))
+        observed = np.zeros((num_days, num_products), dtype=bool)
+        demand[day_codes, product_codes] = totals['quantity'].to_numpy(dtype=float)
+        observed[day_codes, product_codes] = True
+
+        product_ids = list(unique_products)
+        return first_day, demand, observed, product_ids, {p: self.product_info[p] for p in product_ids}
+
+
+def build_demand_matrix(records, start_date=None, end_date=None):
+    """Pivot a list of records into a date x product demand matrix (see DailyDemandAggregator.matrix)."""
+    aggregator = DailyDemandAggregator(start_date, end_date)
+    aggregator.add(records)
+    return aggregator.matrix()
+
+
+def linear_trend_sums(demand, observed, offsets=0):
+    """
+    Sufficient statistics of the normal equations of demand = intercept + slope * day.
+
+    Row t of each column is day offsets + t; only days flagged in observed
+    count (the linear model flags every day of a product's active span). Sums
+    of consecutive segments add up to the sums of the whole series, which is
+    what makes the linear model updatable online.
+    """
+    t = np.asarray(offsets, dtype=float) + np.arange(demand.shape[0], dtype=float)[:, None]
+    weights = observed.astype(float)
+    y = np.where(observed, np.nan_to_num(demand), 0.0)
+    return {
+        'n': weights.sum(axis=0),
+        'sum_t': (weights * t).sum(axis=0),
+        'sum_tt': (weights * t * t).sum(axis=0),
+        'sum_y': y.sum(axis=0),
+        'sum_ty': (y * t).sum(axis=0),
+        'sum_yy': (y * y).sum(axis=0)
+    }
+
+
+def solve_linear_trends(sums):
+    """Solve the 2-parameter normal equations in closed form per column; returns (intercept, slope)."""
+    n, sum_t = sums['n'], sums['sum_t']
+    denominator = n * sums['sum_tt'] - sum_t ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(denominator > 0, (n * sums['sum_ty'] - sum_t * sums['sum_y']) / denominator, 0.0)
+        intercept = np.where(n > 0, (sums['sum_y'] - slope * sum_t) / n, 0.0)
+    return intercept, slope
+
+
+def fit_linear_trends(demand, observed):
+    """
+    Least-squares fit of demand = intercept + slope * day for every product at once.
+
+    Every day from a product's first to its last observed day enters the fit,
+    days without records as zero demand (the demand definition of all other
+    models and of the backtests). Returns (intercept, slope, counts) arrays
+    with one entry per product column.
+    """
+    active = np.maximum.accumulate(observed, axis=0) & np.maximum.accumulate(observed[::-1], axis=0)[::-1]
+    sums = linear_trend_sums(demand, active)
+    intercept, slope = solve_linear_trends(sums)
+    return intercept, slope, sums['n']
+
+
+# Forecast models by name; each takes (series, horizon) and returns
+# (forecasts, params): a (products, horizon) array and a dict of per-product
+# arrays with the fitted parameters and final state
+FORECAST_MODELS = {}
+# Per model, a function (params, lengths, horizon) projecting fitted params
+# forward from each product's last day without refitting
+FORECAST_PROJECTIONS = {}
+# Per model, a function (params, segment, offsets) folding newly arrived days
+# into fitted params without refitting: segment is a DemandSeries of the days
+# following each product's last fitted day and offsets the fitted lengths
+FORECAST_UPDATES = {}
+# Per model, a function (params, lengths, horizon) returning the standard
+# deviation of the forecast error at each step, for prediction intervals
+FORECAST_ERROR_STDS = {}
+
+# Quantiles reported with every forecast unless a request asks for others
+DEFAULT_QUANTILES = (0.1, 0.5, 0.9)
+DEFAULT_FORECAST_MODEL = 'linear'
+DEFAULT_SEASON_LENGTH = 7
+
+# Smoothing parameter grids searched per product (by in-sample one-step error)
+SMOOTHING_GRID = {
+    'alpha': (0.1, 0.2, 0.3, 0.5, 0.7),
+    'beta': (0.05, 0.15),
+    'gamma': (0.05, 0.2)
+}
+
+
+def register_forecast_model(name):
+    """Decorator adding a model function to FORECAST_MODELS."""
+    def decorator(func):
+        FORECAST_MODELS[name] = func
+        return func
+    return decorator
+
+
+def register_forecast_projection(*names):
+    """Decorator adding a projection function to FORECAST_PROJECTIONS."""
+    def decorator(func):
+        for name in names:
+            FORECAST_PROJECTIONS[name] = func
+        return func
+    return decorator
+
+
+def register_forecast_update(*names):
+    """Decorator adding an online update function to FORECAST_UPDATES."""
+    def decorator(func):
+        for name in names:
+            FORECAST_UPDATES[name] = func
+        return func
+    return decorator
+
+
+def register_forecast_error_std(*names):
+    """Decorator adding a forecast error function to FORECAST_ERROR_STDS."""
+    def decorator(func):
+        for name in names:
+            FORECAST_ERROR_STDS[name] = func
+        return func
+    return decorator
+
+
+class DemandSeries:
+    """
+    Per-product daily demand aligned to each product's first observed day.
+
+    values[t, p] is demand of product p on day start_days[p] + t (0 for days
+    without records) for t < lengths[p], NaN afterwards; observed marks days
+    that had records.
+    """
+
+    def __init__(self, values, observed, lengths, start_days, season_length=DEFAULT_SEASON_LENGTH):
+        self.values = values
+        self.observed = observed
+        self.lengths = lengths
+        self.start_days = start_days
+        self.season_length = season_length
+
+    @classmethod
+    def from_matrix(cls, first_day, demand, observed, season_length=DEFAULT_SEASON_LENGTH):
+        num_days, num_products = demand.shape
+        columns = np.arange(num_products)
+        first = np.argmax(observed, axis=0)
+        last = num_days - 1 - np.argmax(observed[::-1], axis=0)
+        lengths = last - first + 1
+        t = np.arange(lengths.max() if num_products else 0)[:, None]
+        index = np.minimum(first[None, :] + t, num_days - 1)
+        active = t < lengths[None, :]
+        values = np.where(active, demand[index, columns], np.nan)
+        aligned_observed = active & observed[index, columns]
+        return cls(values, aligned_observed, lengths, first_day + first, season_length)
+
+    @classmethod
+    def from_points(cls, columns, t, quantities, observed, num_products, start_days, season_length=DEFAULT_SEASON_LENGTH):
+        """
+        Series built from sparse (column, day offset t, quantity, observed) points.
+
+        Each product's length runs up to its last point; days without a point
+        are unobserved zero-demand days.
+        """
+        lengths = np.zeros(num_products, dtype=np.int64)
+        np.maximum.at(lengths, columns, t + 1)
+        rows = int(lengths.max()) if num_products else 0
+        values = np.zeros((rows, num_products))
+        aligned_observed = np.zeros((rows, num_products), dtype=bool)
+        np.add.at(values, (t, columns), quantities)
+        aligned_observed[t[observed], columns[observed]] = True
+        values[np.arange(rows)[:, None] >= lengths[None, :]] = np.nan
+        return cls(values, aligned_observed, lengths, np.asarray(start_days), season_length)
+
+    def subset(self, columns):
+        """Series restricted to the given product columns."""
+        lengths = self.lengths[columns]
+        rows = lengths.max() if len(columns) else 0
+        return DemandSeries(self.values[:rows, columns], self.observed[:rows, columns],
+                            lengths, self.start_days[columns], self.season_length)
+
+
+@register_forecast_model('linear')
+def linear_trend_model(series, horizon):
+    """Least-squares linear trend over each product's active days, days without records counting as zero."""
+    sums = linear_trend_sums(series.values, ~np.isnan(series.values))
+    intercept, slope = solve_linear_trends(sums)
+    params = {'intercept': intercept, 'slope': slope, **sums}
+    return project_linear_trend(params, series.lengths, horizon), params
+
+
+@register_forecast_error_std('linear')
+def linear_trend_error_std(params, lengths, horizon):
+    """Regression prediction interval: residual variance widened by the distance from the mean day."""
+    n, sum_t = params['n'], params['sum_t']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        residual_ss = params['sum_yy'] - params['intercept'] * params['sum_y'] - params['slope'] * params['sum_ty']
+        variance = np.where(n > 2, np.maximum(residual_ss, 0.0) / (n - 2), 0.0)
+        mean_t = np.where(n > 0, sum_t / n, 0.0)
+        spread_t = params['sum_tt'] - n * mean_t ** 2
+        future_t = (lengths - 1)[:, None] + np.arange(1, horizon + 1)[None, :]
+        leverage = np.where(spread_t[:, None] > 0, (future_t - mean_t[:, None]) ** 2 / spread_t[:, None], 0.0)
+        return np.sqrt(variance[:, None] * (1 + np.where(n > 0, 1 / n, 0.0)[:, None] + leverage))
+
+
+@register_forecast_update('linear')
+def update_linear_trend(params, segment, offsets):
+    """Recursive least squares: add the new days to the normal-equation sums and re-solve."""
+    sums = linear_trend_sums(segment.values, ~np.isnan(segment.values), offsets)
+    totals = {key: params[key] + sums[key] for key in sums}
+    intercept, slope = solve_linear_trends(totals)
+    return {'intercept': intercept, 'slope': slope, **totals}
+
+
+@register_forecast_projection('linear')
+def project_linear_trend(params, lengths, horizon):
+    """Extend the fitted trend line past each product's last day."""
+    future_t = (lengths - 1)[:, None] + np.arange(1, horizon + 1)[None, :]
+    return params['intercept'][:, None] + params['slope'][:, None] * future_t
+
+
+def exponential_smoothing(series, horizon, trend=False, seasonal=False):
+    """
+    Additive simple/double/triple exponential smoothing for all products at once.
+
+    Every combination of the SMOOTHING_GRID parameters is run side by side
+    (grid x products state arrays) and each product keeps the combination
+    with the lowest in-sample one-step squared error. Seasonal slots are kept
+    relative to each product's first day: season[k] applies to days
+    start_days + k (mod season_length).
+    """
+    y = series.values
+    num_rows, num_products = y.shape
+    columns = np.arange(num_products)
+    m = series.season_length
+
+    grid = np.array(np.meshgrid(
+        SMOOTHING_GRID['alpha'],
+        SMOOTHING_GRID['beta'] if trend else (0.0,),
+        SMOOTHING_GRID['gamma'] if seasonal else (0.0,),
+        indexing='ij')).reshape(3, -1)
+    alpha, beta, gamma = (g[:, None] for g in grid)
+    num_grid = grid.shape[1]
+
+    with np.errstate(invalid='ignore'):
+        if seasonal:
+            first_season = np.nanmean(y[:m], axis=0) if num_rows else np.zeros(num_products)
+            level = np.tile(np.nan_to_num(first_season), (num_grid, 1))
+            season = np.zeros((num_grid, num_products, m))
+            for i in range(min(m, num_rows)):
+                season[:, :, i] = np.nan_to_num(np.where(i < series.lengths, y[i] - first_season, 0.0))
+            start = min(m, num_rows)
+        else:
+            level = np.tile(np.nan_to_num(y[0]) if num_rows else np.zeros(num_products), (num_grid, 1))
+            season = None
+            start = 1
+    slope = np.zeros((num_grid, num_products))
+    sse = np.zeros((num_grid, num_products))
+
+    for t in range(start, num_rows):
+        active = t < series.lengths
+        season_t = season[:, :, t % m] if seasonal else 0.0
+        level, slope, season_t, sse = smoothing_step(
+            np.nan_to_num(y[t]), active, level, slope, season_t, sse, alpha, beta, gamma, trend, seasonal)
+        if seasonal:
+            season[:, :, t % m] = season_t
+
+    best = np.argmin(sse, axis=0)
+    params = {'alpha': grid[0, best], 'beta': grid[1, best], 'gamma': grid[2, best],
+              'level': level[best, columns], 'trend': slope[best, columns], 'sse': sse[best, columns],
+              'n_errors': np.maximum(series.lengths - start, 0).astype(float)}
+    if seasonal:
+        params['season'] = season[best, columns]
+    return project_smoothing_state(params, series.lengths, horizon), params
+
+
+def smoothing_step(y_t, active, level, slope, season_t, sse, alpha, beta, gamma, trend, seasonal):
+    """One day of the additive smoothing recursion; inactive columns keep their state."""
+    error = y_t - (level + slope + season_t)
+    sse = sse + np.where(active, error * error, 0.0)
+    new_level = alpha * (y_t - season_t) + (1 - alpha) * (level + slope)
+    if trend:
+        slope = np.where(active, beta * (new_level - level) + (1 - beta) * slope, slope)
+    if seasonal:
+        season_t = np.where(active, gamma * (y_t - new_level) + (1 - gamma) * season_t, season_t)
+    level = np.where(active, new_level, level)
+    return level, slope, season_t, sse
+
+
+@register_forecast_update('ses', 'holt', 'holt_winters')
+def update_smoothing_state(params, segment, offsets):
+    """Continue the smoothing recursion over the new days with the fitted alpha, beta and gamma."""
+    params = {key: np.array(value, dtype=float) for key, value in params.items()}
+    level, slope, sse = params['level'], params['trend'], params['sse']
+    season = params.get('season')
+    seasonal = season is not None
+    rows = np.arange(len(offsets))
+    for t in range(segment.values.shape[0]):
+        slot = (offsets + t) % season.shape[1] if seasonal else None
+        season_t = season[rows, slot] if seasonal else 0.0
+        level, slope, season_t, sse = smoothing_step(
+            np.nan_to_num(segment.values[t]), t < segment.lengths, level, slope, season_t, sse,
+            params['alpha'], params['beta'], params['gamma'], True, seasonal)
+        if seasonal:
+            season[rows, slot] = season_t
+    params.update({'level': level, 'trend': slope, 'sse': sse, 'n_errors': params['n_errors'] + segment.lengths})
+    return params
+
+
+@register_forecast_error_std('ses', 'holt', 'holt_winters')
+def smoothing_error_std(params, lengths, horizon):
+    """
+    Analytic h-step error of additive smoothing: sigma^2 * (1 + sum of c_j^2)
+    with c_j = alpha * (1 + j * beta), plus gamma * (1 - alpha) on full seasons.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = np.where(params['n_errors'] > 0, params['sse'] / params['n_errors'], 0.0)
+    j = np.arange(1, horizon)[None, :]
+    c = params['alpha'][:, None] * (1 + j * params['beta'][:, None])
+    if 'season' in params:
+        c = c + params['gamma'][:, None] * (1 - params['alpha'][:, None]) * (j % params['season'].shape[1] == 0)
+    widening = np.concatenate([np.zeros((len(lengths), 1)), np.cumsum(c * c, axis=1)], axis=1)
+    return np.sqrt(variance[:, None] * (1 + widening))
+
+
+@register_forecast_projection('ses', 'holt', 'holt_winters')
+def project_smoothing_state(params, lengths, horizon):
+    """Forecast from the final smoothing level, trend and (if fitted) season."""
+    steps = np.arange(1, horizon + 1)
+    forecasts = params['level'][:, None] + params['trend'][:, None] * steps[None, :]
+    if 'season' in params:
+        season = params['season']
+        rows = np.arange(len(lengths))[:, None]
+        forecasts = forecasts + season[rows, ((lengths - 1)[:, None] + steps[None, :]) % season.shape[1]]
+    return forecasts
+
+
+@register_forecast_model('ses')
+def simple_exponential_smoothing(series, horizon):
+    """Simple exponential smoothing: a flat forecast at the smoothed level."""
+    return exponential_smoothing(series, horizon)
+
+
+@register_forecast_model('holt')
+def double_exponential_smoothing(series, horizon):
+    """Holt's linear method: smoothed level and trend."""
+    return exponential_smoothing(series, horizon, trend=True)
+
+
+@register_forecast_model('holt_winters')
+def triple_exponential_smoothing(series, horizon):
+    """Additive Holt-Winters: level, trend and a season of series.season_length days."""
+    return exponential_smoothing(series, horizon, trend=True, seasonal=True)
+
+
+@register_forecast_model('croston')
+def croston_model(series, horizon):
+    """
+    Croston's method for intermittent demand: smooths non-zero demand sizes and
+    the intervals between them separately; forecasts size / interval.
+    """
+    y = np.nan_to_num(series.values)
+    num_rows, num_products = y.shape
+    columns = np.arange(num_products)
+    alpha = np.array(SMOOTHING_GRID['alpha'])[:, None]
+    num_grid = alpha.shape[0]
+
+    size = np.zeros((num_grid, num_products))
+    interval = np.ones((num_grid, num_products))
+    since_demand = np.ones((num_grid, num_products))
+    seen = np.zeros(num_products, dtype=bool)
+    sse = np.zeros((num_grid, num_products))
+    n_errors = np.zeros(num_products)
+
+    for t in range(num_rows):
+        active = t < series.lengths
+        n_errors += active & seen
+        size, interval, since_demand, seen, sse = croston_step(
+            y[t], active, size, interval, since_demand, seen, sse, alpha)
+
+    best = np.argmin(sse, axis=0)
+    params = {'alpha': alpha[best, 0], 'size': np.where(seen, size[best, columns], 0.0),
+              'interval': interval[best, columns], 'since_demand': since_demand[best, columns],
+              'sse': sse[best, columns], 'n_errors': n_errors}
+    return project_croston_rate(params, None, horizon), params
+
+
+def croston_step(y_t, active, size, interval, since_demand, seen, sse, alpha):
+    """One day of Croston's recursion; inactive columns keep their state."""
+    demand = active & (y_t > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        error = y_t - np.where(seen, size / interval, 0.0)
+    sse = sse + np.where(active & seen, error * error, 0.0)
+
+    first = demand & ~seen
+    size = np.where(first, y_t, np.where(demand, alpha * y_t + (1 - alpha) * size, size))
+    interval = np.where(first, since_demand,
+                        np.where(demand, alpha * since_demand + (1 - alpha) * interval, interval))
+    since_demand = np.where(demand, 1, np.where(active, since_demand + 1, since_demand))
+    return size, interval, since_demand, seen | demand, sse
+
+
+@register_forecast_update('croston')
+def update_croston_state(params, segment, offsets):
+    """Continue Croston's recursion over the new days with the fitted alpha."""
+    params = {key: np.array(value, dtype=float) for key, value in params.items()}
+    size, interval, since_demand, sse = params['size'], params['interval'], params['since_demand'], params['sse']
+    seen = size > 0
+    n_errors = params['n_errors']
+    y = np.nan_to_num(segment.values)
+    for t in range(y.shape[0]):
+        active = t < segment.lengths
+        n_errors = n_errors + (active & seen)
+        size, interval, since_demand, seen, sse = croston_step(
+            y[t], active, size, interval, since_demand, seen, sse, params['alpha'])
+    params.update({'size': np.where(seen, size, 0.0), 'interval': interval,
+                   'since_demand': since_demand, 'sse': sse, 'n_errors': n_errors})
+    return params
+
+
+@register_forecast_error_std('croston')
+def croston_error_std(params, lengths, horizon):
+    """SES-style approximation: one-step error of the demand rate widened by alpha^2 per step."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = np.where(params['n_errors'] > 0, params['sse'] / params['n_errors'], 0.0)
+    steps = np.arange(horizon)[None, :]
+    return np.sqrt(variance[:, None] * (1 + steps * params['alpha'][:, None] ** 2))
+
+
+@register_forecast_projection('croston')
+def project_croston_rate(params, lengths, horizon):
+    """Flat forecast at the smoothed demand size per interval."""
+    rate = params['size'] / params['interval']
+    return np.repeat(rate[:, None], horizon, axis=1)
+
+
+AUTO_FORECAST_MODEL = 'auto'
+
+
+def backtest_models(series, horizon, candidates=None, folds=None):
+    """
+    Rolling-origin backtest of candidate models for every product of a series.
+
+    For fold k the last k * horizon days of each product are held out, the
+    model is fit on the rest and scored on the next horizon days. Returns
+    {model: {'wape', 'mape', 'bias', 'folds'}} with one array entry per
+    product; products too short for a fold are scored on the remaining folds
+    (folds == 0 means no score).
+    """
+    candidates = candidates or list(FORECAST_MODELS)
+    folds = folds or BACKTEST_CONFIG['folds']
+    num_products = len(series.lengths)
+    min_train = max(MIN_HISTORY_POINTS, series.season_length)
+    t = np.arange(series.values.shape[0])[:, None]
+
+    totals = {name: {key: np.zeros(num_products) for key in ('abs_error', 'error', 'actual', 'ape', 'ape_count', 'folds')}
+              for name in candidates}
+    for k in range(1, folds + 1):
+        train_lengths = series.lengths - k * horizon
+        valid = train_lengths >= min_train
+        if not valid.any():
+            break
+        columns = np.flatnonzero(valid)
+        train_lengths = train_lengths[columns]
+        in_train = t < train_lengths[None, :]
+        train = DemandSeries(np.where(in_train, series.values[:, columns], np.nan),
+                             series.observed[:, columns] & in_train,
+                             train_lengths, series.start_days[columns], series.season_length).subset(np.arange(len(columns)))
+        actual = series.values[train_lengths[:, None] + np.arange(horizon)[None, :], columns[:, None]]
+
+        for name in candidates:
+            forecasts, _ = FORECAST_MODELS[name](train, horizon)
+            error = forecasts - actual
+            fold_totals = totals[name]
+            fold_totals['abs_error'][columns] += np.abs(error).sum(axis=1)
+            fold_totals['error'][columns] += error.sum(axis=1)
+            fold_totals['actual'][columns] += np.abs(actual).sum(axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ape = np.where(actual > 0, np.abs(error) / actual, 0.0)
+            fold_totals['ape'][columns] += ape.sum(axis=1)
+            fold_totals['ape_count'][columns] += (actual > 0).sum(axis=1)
+            fold_totals['folds'][columns] += 1
+
+    scores = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for name, fold_totals in totals.items():
+            scored = fold_totals['folds'] > 0
+            scores[name] = {
+                'wape': np.where(scored & (fold_totals['actual'] > 0), fold_totals['abs_error'] / fold_totals['actual'],
+                                 np.where(scored, fold_totals['abs_error'], np.nan)),
+                'mape': np.where(fold_totals['ape_count'] > 0, fold_totals['ape'] / fold_totals['ape_count'], np.nan),
+                'bias': np.where(scored & (fold_totals['actual'] > 0), fold_totals['error'] / fold_totals['actual'], np.nan),
+                'folds': fold_totals['folds'].astype(int)
+            }
+    return scores
+
+
+def _backtest_chunk(values, observed, lengths, start_days, season_length, horizon, candidates, folds):
+    """Process-pool entry point: backtest one slice of the catalog."""
+    series = DemandSeries(values, observed, lengths, start_days, season_length)
+    return backtest_models(series, horizon, candidates, folds)
+
+
+def select_models(series, horizon, candidates=None, folds=None, workers=None):
+    """
+    Pick the best model per product by backtest WAPE.
+
+    Large catalogs are split into column chunks backtested on a process pool.
+    Returns (model_names, scores) where model_names is a per-product array
+    (DEFAULT_FORECAST_MODEL where nothing could be scored) and scores is a
+    per-product list of {model: {'wape', 'mape', 'bias', 'folds'}} dicts.
+    """
+    candidates = candidates or list(FORECAST_MODELS)
+    workers = workers or BACKTEST_CONFIG['workers']
+    num_products = len(series.lengths)
+
+    if workers > 1 and num_products >= BACKTEST_CONFIG['parallel_min_products']:
+        chunks = [c for c in np.array_split(np.arange(num_products), workers * 4) if len(c)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for columns in chunks:
+                chunk = series.subset(columns)
+                futures.append(executor.submit(
+                    _backtest_chunk, chunk.values, chunk.observed, chunk.lengths, chunk.start_days,
+                    chunk.season_length, horizon, candidates, folds))
+            partial = [future.result() for future in futures]
+        scores = {name: {metric: np.concatenate([p[name][metric] for p in partial]) for metric in partial[0][name]}
+                  for name in candidates}
+    else:
+        scores = backtest_models(series, horizon, candidates, folds)
+
+    wape = np.vstack([np.where(np.isnan(scores[name]['wape']), np.inf, scores[name]['wape']) for name in candidates])
+    best = np.argmin(wape, axis=0)
+    model_names = np.array([candidates[i] for i in best], dtype=object)
+    model_names[np.isinf(wape.min(axis=0))] = DEFAULT_FORECAST_MODEL
+
+    def rounded(value):
+        return None if np.isnan(value) else round(float(value), 4)
+
+    product_scores = [
+        {name: {'wape': rounded(scores[name]['wape'][p]), 'mape': rounded(scores[name]['mape'][p]),
+                'bias': rounded(scores[name]['bias'][p]), 'folds': int(scores[name]['folds'][p])}
+         for name in candidates}
+        for p in range(num_products)
+    ]
+    return model_names, product_scores
+
+
+def series_fingerprints(series):
+    """Per-product tuple that changes whenever a product's daily series changes."""
+    totals = np.nansum(series.values, axis=0)
+    observed_days = series.observed.sum(axis=0)
+    weighted = np.nansum(series.values * np.arange(1, series.values.shape[0] + 1)[:, None], axis=0)
+    return [(int(start), int(length), int(days), round(float(total), 6), round(float(w), 6))
+            for start, length, days, total, w in zip(series.start_days, series.lengths, observed_days, totals, weighted)]
+
+
+def split_params(params):
+    """Per-product list of parameter dicts from a model's dict of per-product arrays."""
+    num_products = len(next(iter(params.values()))) if params else 0
+    return [{key: values[p] for key, values in params.items()} for p in range(num_products)]
+
+
+def stack_params(product_params):
+    """Inverse of split_params."""
+    return {key: np.array([params[key] for params in product_params]) for key in product_params[0]}
+
+
+def update_fitted_params(name, product_params, segment, offsets):
+    """Fold a segment of new days into a per-product list of fitted params of model name."""
+    return split_params(FORECAST_UPDATES[name](stack_params(product_params), segment, np.asarray(offsets)))
+
+
+def predict_demand(series, horizon, model=DEFAULT_FORECAST_MODEL, product_models=None, product_ids=None,
+                   fitted_params=None):
+    """
+    Forecast every product of a DemandSeries, grouping products by model.
+
+    product_models optionally maps product ids (matched against product_ids)
+    to model names overriding model. fitted_params, when given, is a
+    per-product list of {'model', 'params'} entries: products whose entry
+    matches their model are projected from it without refitting, the other
+    entries are filled in with the newly fitted parameters. Returns
+    (forecasts, model_names, error_std), error_std being the standard
+    deviation of the forecast error at every step.
+    """
+    num_products = len(series.lengths)
+    model_names = np.array([model] * num_products, dtype=object)
+    if product_models:
+        for p, product_id in enumerate(product_ids):
+            model_names[p] = product_models.get(product_id, model)
+
+    forecasts = np.zeros((num_products, horizon))
+    error_std = np.zeros((num_products, horizon))
+    for name in set(model_names):
+        if name not in FORECAST_MODELS:
+            raise ValueError(f"Unknown forecast model: {name}. Available: {', '.join(sorted(FORECAST_MODELS))}")
+        columns = np.flatnonzero(model_names == name)
+        if fitted_params is not None:
+            is_fitted = np.array([fitted_params[p] is not None and fitted_params[p]['model'] == name for p in columns],
+                                 dtype=bool)
+            fitted, columns = columns[is_fitted], columns[~is_fitted]
+            if len(fitted):
+                params = stack_params([fitted_params[p]['params'] for p in fitted])
+                forecasts[fitted] = FORECAST_PROJECTIONS[name](params, series.lengths[fitted], horizon)
+                error_std[fitted] = FORECAST_ERROR_STDS[name](params, series.lengths[fitted], horizon)
+        if len(columns):
+            forecasts[columns], params = FORECAST_MODELS[name](series.subset(columns), horizon)
+            error_std[columns] = FORECAST_ERROR_STDS[name](params, series.lengths[columns], horizon)
+            if fitted_params is not None:
+                for p, product_params in zip(columns, split_params(params)):
+                    fitted_params[p] = {'model': name, 'params': product_params}
+    return forecasts, model_names, error_std
+
+
+def forecast_quantiles(forecasts, error_std, quantiles=DEFAULT_QUANTILES):
+    """
+    Normal prediction quantiles around point forecasts, floored at zero demand.
+
+    Returns {label: array shaped like forecasts} with labels such as 'p10'.
+    """
+    return {quantile_label(q): np.maximum(forecasts + NormalDist().inv_cdf(q) * error_std, 0.0)
+            for q in quantiles}
+
+
+def quantile_label(quantile):
+    """Response key of a quantile, e.g. 0.1 -> 'p10'."""
+    return f"p{quantile * 100:g}"
+
+
+def classify_trend(percent_change):
+    """Direction and strength labels for a forecast-vs-history percent change."""
+    if abs(percent_change) < 5:
+        return {'direction': 'stable', 'strength': 'low'}
+    return {
+        'direction': 'increasing' if percent_change > 0 else 'decreasing',
+        'strength': 'high' if abs(percent_change) > 15 else 'medium'
+    }
+
+
+def forecast_products(records, forecast_horizon, min_points=MIN_HISTORY_POINTS, **model_options):
+    """Forecast daily demand for every product in a list of records (see forecast_demand_matrix)."""
+    return forecast_demand_matrix(build_demand_matrix(records), forecast_horizon, min_points, **model_options)
+
+
+def forecast_demand_matrix(matrix, forecast_horizon, min_points=MIN_HISTORY_POINTS, model=DEFAULT_FORECAST_MODEL,
+                           product_models=None, season_length=DEFAULT_SEASON_LENGTH, model_scores=None,
+                           fitted_params=None, quantiles=DEFAULT_QUANTILES):
+    """
+    Forecast daily demand for every product of a demand matrix in one vectorized pass.
+
+    Forecasts cover forecast_horizon days after each product's last observed
+    day, using model (a FORECAST_MODELS name) or the per-product override in
+    product_models. Returns a list of per-product dicts with name, product_id,
+    location, model, historical_data, forecast, summary and trend, plus the
+    product's backtest scores when model_scores (product id -> scores) is given.
+    fitted_params is passed on to predict_demand to reuse earlier fits. Every
+    forecast point also carries the requested quantiles (p10, p50, ...) and
+    the summary the one-step forecast error std, computed in the same pass.
+    """
+    if matrix is None:
+        logger.warning("No usable records for forecasting")
+        return []
+    first_day, demand, observed, product_ids, product_info = matrix
+    forecast_horizon = int(forecast_horizon)
+
+    counts = observed.sum(axis=0)
+    num_days = demand.shape[0]
+
+    # Last observed day of each product; forecasts start the day after
+    last_day = num_days - 1 - np.argmax(observed[::-1], axis=0)
+    steps = np.arange(1, forecast_horizon + 1)
+    series = DemandSeries.from_matrix(first_day, demand, observed, season_length)
+    forecasts, model_names, error_std = predict_demand(series, forecast_horizon, model, product_models,
+                                                       product_ids, fitted_params)
+    bands = forecast_quantiles(forecasts, error_std, quantiles)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Average daily demand over each product's active span, gaps counting as zero like in the models
+        historical_avg = np.where(counts > 0, demand.sum(axis=0) / series.lengths, 0.0)
+        forecast_avg = forecasts.mean(axis=1) if forecast_horizon > 0 else np.zeros(len(product_ids))
+        percent_change = np.where(historical_avg > 0, (forecast_avg - historical_avg) / historical_avg * 100, 0.0)
+
+    # Date labels for every day of history and horizon, formatted once
+    labels = epoch_day_labels(np.arange(first_day, first_day + num_days + forecast_horizon))
+
+    results = []
+    for p, product_id in enumerate(product_ids):
+        if counts[p] < min_points:
+            logger.warning(f"Insufficient historical data for product {product_id}")
+            continue
+        observed_days = np.flatnonzero(observed[:, p])
+        results.append({
+            'name': product_info[product_id]['name'],
+            'product_id': product_id,
+            'location': product_info[product_id]['location'],
+            'model': model_names[p],
+            'historical_data': [{'date': labels[d], 'quantity': float(demand[d, p])} for d in observed_days],
+            'forecast': [dict({'date': labels[last_day[p] + k], 'quantity': float(forecasts[p, k - 1])},
+                              **{label: float(band[p, k - 1]) for label, band in bands.items()}) for k in steps],
+            'summary': {
+                'avg_historical': round(float(historical_avg[p]), 2),
+                'avg_forecast': round(float(forecast_avg[p]), 2),
+                'percent_change': round(float(percent_change[p]), 2),
+                'error_std': round(float(error_std[p, 0]), 4) if forecast_horizon > 0 else 0.0
+            },
+            'trend': classify_trend(percent_change[p])
+        })
+        if model_scores and product_id in model_scores:
+            results[-1]['backtest'] = model_scores[product_id]
+    return results
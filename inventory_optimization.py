@@ -0,0 +1,226 @@
+import logging
+import os
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from forecasting import DemandSeries, FORECAST_MODELS, FORECAST_ERROR_STDS, DEFAULT_FORECAST_MODEL, MIN_HISTORY_POINTS
+
+logger = logging.getLogger(__name__)
+
+# Wildcard product_id/location in inventory item settings: the row applies
+# to every product and/or location without a more specific row
+ANY = '*'
+
+# Fallback cost and service parameters for items without settings; a
+# lead_time_days of None means "use the request's forecast horizon"
+DEFAULT_ITEM_SETTINGS = {
+    'unit_cost': float(os.getenv('INVENTORY_DEFAULT_UNIT_COST', 1.0)),
+    'holding_cost_rate': float(os.getenv('INVENTORY_DEFAULT_HOLDING_COST_RATE', 0.2)),
+    'ordering_cost': float(os.getenv('INVENTORY_DEFAULT_ORDERING_COST', 100)),
+    'service_level': float(os.getenv('INVENTORY_DEFAULT_SERVICE_LEVEL', 0.975)),
+    'lead_time_days': None
+}
+
+ITEM_SETTING_FIELDS = tuple(DEFAULT_ITEM_SETTINGS)
+
+DAYS_PER_YEAR = 365
+
+
+def demand_statistics(daily_totals, last_day=None):
+    """
+    Mean and standard deviation of daily demand per (product, location).
+
+    daily_totals is a frame with product, location, day and quantity columns
+    (see DailyDemandAggregator.daily_totals). Days without records between a
+    pair's first day and last_day (default: the latest day overall) count as
+    zero demand, so intermittent items are not overstated. One groupby pass
+    over all pairs; returns a frame with product, location, days, mean and std.
+    """
+    frame = daily_totals[['product', 'location', 'day', 'quantity']].copy()
+    frame['quantity'] = frame['quantity'].astype(float)
+    frame['squared'] = frame['quantity'] ** 2
+    stats = frame.groupby(['product', 'location'], sort=False).agg(
+        total=('quantity', 'sum'),
+        total_squared=('squared', 'sum'),
+        first_day=('day', 'min')
+    ).reset_index()
+
+    last_day = frame['day'].max() if last_day is None else last_day
+    days = np.maximum(last_day - stats['first_day'].to_numpy(dtype=float) + 1, 1)
+    mean = stats['total'].to_numpy() / days
+    variance = np.maximum(stats['total_squared'].to_numpy() / days - mean ** 2, 0.0)
+    return pd.DataFrame({
+        'product': stats['product'],
+        'location': stats['location'],
+        'days': days.astype(np.int64),
+        'mean': mean,
+        'std': np.sqrt(variance)
+    })
+
+
+def lead_time_error_std(daily_totals, pairs, lead_time, model=DEFAULT_FORECAST_MODEL):
+    """
+    Standard deviation of the forecast error of demand over each pair's lead time.
+
+    Fits model to the daily series of every (product, location) pair in
+    pairs (e.g. the demand_statistics frame) in one vectorized pass and sums
+    its per-step error variances (see FORECAST_ERROR_STDS) over the lead
+    time, a fractional last day counting pro rata; step errors are treated
+    as independent. Pairs with fewer than MIN_HISTORY_POINTS days of demand
+    get NaN.
+    """
+    keys = pd.MultiIndex.from_arrays([pairs['product'], pairs['location']])
+    columns = keys.get_indexer(pd.MultiIndex.from_arrays([daily_totals['product'], daily_totals['location']]))
+    days = daily_totals['day'].to_numpy(dtype=np.int64)
+    start_days = np.full(len(keys), np.iinfo(np.int64).max)
+    np.minimum.at(start_days, columns, days)
+
+    series = DemandSeries.from_points(columns, days - start_days[columns],
+                                      daily_totals['quantity'].to_numpy(dtype=float),
+                                      np.ones(len(days), dtype=bool), len(keys), start_days)
+    horizon = max(int(np.ceil(np.max(lead_time))), 1)
+    _, params = FORECAST_MODELS[model](series, horizon)
+    step_variance = FORECAST_ERROR_STDS[model](params, series.lengths, horizon) ** 2
+    weights = np.clip(np.asarray(lead_time, dtype=float)[:, None] - np.arange(horizon)[None, :], 0.0, 1.0)
+    error_std = np.sqrt((step_variance * weights).sum(axis=1))
+    return np.where(np.bincount(columns, minlength=len(keys)) >= MIN_HISTORY_POINTS, error_std, np.nan)
+
+
+def resolve_item_settings(pairs, settings_rows, defaults=None):
+    """
+    Cost and service settings for every (product, location) pair.
+
+    settings_rows are dicts with product_id, location and any of
+    ITEM_SETTING_FIELDS, where product_id and location may be ANY. Missing
+    or NULL fields fall through, most specific first:
+    (product, location) > (product, *) > (*, location) > (*, *) > defaults.
+    Returns a frame aligned with pairs, one column per setting.
+    """
+    defaults = {**DEFAULT_ITEM_SETTINGS, **(defaults or {})}
+    keys = pd.DataFrame({'product': pairs['product'].astype(str).to_numpy(),
+                         'location': pairs['location'].astype(str).to_numpy()})
+    resolved = pd.DataFrame(np.nan, index=keys.index, columns=list(ITEM_SETTING_FIELDS))
+
+    settings = pd.DataFrame(list(settings_rows or []), columns=['product_id', 'location', *ITEM_SETTING_FIELDS])
+    if not settings.empty:
+        settings = settings.rename(columns={'product_id': 'product'})
+        settings[['product', 'location']] = settings[['product', 'location']].astype(str)
+        settings[list(ITEM_SETTING_FIELDS)] = settings[list(ITEM_SETTING_FIELDS)].apply(pd.to_numeric, errors='coerce')
+        any_product = settings['product'] == ANY
+        any_location = settings['location'] == ANY
+        levels = (
+            (~any_product & ~any_location, ['product', 'location']),
+            (~any_product & any_location, ['product']),
+            (any_product & ~any_location, ['location']),
+        )
+        for mask, on in levels:
+            level = settings.loc[mask, [*on, *ITEM_SETTING_FIELDS]].drop_duplicates(on, keep='last')
+            if not level.empty:
+                matched = keys[on].merge(level, how='left', on=on)[list(ITEM_SETTING_FIELDS)]
+                resolved = resolved.combine_first(matched.set_index(keys.index))
+        catch_all = settings.loc[any_product & any_location, list(ITEM_SETTING_FIELDS)]
+        if not catch_all.empty:
+            resolved = resolved.fillna(catch_all.iloc[-1])
+
+    for field, value in defaults.items():
+        if value is not None:
+            resolved[field] = resolved[field].fillna(value)
+    return resolved[list(ITEM_SETTING_FIELDS)]
+
+
+def service_level_z(service_levels):
+    """Standard normal quantile per service level, computed once per distinct level."""
+    levels = np.asarray(service_levels, dtype=float)
+    codes, uniques = pd.factorize(levels)
+    normal = NormalDist()
+    z = np.array([normal.inv_cdf(level) for level in uniques], dtype=float)
+    return z[codes]
+
+
+def optimize_inventory_policies(daily_totals, product_info, lead_time_days, settings_rows=None,
+                                forecast_model=DEFAULT_FORECAST_MODEL):
+    """
+    Safety stock, reorder point and EOQ for every (product, location) pair at once.
+
+    daily_totals as for demand_statistics, product_info maps product ids to
+    names; lead_time_days applies to items whose settings leave it unset.
+    With daily demand mean d, lead time L, service level z, lead-time
+    forecast error deviation e (see lead_time_error_std, fit with
+    forecast_model), annual demand D, ordering cost S and holding cost h
+    (rate x unit cost): safety stock = z * e, reorder point = d * L + safety
+    stock and EOQ = sqrt(2 * D * S / h). Pairs with too little history to
+    fit use e = s * sqrt(L) with s the deviation of daily demand. Returns an
+    unrounded frame with one row per pair.
+    """
+    stats = demand_statistics(daily_totals)
+    settings = resolve_item_settings(stats, settings_rows, {'lead_time_days': float(lead_time_days)})
+
+    lead_time = settings['lead_time_days'].to_numpy(dtype=float)
+    service_level = settings['service_level'].to_numpy(dtype=float)
+    holding_cost = settings['holding_cost_rate'].to_numpy(dtype=float) * settings['unit_cost'].to_numpy(dtype=float)
+    ordering_cost = settings['ordering_cost'].to_numpy(dtype=float)
+    mean, std = stats['mean'].to_numpy(), stats['std'].to_numpy()
+
+    error_std = lead_time_error_std(daily_totals, stats, lead_time, forecast_model)
+    error_std = np.where(np.isfinite(error_std), error_std, std * np.sqrt(lead_time))
+    safety_stock = service_level_z(service_level) * error_std
+    reorder_point = mean * lead_time + safety_stock
+    annual_demand = mean * DAYS_PER_YEAR
+    with np.errstate(divide='ignore', invalid='ignore'):
+        eoq = np.where(holding_cost > 0, np.sqrt(2 * annual_demand * ordering_cost / holding_cost), np.nan)
+
+    names = stats['product'].map(lambda product: (product_info.get(product) or {}).get('name'))
+    return pd.DataFrame({
+        'product_id': stats['product'],
+        'name': names,
+        'location': stats['location'],
+        'mean_demand': mean,
+        'std_demand': std,
+        'lead_time_error_std': error_std,
+        'annual_demand': annual_demand,
+        'lead_time_days': lead_time,
+        'service_level': service_level,
+        'unit_cost': settings['unit_cost'].to_numpy(dtype=float),
+        'holding_cost_rate': settings['holding_cost_rate'].to_numpy(dtype=float),
+        'ordering_cost': ordering_cost,
+        'safety_stock': safety_stock,
+        'reorder_point': reorder_point,
+        'economic_order_quantity': eoq
+    })
+
+
+def validate_item_settings(items):
+    """
+    Check inventory item settings from a request body.
+
+    Returns (rows, error): rows are dicts with product_id, location and the
+    given ITEM_SETTING_FIELDS (NULL clears a field), error a message or None.
+    """
+    if not isinstance(items, list) or not items:
+        return None, 'items must be a non-empty list'
+    rows = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            return None, f'items[{index}] must be an object'
+        row = {
+            'product_id': str(item.get('product_id', ANY)),
+            'location': str(item.get('location', ANY))
+        }
+        for field in ITEM_SETTING_FIELDS:
+            value = item.get(field)
+            if value is not None:
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    return None, f'items[{index}].{field} must be a number'
+                if not np.isfinite(value) or value < 0:
+                    return None, f'items[{index}].{field} must be a non-negative number'
+                if field == 'service_level' and not 0 < value < 1:
+                    return None, f'items[{index}].service_level must be between 0 and 1'
+                if field in ('unit_cost', 'holding_cost_rate') and value == 0:
+                    return None, f'items[{index}].{field} must be positive'
+            row[field] = value
+        rows.append(row)
+    return rows, None
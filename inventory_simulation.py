@@ -0,0 +1,312 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from inventory_optimization import DAYS_PER_YEAR
+
+logger = logging.getLogger(__name__)
+
+# Size limits and parallelism of the Monte Carlo policy simulator
+SIMULATION_CONFIG = {
+    'paths': int(os.getenv('INVENTORY_SIMULATION_PATHS', 500)),
+    'max_paths': int(os.getenv('INVENTORY_SIMULATION_MAX_PATHS', 5000)),
+    'horizon_days': int(os.getenv('INVENTORY_SIMULATION_HORIZON_DAYS', 90)),
+    'max_horizon_days': int(os.getenv('INVENTORY_SIMULATION_MAX_HORIZON_DAYS', 365)),
+    'workers': int(os.getenv('INVENTORY_SIMULATION_WORKERS', os.cpu_count() or 1)),
+    # Catalogs smaller than this are simulated in-process
+    'parallel_min_items': int(os.getenv('INVENTORY_SIMULATION_PARALLEL_MIN_ITEMS', 2000)),
+    # Rough upper bound on simulated array cells (items x candidates x paths x working arrays) per chunk
+    'chunk_cells': int(os.getenv('INVENTORY_SIMULATION_CHUNK_CELLS', 4000000))
+}
+
+# Reorder policies: 'sS' orders up to S whenever the inventory position falls
+# to s or below; 'RQ' orders multiples of Q until the position is above R
+POLICY_TYPES = ('sS', 'RQ')
+
+# Candidates tried per item when the request names none, as factors of the
+# analytic reorder point and EOQ (see optimize_inventory_policies)
+DEFAULT_POLICY_CANDIDATES = tuple(
+    {'policy': policy, 'reorder_point_factor': factor, 'order_quantity_factor': 1.0}
+    for policy in POLICY_TYPES for factor in (0.75, 1.0, 1.25)
+)
+
+
+def validate_candidates(candidates):
+    """
+    Check policy candidates from a request body.
+
+    Each candidate has a policy in POLICY_TYPES and either factors of the
+    analytic policy (reorder_point_factor, order_quantity_factor, default 1)
+    or absolute reorder_point/order_quantity values. For 'sS' the order
+    quantity is S - s. Returns (candidates, error).
+    """
+    if candidates is None:
+        return list(DEFAULT_POLICY_CANDIDATES), None
+    if not isinstance(candidates, list) or not candidates:
+        return None, 'candidates must be a non-empty list'
+    validated = []
+    for index, candidate in enumerate(candidates):
+        if not isinstance(candidate, dict) or candidate.get('policy') not in POLICY_TYPES:
+            return None, f"candidates[{index}].policy must be one of: {', '.join(POLICY_TYPES)}"
+        checked = {'policy': candidate['policy']}
+        for field, default in (('reorder_point_factor', 1.0), ('order_quantity_factor', 1.0),
+                               ('reorder_point', None), ('order_quantity', None)):
+            value = candidate.get(field, default)
+            if value is not None:
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    return None, f'candidates[{index}].{field} must be a number'
+                if not np.isfinite(value) or value < 0:
+                    return None, f'candidates[{index}].{field} must be a non-negative number'
+            checked[field] = value
+        validated.append(checked)
+    return validated, None
+
+
+def candidate_levels(policies, candidates):
+    """(reorder_points, order_quantities) arrays of shape (items, candidates) for the policies frame."""
+    reorder_point = policies['reorder_point'].to_numpy(dtype=float)
+    order_quantity = np.nan_to_num(policies['economic_order_quantity'].to_numpy(dtype=float))
+    reorder_points = np.column_stack([
+        np.full(len(policies), c['reorder_point']) if c.get('reorder_point') is not None
+        else reorder_point * c['reorder_point_factor']
+        for c in candidates])
+    order_quantities = np.column_stack([
+        np.full(len(policies), c['order_quantity']) if c.get('order_quantity') is not None
+        else order_quantity * c['order_quantity_factor']
+        for c in candidates])
+    return reorder_points, order_quantities
+
+
+def sample_demand(rng, mean, variance, paths):
+    """
+    One day of demand, shape (items, paths), from a gamma distribution with
+    the given per-item mean and variance (constant demand where either is 0).
+    """
+    random = (mean > 0) & (variance > 0)
+    shape = np.where(random, mean ** 2 / np.where(random, variance, 1.0), 1.0)
+    scale = np.where(random, variance / np.where(random, mean, 1.0), 1.0)
+    draws = rng.gamma(shape[:, None], scale[:, None], size=(len(mean), paths))
+    return np.where(random[:, None], draws, mean[:, None])
+
+
+def simulate_chunk(daily_mean, daily_std, lead_days, reorder_points, order_quantities, order_up_to,
+                   holding_cost_per_day, ordering_cost, paths, seed):
+    """
+    Simulate every (item, candidate, path) of a chunk at once, day by day.
+
+    daily_mean is (items, days); lead_days, daily_std and the costs are per
+    item; reorder_points, order_quantities and order_up_to ((candidates,)
+    bool, True for 'sS') describe the candidates. Demand is drawn once per
+    item and path and shared by all candidates, so they are compared on the
+    same demand. Unmet demand is lost; orders are placed at the end of a day
+    and arrive after lead_days more days of demand.
+
+    Paths start in steady state: the inventory position is drawn uniformly
+    on (reorder point, reorder point + order quantity] and the longest lead
+    time plus one day is simulated as warm-up before any metric is counted,
+    so the first reorders and arrivals fall inside the measured days. A
+    replenishment cycle ends with each order arrival; the cycle service
+    level is the share of cycles without a stockout (the share of paths
+    without one for items whose orders never arrive). Returns a dict of
+    (items, candidates) metric arrays averaged over the paths.
+    """
+    rng = np.random.default_rng(seed)
+    num_items, num_days = daily_mean.shape
+    num_candidates = reorder_points.shape[1]
+    variance = daily_std ** 2
+    window = int(lead_days.max()) + 2
+    items = np.arange(num_items)
+
+    reorder = reorder_points[:, :, None]
+    quantity = order_quantities[:, :, None]
+    up_to = order_up_to[None, :, None]
+    has_quantity = quantity > 0
+    safe_quantity = np.where(has_quantity, quantity, 1.0)
+
+    # One start position per item and path, shared by the candidates like the demand
+    start = 1.0 - rng.random((num_items, 1, paths))
+    on_hand = np.broadcast_to(reorder + quantity * start, (num_items, num_candidates, paths)).copy()
+    outstanding = np.zeros_like(on_hand)
+    pipeline = np.zeros((window, num_items, num_candidates, paths))
+    sold = np.zeros_like(on_hand)
+    stockout_days = np.zeros_like(on_hand)
+    stock_days = np.zeros_like(on_hand)
+    orders = np.zeros_like(on_hand)
+    cycles = np.zeros_like(on_hand)
+    short_cycles = np.zeros_like(on_hand)
+    short = np.zeros(on_hand.shape, dtype=bool)
+    total_demand = np.zeros((num_items, paths))
+
+    for day in range(-window + 1, num_days):
+        measured = day >= 0
+        if day == 0:
+            short[:] = False
+        slot = day % window
+        arrived = pipeline[slot] > 0
+        if measured:
+            cycles += arrived
+            short_cycles += arrived & short
+        short &= ~arrived
+        on_hand += pipeline[slot]
+        outstanding -= pipeline[slot]
+        pipeline[slot] = 0
+
+        demand = sample_demand(rng, daily_mean[:, max(day, 0)], variance, paths)
+        filled = np.minimum(on_hand, demand[:, None, :])
+        stocked_out = filled < demand[:, None, :] - 1e-9
+        short |= stocked_out
+        on_hand -= filled
+        if measured:
+            total_demand += demand
+            stockout_days += stocked_out
+            sold += filled
+
+        position = on_hand + outstanding
+        below = position <= reorder
+        order = np.where(
+            up_to,
+            reorder + quantity - position,
+            (np.floor((reorder - position) / safe_quantity) + 1) * quantity)
+        order = np.where(below & has_quantity, order, 0.0)
+        outstanding += order
+        pipeline[(day + lead_days + 1) % window, items] += order
+        if measured:
+            orders += order > 0
+            stock_days += on_hand
+
+    demand_total = total_demand.sum(axis=1)[:, None]
+    cycle_total = cycles.sum(axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fill_rate = np.where(demand_total > 0, sold.sum(axis=2) / demand_total, 1.0)
+        cycle_service_level = np.where(cycle_total > 0, 1 - short_cycles.sum(axis=2) / cycle_total,
+                                       1 - short.mean(axis=2))
+    holding_cost = stock_days.mean(axis=2) * holding_cost_per_day[:, None]
+    ordering_total = orders.mean(axis=2) * ordering_cost[:, None]
+    return {
+        'fill_rate': fill_rate,
+        'cycle_service_level': cycle_service_level,
+        'stockout_days': stockout_days.mean(axis=2),
+        'average_on_hand': stock_days.mean(axis=2) / num_days,
+        'orders': orders.mean(axis=2),
+        'holding_cost': holding_cost,
+        'ordering_cost': ordering_total,
+        'total_cost': holding_cost + ordering_total
+    }
+
+
+def simulate_inventory_policies(policies, candidates=None, daily_means=None, horizon_days=None, paths=None,
+                                seed=None, workers=None):
+    """
+    Monte Carlo comparison of reorder policy candidates for every item.
+
+    policies is the frame returned by optimize_inventory_policies; each item
+    gets every candidate (see validate_candidates) built from its analytic
+    reorder point and EOQ. Daily demand is gamma distributed with the item's
+    historical std around daily_means ((items, horizon_days), e.g. a demand
+    forecast) or, by default, its historical mean. Items are simulated in
+    chunks, on a process pool for large catalogs; results only depend on the
+    seed, not on the number of workers.
+
+    Returns (metrics, best, candidates): metrics maps metric names to
+    (items, candidates) arrays, best is the per-item index of the cheapest
+    candidate whose cycle service level meets the item's service level (the
+    one the analytic safety stock targets; the highest where none does).
+    Fill rate is reported alongside but not used for the choice.
+    """
+    candidates = list(candidates or DEFAULT_POLICY_CANDIDATES)
+    horizon_days = horizon_days or SIMULATION_CONFIG['horizon_days']
+    paths = paths or SIMULATION_CONFIG['paths']
+    workers = workers or SIMULATION_CONFIG['workers']
+    num_items = len(policies)
+
+    mean = policies['mean_demand'].to_numpy(dtype=float)
+    if daily_means is None:
+        daily_means = np.repeat(mean[:, None], horizon_days, axis=1)
+    daily_means = np.nan_to_num(np.asarray(daily_means, dtype=float))
+    std = np.nan_to_num(policies['std_demand'].to_numpy(dtype=float))
+    lead_days = np.maximum(np.ceil(policies['lead_time_days'].to_numpy(dtype=float)), 1).astype(np.int64)
+    holding_cost_per_day = (policies['holding_cost_rate'].to_numpy(dtype=float)
+                            * policies['unit_cost'].to_numpy(dtype=float) / DAYS_PER_YEAR)
+    ordering_cost = policies['ordering_cost'].to_numpy(dtype=float)
+    reorder_points, order_quantities = candidate_levels(policies, candidates)
+    order_up_to = np.array([c['policy'] == 'sS' for c in candidates], dtype=bool)
+
+    # Chunks depend only on the data and configuration, so each gets a fixed seed
+    cells_per_item = len(candidates) * paths * (int(lead_days.max(initial=1)) + 11)
+    items_per_chunk = max(1, SIMULATION_CONFIG['chunk_cells'] // cells_per_item)
+    chunks = [np.arange(start, min(start + items_per_chunk, num_items))
+              for start in range(0, num_items, items_per_chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+
+    def chunk_args(rows, chunk_seed):
+        return (daily_means[rows], std[rows], lead_days[rows], reorder_points[rows], order_quantities[rows],
+                order_up_to, holding_cost_per_day[rows], ordering_cost[rows], paths, chunk_seed)
+
+    if workers > 1 and len(chunks) > 1 and num_items >= SIMULATION_CONFIG['parallel_min_items']:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(simulate_chunk, *chunk_args(rows, chunk_seed))
+                       for rows, chunk_seed in zip(chunks, seeds)]
+            partial = [future.result() for future in futures]
+    else:
+        partial = [simulate_chunk(*chunk_args(rows, chunk_seed)) for rows, chunk_seed in zip(chunks, seeds)]
+    metrics = {name: np.concatenate([p[name] for p in partial]) for name in partial[0]} if partial else {}
+    logger.info(f"Simulated {num_items} items x {len(candidates)} policies x {paths} paths over {horizon_days} days "
+                f"in {len(chunks)} chunks")
+
+    if not num_items:
+        return metrics, np.zeros(0, dtype=np.int64), candidates
+    service_level = policies['service_level'].to_numpy(dtype=float)[:, None]
+    meets = metrics['cycle_service_level'] >= service_level
+    best = np.where(meets.any(axis=1),
+                    np.argmin(np.where(meets, metrics['total_cost'], np.inf), axis=1),
+                    np.argmax(metrics['cycle_service_level'], axis=1))
+    return metrics, best, candidates
+
+
+def simulation_results(policies, metrics, best, candidates, details=False):
+    """JSON-ready per-item results: the recommended policy and, with details, every candidate."""
+    reorder_points, order_quantities = candidate_levels(policies, candidates)
+
+    def policy_entry(row, index):
+        entry = {
+            'policy': candidates[index]['policy'],
+            'reorder_point': round(float(reorder_points[row, index]), 2),
+            'order_quantity': round(float(order_quantities[row, index]), 2)
+        }
+        if candidates[index]['policy'] == 'sS':
+            entry['order_up_to'] = round(float(reorder_points[row, index] + order_quantities[row, index]), 2)
+        for name, values in metrics.items():
+            entry[name] = round(float(values[row, index]), 4 if name in ('fill_rate', 'cycle_service_level') else 2)
+        return entry
+
+    results = []
+    for row, item in enumerate(policies[['product_id', 'name', 'location', 'mean_demand', 'std_demand',
+                                         'lead_time_days', 'service_level']].itertuples(index=False)):
+        result = {
+            'product_id': item.product_id,
+            'name': item.name,
+            'location': item.location,
+            'mean_demand': round(float(item.mean_demand), 2),
+            'std_demand': round(float(item.std_demand), 2),
+            'lead_time_days': float(item.lead_time_days),
+            'service_level': float(item.service_level),
+            'recommended': policy_entry(row, int(best[row]))
+        }
+        if details:
+            result['candidates'] = [policy_entry(row, index) for index in range(len(candidates))]
+        results.append(result)
+    return results
+
+
+def location_shares(policies):
+    """Each item's share of its product's mean daily demand across locations (equal shares where all are 0)."""
+    mean = policies['mean_demand'].astype(float)
+    totals = mean.groupby(policies['product_id']).transform('sum')
+    counts = mean.groupby(policies['product_id']).transform('size')
+    return pd.Series(np.where(totals > 0, mean / totals.where(totals > 0, 1.0), 1.0 / counts),
+                     index=policies.index).to_numpy()
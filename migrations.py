@@ -0,0 +1,142 @@
+import logging
+
+from mysql.connector import Error
+
+from database import (
+    get_db,
+    DAILY_DEMAND_DDL,
+    DATA_VERSIONS_DDL,
+    FORECAST_STATES_DDL,
+    FORECAST_FITS_DDL,
+    FORECASTS_DDL,
+    FORECAST_LOCATIONS_DDL,
+    INVENTORY_ITEM_SETTINGS_DDL
+)
+
+logger = logging.getLogger(__name__)
+
+# Applied migrations, one row per version
+SCHEMA_MIGRATIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT NOT NULL PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+
+def create_index(table, name, columns):
+    """Migration step adding an index unless it exists; built online so the table stays writable."""
+    def step(cursor):
+        cursor.execute("""
+            SELECT 1 FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+            LIMIT 1
+        """, (table, name))
+        if cursor.fetchone():
+            logger.info(f"Index {name} on {table} already exists")
+            return
+        cursor.execute(f"ALTER TABLE {table} ADD INDEX {name} ({', '.join(columns)}), ALGORITHM=INPLACE, LOCK=NONE")
+        logger.info(f"Created index {name} on {table} ({', '.join(columns)})")
+    step.description = f"index {name} on {table} ({', '.join(columns)})"
+    return step
+
+
+def execute(statement, description):
+    """Migration step running one idempotent SQL statement."""
+    def step(cursor):
+        cursor.execute(statement)
+    step.description = description
+    return step
+
+
+# Schema versions in order: (version, name, steps). Steps must be idempotent:
+# MySQL commits DDL implicitly, so a migration that fails halfway is rerun
+# from its first step. Never edit an applied migration, add a new one.
+MIGRATIONS = [
+    (1, 'rollup and settings tables', [
+        execute(DAILY_DEMAND_DDL, 'table daily_demand'),
+        execute(DATA_VERSIONS_DDL, 'table data_versions'),
+        execute(FORECAST_STATES_DDL, 'table forecast_states'),
+        execute(FORECASTS_DDL, 'table forecasts'),
+        execute(INVENTORY_ITEM_SETTINGS_DDL, 'table inventory_item_settings'),
+    ]),
+    (2, 'indexes for history, integration and login lookups', [
+        # Keyset pages and exports of one source, newest first
+        create_index('historical_data', 'idx_historical_data_user_source_date', ['user_id', 'source', 'date', 'id']),
+        # Keyset pages over all sources
+        create_index('historical_data', 'idx_historical_data_user_date', ['user_id', 'date', 'id']),
+        create_index('integration_settings', 'idx_integration_settings_user_type', ['user_id', 'integration_type']),
+        create_index('register_login', 'idx_register_login_username', ['Username']),
+    ]),
+    (3, 'persisted interactive forecast fits', [
+        execute(FORECAST_FITS_DDL, 'table forecast_fits'),
+    ]),
+    (4, 'location sets of stored forecasts', [
+        execute(FORECAST_LOCATIONS_DDL, 'table forecast_locations'),
+        execute("""
+            INSERT IGNORE INTO forecast_locations (user_id, product_id, location)
+            SELECT DISTINCT d.user_id, d.product_id, d.location
+            FROM daily_demand d
+            JOIN (SELECT DISTINCT user_id, product_id FROM forecasts) f
+                ON f.user_id = d.user_id AND f.product_id = d.product_id
+        """, 'backfill forecast_locations of stored forecasts'),
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def applied_versions(cursor):
+    """Versions recorded in schema_migrations (creating the table if needed)."""
+    cursor.execute(SCHEMA_MIGRATIONS_DDL)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {int(row[0]) for row in cursor.fetchall()}
+
+
+def migration_status():
+    """Every migration as a dict with version, name and applied."""
+    conn = get_db()
+    if not conn:
+        raise Error("Failed to create database connection")
+    cursor = conn.cursor()
+    try:
+        applied = applied_versions(cursor)
+        return [{'version': version, 'name': name, 'applied': version in applied}
+                for version, name, _ in MIGRATIONS]
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def migrate(target=None, dry_run=False):
+    """
+    Apply pending migrations up to target (default: the latest) in version order.
+
+    Each migration is recorded in schema_migrations once all its steps
+    succeeded; the first failure stops the run and is raised. With dry_run
+    nothing is executed. Returns the list of (version, name) applied.
+    """
+    target = LATEST_VERSION if target is None else target
+    conn = get_db()
+    if not conn:
+        raise Error("Failed to create database connection")
+    cursor = conn.cursor()
+    done = []
+    try:
+        applied = applied_versions(cursor)
+        for version, name, steps in MIGRATIONS:
+            if version in applied or version > target:
+                continue
+            logger.info(f"{'Would apply' if dry_run else 'Applying'} migration {version}: {name}")
+            if not dry_run:
+                for step in steps:
+                    logger.info(f"  {step.description}")
+                    step(cursor)
+                cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                conn.commit()
+            done.append((version, name))
+        return done
+    finally:
+        cursor.close()
+        conn.close()
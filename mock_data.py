@@ -0,0 +1,183 @@
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from date_utils import to_epoch_days, epoch_day_labels
+
+# Seed of the demo data shown to tenants without history, so every request
+# (and every worker) sees the same numbers
+MOCK_DATA_SEED = int(os.getenv('MOCK_DATA_SEED', 42))
+
+# Mock products with various patterns and realistic demand profiles
+MOCK_PRODUCTS = [
+    {"id": "P001", "name": "Premium Widgets", "base_quantity": 150, "trend": "increasing", "volatility": 15,
+     "description": "High-end widgets with growing demand"},
+    {"id": "P002", "name": "Standard Components", "base_quantity": 220, "trend": "decreasing", "volatility": 20,
+     "description": "Being phased out for newer models"},
+    {"id": "P003", "name": "Bulk Materials", "base_quantity": 500, "trend": "stable", "volatility": 30,
+     "description": "Consistent demand industrial materials"},
+    {"id": "P004", "name": "Seasonal Items", "base_quantity": 80, "trend": "cyclical", "volatility": 40,
+     "description": "Products with weekly demand patterns"},
+    {"id": "P005", "name": "New Product Line", "base_quantity": 50, "trend": "exponential", "volatility": 25,
+     "description": "Recently launched product with rapid growth"}
+]
+
+# Mock locations with different characteristics
+MOCK_LOCATIONS = [
+    {"id": "L001", "name": "Main Warehouse", "region": "Central"},
+    {"id": "L002", "name": "East Distribution Center", "region": "East"},
+    {"id": "L003", "name": "West Distribution Center", "region": "West"},
+    {"id": "L004", "name": "Retail Storage North", "region": "North"}
+]
+
+# Where each product is stocked: premium products mostly in the main
+# warehouse, seasonal items everywhere, the rest with a fixed weighting
+MOCK_LOCATION_WEIGHTS = {
+    "P001": [0.7, 0.1, 0.1, 0.1],
+    "P005": [0.7, 0.1, 0.1, 0.1],
+    "P004": [0.25, 0.25, 0.25, 0.25]
+}
+DEFAULT_LOCATION_WEIGHTS = [0.4, 0.3, 0.2, 0.1]
+
+# Popular products get 3-6 orders a day, the others 1-3
+POPULAR_PRODUCTS = ("P001", "P003", "P005")
+
+
+def trend_components(trends, day_index, weekday):
+    """Trend factor per (product, day) for the named trend patterns, shape (products, days)."""
+    i = day_index[None, :].astype(float)
+    weekend = (weekday >= 5)[None, :]
+    trends = np.asarray(trends, dtype=object)[:, None]
+    with np.errstate(over='ignore'):
+        exponential = 2 * (np.exp(np.minimum(i / 20, 700)) - 1)
+    return np.select(
+        [trends == 'increasing', trends == 'decreasing', trends == 'cyclical', trends == 'exponential'],
+        [2 * i,                                       # Stronger linear increase
+         -1.5 * i,                                    # Moderate linear decrease
+         np.where(weekend, 20 * np.sin(i / 7 * np.pi) + 15, 15 * np.sin(i / 7 * np.pi)),  # Weekend peaks
+         exponential],                                # Controlled exponential growth
+        5 * np.sin(i / 10 * np.pi))                   # Stable: very mild oscillation
+
+
+def generate_demand_frame(products, locations, location_weights, start_day, days, rng, first_index=0):
+    """
+    Draw daily demand of every product for every day at once.
+
+    products are dicts with id, name, base_quantity, trend and volatility;
+    location_weights is a (products, locations) array of probabilities.
+    first_index is the position of start_day in a longer series, so trends
+    continue when a long range is generated in blocks.
+    Returns a frame with one row per (product, day): product_id,
+    product_name, location, day (epoch day), quantity, order_count and the
+    trend, seasonal and random components.
+    """
+    num_products = len(products)
+    day_index = first_index + np.arange(days)
+    epoch_days = start_day + np.arange(days)
+    # 1970-01-01 was a Thursday; weekday 0 is Monday
+    weekday = (epoch_days + 3) % 7
+
+    trend = trend_components([p['trend'] for p in products], day_index, weekday)
+    # 90-day seasonal cycle
+    seasonal = np.broadcast_to(10 * np.sin(day_index / 90 * 2 * np.pi), (num_products, days))
+    # More volatile on Mondays and Fridays
+    volatility = np.array([p['volatility'] for p in products], dtype=float)[:, None] * \
+        np.where(np.isin(weekday, (0, 4)), 1.2, 1.0)[None, :]
+    noise = rng.uniform(-1, 1, size=(num_products, days)) * volatility
+    base = np.array([p['base_quantity'] for p in products], dtype=float)[:, None]
+    quantity = np.maximum(0, np.round(base + trend + seasonal + noise))
+
+    cumulative = np.cumsum(np.asarray(location_weights, dtype=float), axis=1)
+    cumulative /= cumulative[:, -1:]
+    draws = rng.random((num_products, days))
+    location_index = np.minimum((draws[:, :, None] >= cumulative[:, None, :]).sum(axis=2), len(locations) - 1)
+
+    popular = np.isin([p['id'] for p in products], POPULAR_PRODUCTS)[:, None]
+    orders = np.where(popular, rng.integers(3, 7, size=(num_products, days)), rng.integers(1, 4, size=(num_products, days)))
+    orders = np.minimum(orders, quantity).astype(np.int64)
+
+    location_names = np.array([location['name'] for location in locations], dtype=object)
+    return pd.DataFrame({
+        'product_id': np.repeat([p['id'] for p in products], days),
+        'product_name': np.repeat([p['name'] for p in products], days),
+        'location': location_names[location_index.ravel()],
+        'day': np.tile(epoch_days, num_products),
+        'quantity': quantity.ravel(),
+        'order_count': orders.ravel(),
+        'trend_factor': trend.ravel().round(2),
+        'seasonal_factor': seasonal.ravel().round(2),
+        'random_factor': noise.ravel().round(2)
+    })
+
+
+def generate_mock_demand(start_date, end_date, seed=MOCK_DATA_SEED):
+    """Seeded demo demand of the mock catalog between two YYYY-MM-DD dates (see generate_demand_frame)."""
+    start_day, end_day = (int(day) for day in to_epoch_days([start_date, end_date]))
+    weights = [MOCK_LOCATION_WEIGHTS.get(p['id'], DEFAULT_LOCATION_WEIGHTS) for p in MOCK_PRODUCTS]
+    return generate_demand_frame(MOCK_PRODUCTS, MOCK_LOCATIONS, weights, start_day,
+                                 max(end_day - start_day + 1, 0), np.random.default_rng(seed))
+
+
+def mock_daily_totals(frame):
+    """Daily totals rows of a demand frame, as accepted by DailyDemandAggregator.add_daily_totals."""
+    totals = frame[['product_id', 'product_name', 'location', 'day', 'quantity']].copy()
+    totals['day'] = epoch_day_labels(totals['day'].to_numpy())
+    totals['record_count'] = 1
+    return totals
+
+
+def synthetic_catalog(num_products, num_locations, rng):
+    """Random products and locations for load tests, with the demo trend patterns mixed in."""
+    trends = np.array(['increasing', 'decreasing', 'stable', 'cyclical'], dtype=object)
+    products = [
+        {'id': f"SKU{index:07d}", 'name': f"Synthetic Product {index}",
+         'base_quantity': float(base), 'trend': trend, 'volatility': float(volatility)}
+        for index, base, trend, volatility in zip(
+            range(1, num_products + 1),
+            rng.lognormal(3, 1, num_products).round(),
+            trends[rng.integers(0, len(trends), num_products)],
+            rng.uniform(0.1, 0.5, num_products))
+    ]
+    for product in products:
+        product['volatility'] *= product['base_quantity']
+    locations = [
+        {'id': f"L{index:04d}", 'name': f"WH/Stock {index}" if index <= max(1, num_locations // 10)
+         else f"Store {index}", 'region': None}
+        for index in range(1, num_locations + 1)
+    ]
+    weights = rng.dirichlet(np.ones(num_locations), size=num_products)
+    return products, locations, weights
+
+
+def iter_synthetic_movements(num_products, num_locations, start_date, days, seed=MOCK_DATA_SEED,
+                             batch_days=None, batch_records=50000):
+    """
+    Yield batches of synthetic stock movement records for load tests.
+
+    One movement per product and day, at a location drawn from the product's
+    random location mix. Days are generated in blocks of batch_days
+    (default: enough to fill about batch_records records), so memory stays
+    bounded for catalogs of millions of movements. Seeded: the same
+    arguments always produce the same data.
+    """
+    rng = np.random.default_rng(seed)
+    products, locations, weights = synthetic_catalog(num_products, num_locations, rng)
+    start_day = int(to_epoch_days([start_date or datetime.now().strftime('%Y-%m-%d')])[0])
+    batch_days = batch_days or max(1, batch_records // max(num_products, 1))
+    location_types = {location['name']: 'warehouse' if location['name'].startswith('WH/') else 'retailer'
+                      for location in locations}
+    for offset in range(0, days, batch_days):
+        block = min(batch_days, days - offset)
+        frame = generate_demand_frame(products, locations, weights, start_day + offset, block, rng, offset)
+        dates = [f"{date} 00:00:00" for date in epoch_day_labels(frame['day'].to_numpy()).tolist()]
+        yield [
+            {'date': date,
+             'data': {'product_id': product_id, 'product': product_name, 'location': location,
+                      'quantity': quantity, 'type': location_types[location]},
+             'source': 'loadtest'}
+            for date, product_id, product_name, location, quantity in zip(
+                dates, frame['product_id'].tolist(), frame['product_name'].tolist(),
+                frame['location'].tolist(), frame['quantity'].astype(np.int64).tolist())
+        ]
@@ -0,0 +1,337 @@
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from ortools.linear_solver import pywraplp
+
+from inventory_optimization import resolve_item_settings, service_level_z
+
+logger = logging.getLogger(__name__)
+
+# Solver budget and service time grid of the multi-echelon allocation
+MULTI_ECHELON_CONFIG = {
+    'time_limit_seconds': float(os.getenv('MULTI_ECHELON_TIME_LIMIT_SECONDS', 10)),
+    'max_time_limit_seconds': float(os.getenv('MULTI_ECHELON_MAX_TIME_LIMIT_SECONDS', 120)),
+    # Service times a warehouse may quote its retailers, as evenly spaced fractions of its own lead time
+    'service_time_levels': int(os.getenv('MULTI_ECHELON_SERVICE_TIME_LEVELS', 5)),
+    # Cost per unit of capacity overflow, relative to the highest holding cost in the problem
+    'overflow_penalty': float(os.getenv('MULTI_ECHELON_OVERFLOW_PENALTY', 1000))
+}
+
+NODE_TYPES = ('warehouse', 'retailer')
+
+
+def infer_location_type(location):
+    """Node type from a location name, following the Odoo import rule (WH/ locations are warehouses)."""
+    name = str(location).strip().lower()
+    return 'warehouse' if name.startswith('wh/') or 'warehouse' in name else 'retailer'
+
+
+def validate_network(nodes):
+    """
+    Check network nodes from a request body.
+
+    Each node has a location and optionally a type ('warehouse' or
+    'retailer'), a supplier (the warehouse location replenishing a retailer)
+    and a capacity (units of safety stock it can hold across all SKUs).
+    Returns (nodes, error) with nodes keyed by location.
+    """
+    if nodes is None:
+        return {}, None
+    if not isinstance(nodes, list):
+        return None, 'network must be a list of nodes'
+    network = {}
+    for index, node in enumerate(nodes):
+        if not isinstance(node, dict) or not node.get('location'):
+            return None, f'network[{index}] must be an object with a location'
+        location = str(node['location'])
+        node_type = node.get('type') or infer_location_type(location)
+        if node_type not in NODE_TYPES:
+            return None, f"network[{index}].type must be one of: {', '.join(NODE_TYPES)}"
+        capacity = node.get('capacity')
+        if capacity is not None:
+            try:
+                capacity = float(capacity)
+            except (TypeError, ValueError):
+                return None, f'network[{index}].capacity must be a number'
+            if not np.isfinite(capacity) or capacity < 0:
+                return None, f'network[{index}].capacity must be a non-negative number'
+        network[location] = {
+            'type': node_type,
+            'supplier': str(node['supplier']) if node.get('supplier') else None,
+            'capacity': capacity
+        }
+    for location, node in network.items():
+        supplier = node['supplier']
+        if supplier and node['type'] == 'warehouse':
+            return None, f'{location} is a warehouse and cannot have a supplier'
+        if supplier and network.get(supplier, {'type': infer_location_type(supplier)})['type'] != 'warehouse':
+            return None, f'supplier {supplier} of {location} is not a warehouse'
+    return network, None
+
+
+def build_network(locations, network):
+    """
+    Complete a network with every location that has demand.
+
+    Unlisted locations get their type from infer_location_type, and
+    retailers without a supplier are linked to the warehouse when there is
+    exactly one; retailers left without a supplier are planned on their own.
+    """
+    network = {location: dict(node) for location, node in network.items()}
+    for location in locations:
+        network.setdefault(str(location), {'type': infer_location_type(location), 'supplier': None, 'capacity': None})
+    for node in list(network.values()):
+        if node['supplier'] and node['supplier'] not in network:
+            network[node['supplier']] = {'type': 'warehouse', 'supplier': None, 'capacity': None}
+    warehouses = [location for location, node in network.items() if node['type'] == 'warehouse']
+    if len(warehouses) == 1:
+        for node in network.values():
+            if node['type'] == 'retailer' and not node['supplier']:
+                node['supplier'] = warehouses[0]
+    return network
+
+
+def allocate_safety_stock(policies, network, settings_rows=None, lead_time_days=None, time_limit_seconds=None,
+                          service_time_levels=None):
+    """
+    Allocate safety stock across a two-echelon network for every SKU at once.
+
+    policies is the frame returned by optimize_inventory_policies (per SKU and
+    location demand, settings and service levels); network maps locations to
+    {'type', 'supplier', 'capacity'} (see build_network). For each SKU and
+    warehouse the warehouse quotes its retailers a service time S between 0
+    and its own lead time Lw (guaranteed-service model): the warehouse then
+    covers its pooled demand over Lw - S days and each retailer its own over
+    Lr + S days, so safety stock is z * sigma * sqrt(net replenishment time)
+    at every node. The service time with the lowest holding cost is chosen
+    per SKU; when nodes have capacities, all SKUs touching them are solved
+    together as one LP (GLOP, within the time limit) over the service time
+    grid, and capacity excess is allowed at a penalty and reported.
+
+    Returns (items, nodes, summary): items is a frame per SKU and location
+    with the chosen allocation, nodes a list of per-node usage dicts.
+    """
+    started = time.time()
+    time_limit_seconds = time_limit_seconds or MULTI_ECHELON_CONFIG['time_limit_seconds']
+    levels = max(2, int(service_time_levels or MULTI_ECHELON_CONFIG['service_time_levels']))
+
+    items = policies[['product_id', 'name', 'location', 'mean_demand', 'std_demand', 'lead_time_days',
+                      'service_level', 'unit_cost', 'holding_cost_rate']].reset_index(drop=True).copy()
+    items['location'] = items['location'].astype(str)
+    node_type = items['location'].map(lambda location: network[location]['type'])
+    supplier = items['location'].map(lambda location: network[location]['supplier'])
+    items['echelon'] = np.where(node_type == 'warehouse', 'warehouse',
+                                np.where(supplier.notna(), 'retailer', 'standalone'))
+    items['supplier'] = supplier.where(items['echelon'] == 'retailer')
+    variance = items['std_demand'].to_numpy(dtype=float) ** 2
+    holding = items['holding_cost_rate'].to_numpy(dtype=float) * items['unit_cost'].to_numpy(dtype=float)
+    z = service_level_z(items['service_level'])
+    lead = items['lead_time_days'].to_numpy(dtype=float)
+
+    # One group per (SKU, warehouse): the warehouse's own demand plus its retailers'
+    is_retailer = (items['echelon'] == 'retailer').to_numpy()
+    is_warehouse = (items['echelon'] == 'warehouse').to_numpy()
+    group_warehouse = np.where(is_retailer, items['supplier'].fillna('').to_numpy(dtype=object),
+                               items['location'].to_numpy(dtype=object))
+    grouped = is_retailer | is_warehouse
+    group_keys = pd.MultiIndex.from_arrays([items['product_id'][grouped].to_numpy(), group_warehouse[grouped]])
+    group_codes, groups = pd.factorize(group_keys)
+    item_group = np.full(len(items), -1)
+    item_group[grouped] = group_codes
+    num_groups = len(groups)
+
+    group_pairs = pd.DataFrame({'product': groups.get_level_values(0), 'location': groups.get_level_values(1)})
+    group_settings = resolve_item_settings(group_pairs, settings_rows, {'lead_time_days': lead_time_days})
+    warehouse_lead = group_settings['lead_time_days'].to_numpy(dtype=float)
+    warehouse_z = service_level_z(group_settings['service_level'])
+    warehouse_holding = (group_settings['holding_cost_rate'] * group_settings['unit_cost']).to_numpy(dtype=float)
+    own_variance = np.bincount(item_group[is_warehouse], weights=variance[is_warehouse], minlength=num_groups)
+    downstream_variance = np.bincount(item_group[is_retailer], weights=variance[is_retailer], minlength=num_groups)
+
+    # Safety stock of every node under every service time option, shape (groups or items, levels)
+    fractions = np.linspace(0.0, 1.0, levels)
+    service_time = warehouse_lead[:, None] * fractions[None, :]
+    warehouse_stock = warehouse_z[:, None] * np.sqrt(
+        own_variance[:, None] * warehouse_lead[:, None] + downstream_variance[:, None] * (warehouse_lead[:, None] - service_time))
+    item_service_time = np.zeros((len(items), levels))
+    item_service_time[grouped] = service_time[item_group[grouped]]
+    retailer_days = lead[:, None] + np.where(is_retailer[:, None], item_service_time, 0.0)
+    retailer_stock = np.where(is_warehouse[:, None], 0.0, z[:, None] * np.sqrt(variance)[:, None] * np.sqrt(retailer_days))
+    option_cost = warehouse_holding[:, None] * warehouse_stock
+    for level in range(levels):
+        option_cost[:, level] += np.bincount(item_group[is_retailer],
+                                             weights=(holding * retailer_stock[:, level])[is_retailer],
+                                             minlength=num_groups)
+    choice = np.argmin(option_cost, axis=1)
+    status = 'optimal'
+
+    # Capacities couple SKUs: one LP over the groups touching a capacitated node
+    capacity = {location: node['capacity'] for location, node in network.items() if node['capacity'] is not None}
+    if capacity and num_groups:
+        choice, status = _solve_capacitated(
+            items, is_retailer, item_group, groups, warehouse_stock, retailer_stock, option_cost, choice,
+            capacity, started + time_limit_seconds)
+
+    rows = np.arange(len(items))
+    item_level = np.zeros(len(items), dtype=np.int64)
+    item_level[grouped] = choice[item_group[grouped]]
+    items['service_time_days'] = item_service_time[rows, item_level]
+    safety_stock = retailer_stock[rows, item_level]
+    net_days = np.where(is_retailer, lead + items['service_time_days'], lead)
+    item_holding = holding.copy()
+    # A warehouse row carries its group's stock for own and downstream demand
+    warehouse_groups = item_group[is_warehouse]
+    safety_stock[is_warehouse] = warehouse_stock[warehouse_groups, item_level[is_warehouse]]
+    net_days[is_warehouse] = warehouse_lead[warehouse_groups] - items['service_time_days'].to_numpy()[is_warehouse]
+    item_holding[is_warehouse] = warehouse_holding[warehouse_groups]
+    items['net_replenishment_days'] = net_days
+    items['safety_stock'] = safety_stock
+    items['holding_cost'] = item_holding * safety_stock
+
+    # Warehouses with only downstream demand have no row of their own; report them per SKU as well
+    extra = np.setdiff1d(np.arange(num_groups), item_group[is_warehouse])
+    if len(extra):
+        extra_rows = pd.DataFrame({
+            'product_id': group_pairs['product'].to_numpy()[extra],
+            'name': None,
+            'location': group_pairs['location'].to_numpy()[extra],
+            'mean_demand': 0.0,
+            'std_demand': 0.0,
+            'lead_time_days': warehouse_lead[extra],
+            'service_level': group_settings['service_level'].to_numpy(dtype=float)[extra],
+            'unit_cost': group_settings['unit_cost'].to_numpy(dtype=float)[extra],
+            'holding_cost_rate': group_settings['holding_cost_rate'].to_numpy(dtype=float)[extra],
+            'echelon': 'warehouse',
+            'supplier': None,
+            'service_time_days': service_time[extra, choice[extra]],
+            'net_replenishment_days': warehouse_lead[extra] - service_time[extra, choice[extra]],
+            'safety_stock': warehouse_stock[extra, choice[extra]],
+            'holding_cost': warehouse_holding[extra] * warehouse_stock[extra, choice[extra]]
+        })
+        names = dict(zip(items['product_id'], items['name']))
+        extra_rows['name'] = extra_rows['product_id'].map(names)
+        items = pd.concat([items, extra_rows], ignore_index=True)
+
+    usage = items.groupby('location')['safety_stock'].sum()
+    nodes = []
+    for location, node in sorted(network.items()):
+        used = float(usage.get(location, 0.0))
+        nodes.append({
+            'location': location,
+            'type': node['type'],
+            'supplier': node['supplier'],
+            'capacity': node['capacity'],
+            'safety_stock': round(used, 2),
+            'overflow': round(max(used - node['capacity'], 0.0), 2) if node['capacity'] is not None else 0.0
+        })
+
+    baseline_cost = float(option_cost[:, 0].sum()) + float((holding * retailer_stock[:, 0])[~grouped].sum())
+    total_cost = float(items['holding_cost'].sum())
+    summary = {
+        'status': status,
+        'skus': int(items['product_id'].nunique()),
+        'nodes': len(nodes),
+        'service_time_levels': levels,
+        'total_safety_stock': round(float(items['safety_stock'].sum()), 2),
+        'holding_cost': round(total_cost, 2),
+        # Every warehouse quoting zero service time, i.e. each node stocking for its own lead time
+        'decoupled_holding_cost': round(baseline_cost, 2),
+        'total_overflow': round(sum(node['overflow'] for node in nodes), 2),
+        'seconds': round(time.time() - started, 3)
+    }
+    logger.info(f"Allocated safety stock for {summary['skus']} SKUs over {len(nodes)} nodes ({status}) "
+                f"in {summary['seconds']}s")
+    return items, nodes, summary
+
+
+def _solve_capacitated(items, is_retailer, item_group, groups, warehouse_stock, retailer_stock, option_cost,
+                       choice, capacity, deadline):
+    """
+    Re-choose service times of the groups touching capacitated nodes with one LP.
+
+    Variables are the weights of each group's service time options (summing
+    to 1) plus a penalized overflow per capacitated node. A basic optimal
+    solution has at most one fractional group per binding capacity, so each
+    group takes its largest weight. Falls back to the uncapacitated choice
+    when the deadline passes; returns (choice, status).
+    """
+    num_groups, levels = option_cost.shape
+    group_warehouses = groups.get_level_values(1).to_numpy(dtype=object)
+    locations = items['location'].to_numpy(dtype=object)
+
+    # Groups touching no capacitated node keep their closed-form choice
+    touches = np.isin(group_warehouses, list(capacity))
+    retailer_capacitated = is_retailer & np.isin(locations, list(capacity))
+    touches[np.unique(item_group[retailer_capacitated])] = True
+    lp_groups = np.flatnonzero(touches)
+    fixed = ~touches
+
+    solver = pywraplp.Solver.CreateSolver('GLOP')
+    if solver is None:
+        logger.warning("GLOP solver unavailable, ignoring node capacities")
+        return choice, 'capacity_ignored'
+
+    penalty = MULTI_ECHELON_CONFIG['overflow_penalty'] * max(float(option_cost.max(initial=0.0)), 1.0)
+    weights = {}
+    objective = solver.Objective()
+    for group in lp_groups:
+        row = []
+        for level in range(levels):
+            variable = solver.NumVar(0.0, 1.0, '')
+            objective.SetCoefficient(variable, float(option_cost[group, level]))
+            row.append(variable)
+        total = solver.Constraint(1.0, 1.0)
+        for variable in row:
+            total.SetCoefficient(variable, 1.0)
+        weights[group] = row
+        if time.time() > deadline:
+            logger.warning("Multi-echelon time budget spent while building the LP, ignoring capacities")
+            return choice, 'time_limit'
+
+    # Capacity rows: fixed groups and standalone items count as constants
+    for location, limit in capacity.items():
+        overflow = solver.NumVar(0.0, solver.infinity(), '')
+        objective.SetCoefficient(overflow, penalty)
+        used = 0.0
+        constraint = solver.Constraint(-solver.infinity(), 0.0)
+        constraint.SetCoefficient(overflow, -1.0)
+        for group in np.flatnonzero(group_warehouses == location):
+            if fixed[group]:
+                used += warehouse_stock[group, choice[group]]
+            else:
+                for level, variable in enumerate(weights[group]):
+                    constraint.SetCoefficient(variable, float(warehouse_stock[group, level]))
+        at_location = np.flatnonzero((locations == location) & (item_group >= 0) & is_retailer)
+        coefficients = {}
+        for item in at_location:
+            group = item_group[item]
+            if fixed[group]:
+                used += retailer_stock[item, choice[group]]
+            else:
+                coefficients.setdefault(group, np.zeros(levels))
+                coefficients[group] += retailer_stock[item]
+        for group, values in coefficients.items():
+            for level, variable in enumerate(weights[group]):
+                # Warehouse and retailer coefficients of one group never share a location
+                constraint.SetCoefficient(variable, float(values[level]))
+        standalone = (locations == location) & (item_group < 0)
+        used += float(retailer_stock[standalone, 0].sum())
+        constraint.SetUb(float(limit - used))
+
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        logger.warning("Multi-echelon time budget spent while building the LP, ignoring capacities")
+        return choice, 'time_limit'
+    solver.SetTimeLimit(int(remaining * 1000))
+    result = solver.Solve()
+    if result not in (pywraplp.Solver.OPTIMAL, pywraplp.Solver.FEASIBLE):
+        logger.warning(f"Multi-echelon LP ended with status {result}, ignoring capacities")
+        return choice, 'time_limit' if result == pywraplp.Solver.NOT_SOLVED else 'capacity_ignored'
+
+    choice = choice.copy()
+    for group, row in weights.items():
+        choice[group] = int(np.argmax([variable.solution_value() for variable in row]))
+    return choice, 'optimal' if result == pywraplp.Solver.OPTIMAL else 'feasible'
@@ -0,0 +1,239 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Worker pool configuration for background route optimizations
+ROUTE_JOB_CONFIG = {
+    'max_workers': int(os.getenv('ROUTE_OPTIMIZATION_WORKERS', 2)),
+    'job_ttl_seconds': int(os.getenv('ROUTE_JOB_TTL_SECONDS', 3600)),
+    'heartbeat_seconds': int(os.getenv('ROUTE_JOB_HEARTBEAT_SECONDS', 15))
+}
+
+# Terminal job states; no further events are published after one of these
+FINISHED_STATES = ('completed', 'failed', 'cancelled')
+
+
+class JobCancelled(Exception):
+    """Raised inside a running optimization when its job has been cancelled."""
+
+
+class Deadline:
+    """
+    Stand-in for a cancel event that becomes set once a wall-clock deadline passes.
+
+    Unlike threading.Event it can be pickled, so it also works in worker processes.
+    """
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+
+    def is_set(self):
+        return time.time() >= self.deadline
+
+
+class OptimizationJob:
+    """State, result and event log of a single background optimization."""
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.events = []
+        self._condition = threading.Condition()
+
+    def publish(self, event_type, data):
+        """Append an event to the job log and wake up any listeners."""
+        with self._condition:
+            self.events.append({
+                'id': len(self.events) + 1,
+                'event': event_type,
+                'data': data
+            })
+            self._condition.notify_all()
+
+    def report_progress(self, progress):
+        """Progress callback handed to the optimizer."""
+        self.publish('progress', progress)
+
+    def finish(self, status, result=None, error=None):
+        """Move the job to a terminal state and publish the final event."""
+        with self._condition:
+            if self.is_finished():
+                return
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+            self.publish(status, self.to_dict(include_result=False))
+
+    def is_finished(self):
+        return self.status in FINISHED_STATES
+
+    def start(self):
+        """Move a queued job to running; False when it was cancelled or finished meanwhile."""
+        with self._condition:
+            if self.cancel_event.is_set() or self.status != 'queued':
+                return False
+            self.status = 'running'
+            self.publish('running', self.to_dict(include_result=False))
+            return True
+
+    def request_cancel(self):
+        """Signal cancellation; a job that has not started yet is finished right away."""
+        with self._condition:
+            if self.is_finished():
+                return
+            self.cancel_event.set()
+            if self.status == 'queued':
+                self.finish('cancelled')
+
+    def wait_for_events(self, after_id, timeout):
+        """Return events with an id greater than after_id, blocking up to timeout seconds."""
+        with self._condition:
+            if len(self.events) <= after_id and not self.is_finished():
+                self._condition.wait(timeout)
+            return self.events[after_id:]
+
+    def to_dict(self, include_result=True):
+        job = {
+            'job_id': self.id,
+            'status': self.status,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'error': self.error,
+            'progress': next(
+                (e['data'] for e in reversed(self.events) if e['event'] == 'progress'),
+                None)
+        }
+        if include_result:
+            job['result'] = self.result
+        return job
+
+
+class JobManager:
+    """
+    Runs optimization jobs on a worker pool and keeps them around for polling.
+
+    Jobs live in this process only: status, SSE and cancel requests must reach
+    the process that queued the job. Serve the app from a single worker
+    process (threads are fine, e.g. gunicorn -w 1 --threads 8) or route a
+    job's requests back to the same worker (sticky sessions).
+    """
+
+    def __init__(self, max_workers, job_ttl_seconds):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='route-opt')
+        self.job_ttl_seconds = job_ttl_seconds
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue func(*args, progress_callback=..., cancel_event=..., **kwargs).
+
+        func must return a (payload, status_code) tuple; a status code of 400
+        or above marks the job as failed with payload['error'] as the message.
+        """
+        self._prune()
+        job = OptimizationJob(str(uuid.uuid4()))
+        with self._lock:
+            self.jobs[job.id] = job
+        job.publish('queued', job.to_dict(include_result=False))
+        self.executor.submit(self._run, job, func, args, kwargs)
+        logger.info(f"Queued route optimization job {job.id}")
+        return job
+
+    def add_completed(self, result):
+        """Register a job that is already completed with result (e.g. served from a cache)."""
+        self._prune()
+        job = OptimizationJob(str(uuid.uuid4()))
+        with self._lock:
+            self.jobs[job.id] = job
+        job.publish('queued', job.to_dict(include_result=False))
+        job.finish('completed', result=result)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Request cancellation; returns the job or None if unknown."""
+        job = self.get(job_id)
+        if job and not job.is_finished():
+            job.request_cancel()
+            logger.info(f"Cancellation requested for route optimization job {job_id}")
+        return job
+
+    def stats(self):
+        """Number of tracked jobs per status."""
+        with self._lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return counts
+
+    def _run(self, job, func, args, kwargs):
+        # Checked and switched under the job lock, so a concurrent cancel either
+        # finishes the queued job first or is seen by the running optimizer
+        if not job.start():
+            return
+        try:
+            payload, status_code = func(
+                *args,
+                progress_callback=job.report_progress,
+                cancel_event=job.cancel_event,
+                **kwargs)
+            if status_code >= 400:
+                job.finish('failed', error=payload.get('error'))
+            else:
+                job.finish('completed', result=payload)
+        except JobCancelled:
+            job.finish('cancelled')
+        except Exception as e:
+            logger.error(f"Route optimization job {job.id} failed: {str(e)}")
+            job.finish('failed', error=str(e))
+
+    def _prune(self):
+        """Drop finished jobs older than the configured TTL."""
+        cutoff = time.time() - self.job_ttl_seconds
+        with self._lock:
+            expired = [job_id for job_id, job in self.jobs.items()
+                       if job.finished_at and job.finished_at < cutoff]
+            for job_id in expired:
+                del self.jobs[job_id]
+
+
+def format_sse(event):
+    """Serialize a job event as a Server-Sent Events frame."""
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+def stream_job_events(job, last_event_id=0, heartbeat_seconds=None):
+    """Yield SSE frames for a job until it reaches a terminal state."""
+    heartbeat_seconds = heartbeat_seconds or ROUTE_JOB_CONFIG['heartbeat_seconds']
+    sent = last_event_id
+    while True:
+        events = job.wait_for_events(sent, heartbeat_seconds)
+        for event in events:
+            sent = event['id']
+            yield format_sse(event)
+        if job.is_finished() and sent >= len(job.events):
+            break
+        if not events:
+            # Comment frame keeps proxies from closing an idle connection
+            yield ': keep-alive\n\n'
+
+
+job_manager = JobManager(
+    ROUTE_JOB_CONFIG['max_workers'], ROUTE_JOB_CONFIG['job_ttl_seconds'])